@@ -1,27 +1,291 @@
+import itertools
 import random
+import re
+from array import array
+
+
+# Grammar IR shared by Lab_1, Lab_2 and Lab_5. The labs run standalone, so each keeps a
+# copy; the three copies are identical, from here down to the end of parse_grammar.
+class SymbolTable:
+    # Grammar symbols interned to dense ids, so per-symbol data can live in lists
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.terminal = bytearray()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name, terminal=False):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.terminal.append(terminal)
+        return symbol
+
+    def copy(self):
+        table = SymbolTable()
+        table.ids = dict(self.ids)
+        table.names = list(self.names)
+        table.terminal = bytearray(self.terminal)
+        return table
 
 
 class Grammar:
-    def __init__(self, non_terminals, terminals, productions):
+    # productions is the {non-terminal: [production]} view the grammar was built from.
+    # Everything else works on the interned form: rule r is rule_lhs[r] -> rule_rhs[r]
+    # (a tuple of symbol ids), rules_for[A] lists the rules of A and uses[X] lists the
+    # rules with X on their right-hand side. Productions are strings split by longest
+    # match against the declared symbol names (so 'aN_q1' is 'a', 'N_q1'), or tuples of names.
+    # A removed rule leaves None in rule_rhs, so rule ids stay stable.
+    def __init__(self, non_terminals, terminals, productions, start='S'):
         self.non_terminals = non_terminals
         self.terminals = terminals
         self.productions = productions
+        self.start = start
+        self.symbols = SymbolTable()
+        self.rule_lhs = array('i')
+        self.rule_rhs = []
+        self.rules_for = []
+        self.uses = []
 
+        for non_terminal in productions:
+            self.intern(non_terminal)
+        for non_terminal in sorted(set(non_terminals).difference(productions)):
+            self.intern(non_terminal)
+        for terminal in sorted(terminals):
+            self.intern(terminal, True)
+        self.build_pattern()
+        for non_terminal, alternatives in productions.items():
+            lhs = self.symbols.ids[non_terminal]
+            for production in alternatives:
+                self.add_rule(lhs, self.split(production))
 
-def generate_strings(grammar, num_strings):
-    valid_strings = []
-    for _ in range(num_strings):
-        valid_strings.append(generate_string(grammar, 'S'))
-    return valid_strings
+    def build_pattern(self):
+        names = sorted(self.symbols.names, key=len, reverse=True)
+        self.symbol_pattern = re.compile('|'.join(map(re.escape, names)) + '|.' if names else '.', re.DOTALL)
 
-
-def generate_string(grammar, symbol):
-    if symbol in grammar.terminals:
+    def intern(self, name, terminal=False):
+        symbol = self.symbols.intern(name, terminal)
+        if symbol == len(self.rules_for):
+            self.rules_for.append([])
+            self.uses.append([])
         return symbol
-    else:
-        production = random.choice(grammar.productions[symbol])
-        generated_string = ''.join(generate_string(grammar, s) for s in production)
-        return generated_string
+
+    def split(self, production):
+        # Symbols that were not declared are terminals until add_production gives them a rule
+        if isinstance(production, str):
+            if production == 'ε':
+                return ()
+            production = self.symbol_pattern.findall(production)
+        ids = self.symbols.ids
+        return tuple(ids[name] if name in ids else self.intern(name, True) for name in production)
+
+    def add_rule(self, lhs, rhs):
+        rule = len(self.rule_rhs)
+        self.rule_lhs.append(lhs)
+        self.rule_rhs.append(rhs)
+        self.rules_for[lhs].append(rule)
+        for symbol in set(rhs):
+            self.uses[symbol].append(rule)
+        return rule
+
+    def add_production(self, non_terminal, production):
+        lhs = self.symbols.ids.get(non_terminal)
+        if lhs is None:
+            lhs = self.intern(non_terminal)
+            self.non_terminals.add(non_terminal)
+            if len(non_terminal) > 1:
+                self.build_pattern()
+        elif self.symbols.terminal[lhs]:
+            if non_terminal in self.terminals:
+                raise ValueError(f"Cannot add a production to terminal {non_terminal}")
+            # It was only seen on right-hand sides so far
+            self.symbols.terminal[lhs] = False
+            self.non_terminals.add(non_terminal)
+        rule = self.add_rule(lhs, self.split(production))
+        self.productions.setdefault(non_terminal, []).append(production)
+        return rule
+
+    def remove_production(self, non_terminal, production):
+        lhs = self.symbols.ids.get(non_terminal)
+        rhs = self.split(production)
+        rules = self.rules_for[lhs] if lhs is not None else ()
+        for rule in rules:
+            if self.rule_rhs[rule] == rhs:
+                break
+        else:
+            raise ValueError(f"No production {non_terminal} -> {production}")
+        rules.remove(rule)
+        for symbol in set(rhs):
+            self.uses[symbol].remove(rule)
+        self.rule_rhs[rule] = None
+        alternatives = self.productions[non_terminal]
+        for i, alternative in enumerate(alternatives):
+            if self.split(alternative) == rhs:
+                del alternatives[i]
+                break
+        return rule
+
+    def production_string(self, rule):
+        rhs = self.rule_rhs[rule]
+        return ''.join(self.symbols.names[symbol] for symbol in rhs) if rhs else 'ε'
+
+    def __str__(self):
+        ids = self.symbols.ids
+        productions_str = "\n".join([f"{non_terminal} -> {' | '.join(map(self.production_string, self.rules_for[ids[non_terminal]]))}" for non_terminal in self.productions])
+        return f"Non-terminals: {self.non_terminals}\nTerminals: {self.terminals}\nProductions:\n{productions_str}"
+
+    def classify_chomsky(self):
+        terminal = self.symbols.terminal
+        rules = [rhs for rhs in self.rule_rhs if rhs is not None]
+        # ε counts as a single symbol, as it did when productions were strings
+        lengths = [len(rhs) or 1 for rhs in rules]
+
+        # Check if the grammar is regular
+        regular = all(length <= 2 and (length == 1 or not terminal[rhs[0]])
+                      for length, rhs in zip(lengths, rules))
+
+        # Check if the grammar is context-free
+        context_free = all(length == 1 for length in lengths)
+
+        # Check if the grammar is context-sensitive
+        context_sensitive = not regular and not context_free
+
+        # If none of the above are True, the grammar is unrestricted
+        if not any([regular, context_free, context_sensitive]):
+            return "Type 0 : Unrestricted"
+        elif regular:
+            return "Type 3 : Regular"
+        elif context_free:
+            return "Type 2 : Context-Free"
+        elif context_sensitive:
+            return "Type 1 : Context-Sensitive"
+
+
+def parse_grammar(grammar_str):
+    # 'S:aB, B:bB, ...'; the first left-hand side is the start symbol, and upper-case
+    # symbols are non-terminals even without rules of their own. Non-terminal names may be
+    # longer than one character; right-hand sides are split by Grammar.
+    productions = {}
+    for production in grammar_str.split(','):
+        left, right = production.strip().split(':')
+        productions.setdefault(left.strip(), []).append(right.strip())
+    grammar = Grammar(set(productions), set(), productions, next(iter(productions)))
+    symbols = grammar.symbols
+    for symbol, name in enumerate(symbols.names):
+        if not symbols.terminal[symbol]:
+            continue
+        if name.isupper():
+            symbols.terminal[symbol] = False
+            grammar.non_terminals.add(name)
+        else:
+            grammar.terminals.add(name)
+    return grammar
+
+
+def generate_strings(grammar, num_strings, rng=None, max_depth=None, lazy=False):
+    strings = iter_strings(grammar, num_strings, rng, max_depth)
+    if lazy:
+        return strings
+    return list(strings)
+
+
+def iter_strings(grammar, num_strings=None, rng=None, max_depth=None, start_symbol=None):
+    # num_strings=None streams forever
+    generator = StringGenerator(grammar, rng, max_depth)
+    counter = itertools.count() if num_strings is None else range(num_strings)
+    for _ in counter:
+        yield generator.generate(start_symbol)
+
+
+def generate_string(grammar, symbol, rng=None, max_depth=None):
+    return StringGenerator(grammar, rng, max_depth).generate(symbol)
+
+
+class StringGenerator:
+    def __init__(self, grammar, rng=None, max_depth=None):
+        if rng is None:
+            rng = random
+        elif not isinstance(rng, random.Random):
+            rng = random.Random(rng)
+        self.rng = rng
+        self.max_depth = max_depth
+        self.start = grammar.start
+        self.ids = grammar.symbols.ids
+        self.names = grammar.symbols.names
+        self.terminal = grammar.symbols.terminal
+
+        # Right-hand sides are stored reversed per symbol id, ready to be pushed on the stack
+        self.productions = [[grammar.rule_rhs[rule][::-1] for rule in rules] for rules in grammar.rules_for]
+        self.escape = self.shortest_productions()
+        # escape only has the non-terminals that derive some string; a production through
+        # any other one (such as an upper-case symbol without rules) could never finish
+        self.productions = [[production for production in productions
+                             if all(self.terminal[symbol] or symbol in self.escape for symbol in production)]
+                            for productions in self.productions]
+
+    def shortest_productions(self):
+        # For each non-terminal, the production with the lowest derivation height.
+        # Used once max_depth is reached so that every derivation terminates.
+        terminal = self.terminal
+        heights = {}
+        escape = {}
+        changed = True
+        while changed:
+            changed = False
+            for non_terminal, productions in enumerate(self.productions):
+                for production in productions:
+                    height = 1
+                    for symbol in production:
+                        if not terminal[symbol]:
+                            if symbol not in heights:
+                                break
+                            height = max(height, heights[symbol] + 1)
+                    else:
+                        if height < heights.get(non_terminal, height + 1):
+                            heights[non_terminal] = height
+                            escape[non_terminal] = production
+                            changed = True
+        return escape
+
+    def generate(self, symbol=None):
+        terminal = self.terminal
+        names = self.names
+        productions = self.productions
+        escape = self.escape
+        choice = self.rng.choice
+        max_depth = self.max_depth
+        if symbol is None:
+            symbol = self.start
+        if not terminal[self.ids[symbol]] and self.ids[symbol] not in escape:
+            raise ValueError(f"{symbol} derives no string")
+        result = []
+        if max_depth is None:
+            stack = [self.ids[symbol]]
+            while stack:
+                symbol = stack.pop()
+                if terminal[symbol]:
+                    result.append(names[symbol])
+                else:
+                    stack.extend(choice(productions[symbol]))
+            return ''.join(result)
+
+        stack = [(self.ids[symbol], 0)]
+        while stack:
+            symbol, depth = stack.pop()
+            if terminal[symbol]:
+                result.append(names[symbol])
+                continue
+            if depth >= max_depth and symbol in escape:
+                production = escape[symbol]
+            else:
+                production = choice(productions[symbol])
+            depth += 1
+            for next_symbol in production:
+                stack.append((next_symbol, depth))
+        return ''.join(result)
 
 
 class FiniteAutomaton:
@@ -31,19 +295,26 @@ class FiniteAutomaton:
         self.transitions = {}
         self.initial_state = None
         self.accepting_states = set()
+        # Table built by the first check_many, reused until the automaton is rebuilt
+        self._compiled = None
 
     def convert_from_grammar(self, grammar):
+        self._compiled = None
         for non_terminal in grammar.non_terminals:
             self.states.add(non_terminal)
         for terminal in grammar.terminals:
             self.alphabet.add(terminal)
 
-        for non_terminal, productions in grammar.productions.items():
-            for production in productions:
-                if len(production) == 1:  # Singleton production
-                    self.transitions.setdefault(non_terminal, {}).setdefault(production, 'ε')
-                else:
-                    self.transitions.setdefault(non_terminal, {}).setdefault(production[0], production[1])
+        names = grammar.symbols.names
+        for lhs, rhs in zip(grammar.rule_lhs, grammar.rule_rhs):
+            if rhs is None:
+                continue
+            non_terminal = names[lhs]
+            if len(rhs) <= 1:  # Singleton production
+                production = names[rhs[0]] if rhs else 'ε'
+                self.transitions.setdefault(non_terminal, {}).setdefault(production, 'ε')
+            else:
+                self.transitions.setdefault(non_terminal, {}).setdefault(names[rhs[0]], names[rhs[1]])
 
         self.initial_state = 'S'
         self.accepting_states = grammar.terminals
@@ -62,6 +333,77 @@ class FiniteAutomaton:
                 return False
         return current_state in self.accepting_states
 
+    def compile(self):
+        return CompiledAutomaton(self)
+
+    def check_many(self, input_strings):
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled.check_many(input_strings)
+
+
+class CompiledAutomaton:
+    # State 0 is the dead state, column 0 is "any symbol outside the alphabet".
+    # States are stored premultiplied by the row width, so a step is table[state + symbol].
+    def __init__(self, fa):
+        state_ids = {}
+        symbol_ids = {}
+        for state, transitions in fa.transitions.items():
+            state_ids.setdefault(state, len(state_ids) + 1)
+            for symbol, next_state in transitions.items():
+                if isinstance(next_state, set):
+                    raise ValueError(f"Cannot compile non-deterministic transition: {state} -- {symbol}")
+                symbol_ids.setdefault(symbol, len(symbol_ids) + 1)
+                if next_state is not None:
+                    state_ids.setdefault(next_state, len(state_ids) + 1)
+        state_ids.setdefault(fa.initial_state, len(state_ids) + 1)
+
+        self.state_ids = state_ids
+        self.symbol_ids = symbol_ids
+        self.width = width = len(symbol_ids) + 1
+        self.table = array('i', bytes(4 * width * (len(state_ids) + 1)))
+        for state, transitions in fa.transitions.items():
+            row = state_ids[state] * width
+            for symbol, next_state in transitions.items():
+                if next_state is not None:
+                    self.table[row + symbol_ids[symbol]] = state_ids[next_state] * width
+
+        self.accepting = bytearray(width * (len(state_ids) + 1))
+        for state, state_id in state_ids.items():
+            if state in fa.accepting_states:
+                self.accepting[state_id * width] = 1
+        self.start = state_ids[fa.initial_state] * width
+
+        # Single-character symbols can be mapped to byte codes in one str.translate call
+        self.byte_codes = None
+        if width < 256 and all(isinstance(s, str) and len(s) == 1 for s in symbol_ids):
+            self.byte_codes = _ByteCodes({ord(s): chr(i) for s, i in symbol_ids.items()})
+
+    def check_string(self, input_string):
+        table = self.table
+        state = self.start
+        if self.byte_codes is not None and isinstance(input_string, str):
+            for code in input_string.translate(self.byte_codes).encode('latin-1'):
+                state = table[state + code]
+                if not state:
+                    return False
+        else:
+            symbol_ids = self.symbol_ids
+            for symbol in input_string:
+                state = table[state + symbol_ids.get(symbol, 0)]
+                if not state:
+                    return False
+        return self.accepting[state] == 1
+
+    def check_many(self, input_strings):
+        check_string = self.check_string
+        return [check_string(s) for s in input_strings]
+
+
+class _ByteCodes(dict):
+    def __missing__(self, key):
+        return '\x00'
+
 
 if __name__ == "__main__":
     # Grammar definition
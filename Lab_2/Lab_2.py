@@ -1,23 +1,165 @@
+import argparse
+import codecs
+import concurrent.futures
+import itertools
+import mmap
+import os
 import random
+import re
+import struct
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from artifact_cache import ArtifactCache, grammar_key
+
+
+# Grammar IR shared by Lab_1, Lab_2 and Lab_5. The labs run standalone, so each keeps a
+# copy; the three copies are identical, from here down to the end of parse_grammar.
+class SymbolTable:
+    # Grammar symbols interned to dense ids, so per-symbol data can live in lists
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.terminal = bytearray()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name, terminal=False):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.terminal.append(terminal)
+        return symbol
+
+    def copy(self):
+        table = SymbolTable()
+        table.ids = dict(self.ids)
+        table.names = list(self.names)
+        table.terminal = bytearray(self.terminal)
+        return table
 
 
 class Grammar:
-    def __init__(self, non_terminals, terminals, productions):
+    # productions is the {non-terminal: [production]} view the grammar was built from.
+    # Everything else works on the interned form: rule r is rule_lhs[r] -> rule_rhs[r]
+    # (a tuple of symbol ids), rules_for[A] lists the rules of A and uses[X] lists the
+    # rules with X on their right-hand side. Productions are strings split by longest
+    # match against the declared symbol names (so 'aN_q1' is 'a', 'N_q1'), or tuples of names.
+    # A removed rule leaves None in rule_rhs, so rule ids stay stable.
+    def __init__(self, non_terminals, terminals, productions, start='S'):
         self.non_terminals = non_terminals
         self.terminals = terminals
         self.productions = productions
+        self.start = start
+        self.symbols = SymbolTable()
+        self.rule_lhs = array('i')
+        self.rule_rhs = []
+        self.rules_for = []
+        self.uses = []
+
+        for non_terminal in productions:
+            self.intern(non_terminal)
+        for non_terminal in sorted(set(non_terminals).difference(productions)):
+            self.intern(non_terminal)
+        for terminal in sorted(terminals):
+            self.intern(terminal, True)
+        self.build_pattern()
+        for non_terminal, alternatives in productions.items():
+            lhs = self.symbols.ids[non_terminal]
+            for production in alternatives:
+                self.add_rule(lhs, self.split(production))
+
+    def build_pattern(self):
+        names = sorted(self.symbols.names, key=len, reverse=True)
+        self.symbol_pattern = re.compile('|'.join(map(re.escape, names)) + '|.' if names else '.', re.DOTALL)
+
+    def intern(self, name, terminal=False):
+        symbol = self.symbols.intern(name, terminal)
+        if symbol == len(self.rules_for):
+            self.rules_for.append([])
+            self.uses.append([])
+        return symbol
+
+    def split(self, production):
+        # Symbols that were not declared are terminals until add_production gives them a rule
+        if isinstance(production, str):
+            if production == 'ε':
+                return ()
+            production = self.symbol_pattern.findall(production)
+        ids = self.symbols.ids
+        return tuple(ids[name] if name in ids else self.intern(name, True) for name in production)
+
+    def add_rule(self, lhs, rhs):
+        rule = len(self.rule_rhs)
+        self.rule_lhs.append(lhs)
+        self.rule_rhs.append(rhs)
+        self.rules_for[lhs].append(rule)
+        for symbol in set(rhs):
+            self.uses[symbol].append(rule)
+        return rule
+
+    def add_production(self, non_terminal, production):
+        lhs = self.symbols.ids.get(non_terminal)
+        if lhs is None:
+            lhs = self.intern(non_terminal)
+            self.non_terminals.add(non_terminal)
+            if len(non_terminal) > 1:
+                self.build_pattern()
+        elif self.symbols.terminal[lhs]:
+            if non_terminal in self.terminals:
+                raise ValueError(f"Cannot add a production to terminal {non_terminal}")
+            # It was only seen on right-hand sides so far
+            self.symbols.terminal[lhs] = False
+            self.non_terminals.add(non_terminal)
+        rule = self.add_rule(lhs, self.split(production))
+        self.productions.setdefault(non_terminal, []).append(production)
+        return rule
+
+    def remove_production(self, non_terminal, production):
+        lhs = self.symbols.ids.get(non_terminal)
+        rhs = self.split(production)
+        rules = self.rules_for[lhs] if lhs is not None else ()
+        for rule in rules:
+            if self.rule_rhs[rule] == rhs:
+                break
+        else:
+            raise ValueError(f"No production {non_terminal} -> {production}")
+        rules.remove(rule)
+        for symbol in set(rhs):
+            self.uses[symbol].remove(rule)
+        self.rule_rhs[rule] = None
+        alternatives = self.productions[non_terminal]
+        for i, alternative in enumerate(alternatives):
+            if self.split(alternative) == rhs:
+                del alternatives[i]
+                break
+        return rule
+
+    def production_string(self, rule):
+        rhs = self.rule_rhs[rule]
+        return ''.join(self.symbols.names[symbol] for symbol in rhs) if rhs else 'ε'
 
     def __str__(self):
-        productions_str = "\n".join([f"{non_terminal} -> {' | '.join(productions)}" for non_terminal, productions in self.productions.items()])
+        ids = self.symbols.ids
+        productions_str = "\n".join([f"{non_terminal} -> {' | '.join(map(self.production_string, self.rules_for[ids[non_terminal]]))}" for non_terminal in self.productions])
         return f"Non-terminals: {self.non_terminals}\nTerminals: {self.terminals}\nProductions:\n{productions_str}"
 
     def classify_chomsky(self):
+        terminal = self.symbols.terminal
+        rules = [rhs for rhs in self.rule_rhs if rhs is not None]
+        # ε counts as a single symbol, as it did when productions were strings
+        lengths = [len(rhs) or 1 for rhs in rules]
+
         # Check if the grammar is regular
-        regular = all(len(production) <= 2 and (len(production) == 1 or production[0] in self.non_terminals)
-                      for productions in self.productions.values() for production in productions)
+        regular = all(length <= 2 and (length == 1 or not terminal[rhs[0]])
+                      for length, rhs in zip(lengths, rules))
 
         # Check if the grammar is context-free
-        context_free = all(len(production) == 1 for productions in self.productions.values() for production in productions)
+        context_free = all(length == 1 for length in lengths)
 
         # Check if the grammar is context-sensitive
         context_sensitive = not regular and not context_free
@@ -33,20 +175,449 @@ class Grammar:
             return "Type 1 : Context-Sensitive"
 
 
-def generate_strings(grammar, num_strings):
-    valid_strings = []
-    for _ in range(num_strings):
-        valid_strings.append(generate_string(grammar, 'S'))
-    return valid_strings
+def parse_grammar(grammar_str):
+    # 'S:aB, B:bB, ...'; the first left-hand side is the start symbol, and upper-case
+    # symbols are non-terminals even without rules of their own. Non-terminal names may be
+    # longer than one character; right-hand sides are split by Grammar.
+    productions = {}
+    for production in grammar_str.split(','):
+        left, right = production.strip().split(':')
+        productions.setdefault(left.strip(), []).append(right.strip())
+    grammar = Grammar(set(productions), set(), productions, next(iter(productions)))
+    symbols = grammar.symbols
+    for symbol, name in enumerate(symbols.names):
+        if not symbols.terminal[symbol]:
+            continue
+        if name.isupper():
+            symbols.terminal[symbol] = False
+            grammar.non_terminals.add(name)
+        else:
+            grammar.terminals.add(name)
+    return grammar
 
 
-def generate_string(grammar, symbol):
-    if symbol in grammar.terminals:
-        return symbol
-    else:
-        production = random.choice(grammar.productions[symbol])
-        generated_string = ''.join(generate_string(grammar, s) for s in production)
-        return generated_string
+END_MARKER = '$'
+
+
+class GrammarAnalysis:
+    # Nullable, productive and reachable symbols are int bitsets over symbol ids. first[X]
+    # and follow[X] are bitsets over terminals, with terminal t at bit t + 1 and bit 0 for
+    # the end of input. Every set is a least fixed point reached with a worklist, so
+    # add_production / remove_production only revisit rules that can be affected: an
+    # addition resumes the worklists from the new rule, a removal first clears every
+    # symbol whose value may have depended on the removed rule and re-derives those.
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.recompute()
+
+    def recompute(self):
+        self.rule_masks = []
+        self.first = []
+        self.follow = []
+        self.nullable = 0
+        self.productive = 0
+        self.reachable = 0
+        self.sync()
+        rules = [rule for rule, rhs in enumerate(self.grammar.rule_rhs) if rhs is not None]
+        self.nullable = self.close(0, rules)
+        self.productive = self.close(self.productive, rules)
+        start = self.start_symbol()
+        if start is not None:
+            self.reachable = self.reach(1 << start, self.grammar.rules_for[start])
+            self.follow[start] = 1
+        self.update_first(rules)
+        self.update_follow(rules)
+
+    def sync(self):
+        # Picks up symbols and rules added to the grammar since the last update
+        grammar = self.grammar
+        terminal = grammar.symbols.terminal
+        known = len(self.first)
+        for symbol in range(known, len(grammar.symbols)):
+            self.first.append(1 << symbol + 1 if terminal[symbol] else 0)
+            self.follow.append(0)
+            if terminal[symbol]:
+                self.productive |= 1 << symbol
+        # The start symbol may only now have been seen
+        start = self.start_symbol()
+        if start is not None and start >= known:
+            self.reachable |= 1 << start
+            self.follow[start] = 1
+        for rule in range(len(self.rule_masks), len(grammar.rule_rhs)):
+            mask = 0
+            for symbol in grammar.rule_rhs[rule] or ():
+                mask |= 1 << symbol
+            self.rule_masks.append(mask)
+
+    def start_symbol(self):
+        return self.grammar.symbols.ids.get(self.grammar.start)
+
+    def close(self, value, rules):
+        # Least fixed point of "the left-hand side holds once every symbol on the
+        # right-hand side holds", resumed from value with rules as the candidates
+        grammar = self.grammar
+        masks = self.rule_masks
+        work = list(rules)
+        while work:
+            rule = work.pop()
+            lhs = grammar.rule_lhs[rule]
+            if value >> lhs & 1 or grammar.rule_rhs[rule] is None or masks[rule] & ~value:
+                continue
+            value |= 1 << lhs
+            work.extend(grammar.uses[lhs])
+        return value
+
+    def reach(self, value, rules):
+        # rules must have reachable left-hand sides
+        grammar = self.grammar
+        masks = self.rule_masks
+        work = list(rules)
+        while work:
+            rule = work.pop()
+            if grammar.rule_rhs[rule] is None:
+                continue
+            new = masks[rule] & ~value
+            value |= new
+            for symbol in bits(new):
+                work.extend(grammar.rules_for[symbol])
+        return value
+
+    def update_first(self, rules):
+        grammar = self.grammar
+        first = self.first
+        nullable = self.nullable
+        changed = set()
+        work = list(rules)
+        while work:
+            rule = work.pop()
+            rhs = grammar.rule_rhs[rule]
+            if rhs is None:
+                continue
+            lhs = grammar.rule_lhs[rule]
+            added = 0
+            for symbol in rhs:
+                added |= first[symbol]
+                if not nullable >> symbol & 1:
+                    break
+            if added & ~first[lhs]:
+                first[lhs] |= added
+                changed.add(lhs)
+                work.extend(grammar.uses[lhs])
+        return changed
+
+    def update_follow(self, rules):
+        grammar = self.grammar
+        terminal = grammar.symbols.terminal
+        first = self.first
+        follow = self.follow
+        nullable = self.nullable
+        work = list(rules)
+        while work:
+            rule = work.pop()
+            rhs = grammar.rule_rhs[rule]
+            if rhs is None:
+                continue
+            trailer = follow[grammar.rule_lhs[rule]]
+            for symbol in reversed(rhs):
+                if not terminal[symbol] and trailer & ~follow[symbol]:
+                    follow[symbol] |= trailer
+                    work.extend(grammar.rules_for[symbol])
+                if nullable >> symbol & 1:
+                    trailer |= first[symbol]
+                else:
+                    trailer = first[symbol]
+
+    def rules_using(self, symbols):
+        uses = self.grammar.uses
+        return [rule for symbol in symbols for rule in uses[symbol]]
+
+    def rules_of(self, symbols):
+        rules_for = self.grammar.rules_for
+        return [rule for symbol in symbols for rule in rules_for[symbol]]
+
+    def upward(self, symbols, within):
+        # symbols plus every left-hand side that (transitively) uses one of them, inside within
+        grammar = self.grammar
+        closure = 0
+        for symbol in symbols:
+            closure |= 1 << symbol
+        stack = list(symbols)
+        while stack:
+            for rule in grammar.uses[stack.pop()]:
+                lhs = grammar.rule_lhs[rule]
+                if within >> lhs & 1 and not closure >> lhs & 1:
+                    closure |= 1 << lhs
+                    stack.append(lhs)
+        return closure
+
+    def downward(self, closure):
+        # closure plus every symbol derivable from it
+        masks = self.rule_masks
+        stack = list(bits(closure))
+        while stack:
+            for rule in self.grammar.rules_for[stack.pop()]:
+                new = masks[rule] & ~closure
+                closure |= new
+                stack.extend(bits(new))
+        return closure
+
+    def tails(self, closure):
+        # closure plus every non-terminal that inherits FOLLOW from it, i.e. ends one of
+        # its rules up to a nullable suffix
+        grammar = self.grammar
+        terminal = grammar.symbols.terminal
+        stack = list(bits(closure))
+        while stack:
+            for rule in grammar.rules_for[stack.pop()]:
+                for symbol in reversed(grammar.rule_rhs[rule]):
+                    if terminal[symbol]:
+                        break
+                    if not closure >> symbol & 1:
+                        closure |= 1 << symbol
+                        stack.append(symbol)
+                    if not self.nullable >> symbol & 1:
+                        break
+        return closure
+
+    def add_production(self, non_terminal, production):
+        grammar = self.grammar
+        symbol = grammar.symbols.ids.get(non_terminal)
+        promoted = symbol is not None and grammar.symbols.terminal[symbol]
+        rule = grammar.add_production(non_terminal, production)
+        if promoted:
+            # A terminal turned non-terminal: its bit may be in any FIRST or FOLLOW set, and
+            # this happens once per symbol at most, so everything is derived again
+            self.recompute()
+            return rule
+        self.sync()
+        lhs = grammar.rule_lhs[rule]
+        old_nullable = self.nullable
+        self.nullable = self.close(self.nullable, [rule])
+        self.productive = self.close(self.productive, [rule])
+        if lhs == self.start_symbol():
+            self.reachable |= 1 << lhs
+            self.follow[lhs] |= 1
+        if self.reachable >> lhs & 1:
+            self.reachable = self.reach(self.reachable, [rule])
+
+        gained = list(bits(self.nullable & ~old_nullable))
+        first_changed = self.update_first([rule] + self.rules_using(gained))
+        self.update_follow([rule] + self.rules_using(gained) + self.rules_using(first_changed))
+        return rule
+
+    def remove_production(self, non_terminal, production):
+        grammar = self.grammar
+        rule = grammar.remove_production(non_terminal, production)
+        lhs = grammar.rule_lhs[rule]
+        non_terminals = self.non_terminal_mask()
+
+        old_nullable = self.nullable
+        self.nullable = self.rederive(self.nullable, lhs)
+        self.productive = self.rederive(self.productive, lhs)
+
+        start = self.start_symbol()
+        if self.reachable >> lhs & 1:
+            cleared = self.downward(self.rule_masks[rule]) & self.reachable
+            self.reachable &= ~cleared
+            seeds = [r for r in self.rules_using(bits(cleared)) if self.reachable >> grammar.rule_lhs[r] & 1]
+            if start is not None and cleared >> start & 1:
+                self.reachable |= 1 << start
+                seeds.extend(grammar.rules_for[start])
+            self.reachable = self.reach(self.reachable, seeds)
+
+        lost = list(bits(old_nullable & ~self.nullable))
+        cleared = self.upward([lhs] + lost, non_terminals)
+        previous = {symbol: self.first[symbol] for symbol in bits(cleared)}
+        for symbol in previous:
+            self.first[symbol] = 0
+        self.update_first(self.rules_of(previous))
+        first_changed = [symbol for symbol, value in previous.items() if self.first[symbol] != value]
+
+        cleared = self.rule_masks[rule]
+        for other in self.rules_using(first_changed + lost):
+            cleared |= self.rule_masks[other]
+        cleared = self.tails(cleared & non_terminals)
+        for symbol in bits(cleared):
+            self.follow[symbol] = 1 if symbol == start else 0
+        self.update_follow(self.rules_using(bits(cleared)))
+        return rule
+
+    def rederive(self, value, lhs):
+        # Clears lhs and everything built on it, then closes again from their rules
+        if not value >> lhs & 1:
+            return value
+        cleared = self.upward([lhs], value)
+        return self.close(value & ~cleared, self.rules_of(bits(cleared)))
+
+    def non_terminal_mask(self):
+        mask = 0
+        for symbol, terminal in enumerate(self.grammar.symbols.terminal):
+            if not terminal:
+                mask |= 1 << symbol
+        return mask
+
+    def symbol_names(self, mask):
+        names = self.grammar.symbols.names
+        return {names[symbol] for symbol in bits(mask & self.non_terminal_mask())}
+
+    def terminal_names(self, mask):
+        names = self.grammar.symbols.names
+        return {END_MARKER if bit == 0 else names[bit - 1] for bit in bits(mask)}
+
+    def nullable_symbols(self):
+        return self.symbol_names(self.nullable)
+
+    def productive_symbols(self):
+        return self.symbol_names(self.productive)
+
+    def reachable_symbols(self):
+        return self.symbol_names(self.reachable)
+
+    def useless_symbols(self):
+        return self.symbol_names(~(self.productive & self.reachable))
+
+    def first_set(self, symbol):
+        return self.terminal_names(self.first[self.grammar.symbols.ids[symbol]])
+
+    def follow_set(self, symbol):
+        return self.terminal_names(self.follow[self.grammar.symbols.ids[symbol]])
+
+    def predict(self, rule):
+        # FIRST of the right-hand side, plus FOLLOW of the left-hand side when it is nullable
+        grammar = self.grammar
+        result = 0
+        for symbol in grammar.rule_rhs[rule]:
+            result |= self.first[symbol]
+            if not self.nullable >> symbol & 1:
+                return result
+        return result | self.follow[grammar.rule_lhs[rule]]
+
+    def ll1_conflicts(self):
+        # [(non-terminal, production, production, {terminals predicting both})]
+        grammar = self.grammar
+        names = grammar.symbols.names
+        conflicts = []
+        for lhs, rules in enumerate(grammar.rules_for):
+            predicted = [(rule, self.predict(rule)) for rule in rules]
+            for i, (rule, mask) in enumerate(predicted):
+                for other, other_mask in predicted[:i]:
+                    if mask & other_mask:
+                        conflicts.append((names[lhs], grammar.production_string(other),
+                                          grammar.production_string(rule), self.terminal_names(mask & other_mask)))
+        return conflicts
+
+    def is_ll1(self):
+        return not self.ll1_conflicts()
+
+
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def generate_strings(grammar, num_strings, rng=None, max_depth=None, lazy=False):
+    strings = iter_strings(grammar, num_strings, rng, max_depth)
+    if lazy:
+        return strings
+    return list(strings)
+
+
+def iter_strings(grammar, num_strings=None, rng=None, max_depth=None, start_symbol=None):
+    # num_strings=None streams forever
+    generator = StringGenerator(grammar, rng, max_depth)
+    counter = itertools.count() if num_strings is None else range(num_strings)
+    for _ in counter:
+        yield generator.generate(start_symbol)
+
+
+def generate_string(grammar, symbol, rng=None, max_depth=None):
+    return StringGenerator(grammar, rng, max_depth).generate(symbol)
+
+
+class StringGenerator:
+    def __init__(self, grammar, rng=None, max_depth=None):
+        if rng is None:
+            rng = random
+        elif not isinstance(rng, random.Random):
+            rng = random.Random(rng)
+        self.rng = rng
+        self.max_depth = max_depth
+        self.start = grammar.start
+        self.ids = grammar.symbols.ids
+        self.names = grammar.symbols.names
+        self.terminal = grammar.symbols.terminal
+
+        # Right-hand sides are stored reversed per symbol id, ready to be pushed on the stack
+        self.productions = [[grammar.rule_rhs[rule][::-1] for rule in rules] for rules in grammar.rules_for]
+        self.escape = self.shortest_productions()
+        # escape only has the non-terminals that derive some string; a production through
+        # any other one (such as an upper-case symbol without rules) could never finish
+        self.productions = [[production for production in productions
+                             if all(self.terminal[symbol] or symbol in self.escape for symbol in production)]
+                            for productions in self.productions]
+
+    def shortest_productions(self):
+        # For each non-terminal, the production with the lowest derivation height.
+        # Used once max_depth is reached so that every derivation terminates.
+        terminal = self.terminal
+        heights = {}
+        escape = {}
+        changed = True
+        while changed:
+            changed = False
+            for non_terminal, productions in enumerate(self.productions):
+                for production in productions:
+                    height = 1
+                    for symbol in production:
+                        if not terminal[symbol]:
+                            if symbol not in heights:
+                                break
+                            height = max(height, heights[symbol] + 1)
+                    else:
+                        if height < heights.get(non_terminal, height + 1):
+                            heights[non_terminal] = height
+                            escape[non_terminal] = production
+                            changed = True
+        return escape
+
+    def generate(self, symbol=None):
+        terminal = self.terminal
+        names = self.names
+        productions = self.productions
+        escape = self.escape
+        choice = self.rng.choice
+        max_depth = self.max_depth
+        if symbol is None:
+            symbol = self.start
+        if not terminal[self.ids[symbol]] and self.ids[symbol] not in escape:
+            raise ValueError(f"{symbol} derives no string")
+        result = []
+        if max_depth is None:
+            stack = [self.ids[symbol]]
+            while stack:
+                symbol = stack.pop()
+                if terminal[symbol]:
+                    result.append(names[symbol])
+                else:
+                    stack.extend(choice(productions[symbol]))
+            return ''.join(result)
+
+        stack = [(self.ids[symbol], 0)]
+        while stack:
+            symbol, depth = stack.pop()
+            if terminal[symbol]:
+                result.append(names[symbol])
+                continue
+            if depth >= max_depth and symbol in escape:
+                production = escape[symbol]
+            else:
+                production = choice(productions[symbol])
+            depth += 1
+            for next_symbol in production:
+                stack.append((next_symbol, depth))
+        return ''.join(result)
 
 
 class FiniteAutomaton:
@@ -56,19 +627,26 @@ class FiniteAutomaton:
         self.transitions = {}
         self.initial_state = None
         self.accepting_states = set()
+        # Table built by the first check_many, reused until the automaton is rebuilt
+        self._compiled = None
 
     def convert_from_grammar(self, grammar):
+        self._compiled = None
         for non_terminal in grammar.non_terminals:
             self.states.add(non_terminal)
         for terminal in grammar.terminals:
             self.alphabet.add(terminal)
 
-        for non_terminal, productions in grammar.productions.items():
-            for production in productions:
-                if len(production) == 1:  # Singleton production
-                    self.transitions.setdefault(non_terminal, {}).setdefault(production, 'ε')
-                else:
-                    self.transitions.setdefault(non_terminal, {}).setdefault(production[0], production[1])
+        names = grammar.symbols.names
+        for lhs, rhs in zip(grammar.rule_lhs, grammar.rule_rhs):
+            if rhs is None:
+                continue
+            non_terminal = names[lhs]
+            if len(rhs) <= 1:  # Singleton production
+                production = names[rhs[0]] if rhs else 'ε'
+                self.transitions.setdefault(non_terminal, {}).setdefault(production, 'ε')
+            else:
+                self.transitions.setdefault(non_terminal, {}).setdefault(names[rhs[0]], names[rhs[1]])
 
         self.initial_state = 'S'
         self.accepting_states = grammar.terminals
@@ -87,6 +665,219 @@ class FiniteAutomaton:
                 return False
         return current_state in self.accepting_states
 
+    def compile(self):
+        return CompiledAutomaton(self)
+
+    def check_many(self, input_strings):
+        if self._compiled is None:
+            self._compiled = self.compile()
+        return self._compiled.check_many(input_strings)
+
+
+# Serialized CompiledAutomaton: magic, width, rows, start, symbol count, state count
+AUTOMATON_MAGIC = b'DFA' + (b'<' if sys.byteorder == 'little' else b'>')
+AUTOMATON_HEADER = struct.Struct('=4s5I')
+
+
+class CompiledAutomaton:
+    # State 0 is the dead state, column 0 is "any symbol outside the alphabet".
+    # States are stored premultiplied by the row width, so a step is table[state + symbol].
+    def __init__(self, fa):
+        state_ids = {}
+        symbol_ids = {}
+        for state, transitions in fa.transitions.items():
+            state_ids.setdefault(state, len(state_ids) + 1)
+            for symbol, next_state in transitions.items():
+                if isinstance(next_state, set):
+                    raise ValueError(f"Cannot compile non-deterministic transition: {state} -- {symbol}")
+                symbol_ids.setdefault(symbol, len(symbol_ids) + 1)
+                if next_state is not None:
+                    state_ids.setdefault(next_state, len(state_ids) + 1)
+        state_ids.setdefault(fa.initial_state, len(state_ids) + 1)
+
+        self.state_ids = state_ids
+        self.symbol_ids = symbol_ids
+        self.width = width = len(symbol_ids) + 1
+        self.table = array('i', bytes(4 * width * (len(state_ids) + 1)))
+        for state, transitions in fa.transitions.items():
+            row = state_ids[state] * width
+            for symbol, next_state in transitions.items():
+                if next_state is not None:
+                    self.table[row + symbol_ids[symbol]] = state_ids[next_state] * width
+
+        self.accepting = bytearray(width * (len(state_ids) + 1))
+        for state, state_id in state_ids.items():
+            if state in fa.accepting_states:
+                self.accepting[state_id * width] = 1
+        self.start = state_ids[fa.initial_state] * width
+        self.byte_codes = self.make_byte_codes(symbol_ids, width)
+
+    @staticmethod
+    def make_byte_codes(symbol_ids, width):
+        # Single-character symbols can be mapped to byte codes in one str.translate call
+        if width < 256 and all(isinstance(s, str) and len(s) == 1 for s in symbol_ids):
+            return _ByteCodes({ord(s): chr(i) for s, i in symbol_ids.items()})
+        return None
+
+    def to_bytes(self):
+        # Header, name lengths, UTF-8 names (symbols then states, in id order, padded to
+        # 4 bytes), the transition table and the accepting flags, all in native byte order
+        encoded = [name.encode('utf-8') for name in itertools.chain(self.symbol_ids, self.state_ids)]
+        text = b''.join(encoded)
+        text += bytes(-len(text) % 4)
+        header = AUTOMATON_HEADER.pack(AUTOMATON_MAGIC, self.width, len(self.table) // self.width,
+                                       self.start, len(self.symbol_ids), len(self.state_ids))
+        return b''.join([header, array('I', map(len, encoded)).tobytes(), text,
+                         array('i', self.table).tobytes(), bytes(self.accepting)])
+
+    @classmethod
+    def from_bytes(cls, data):
+        # The table and accepting flags stay views of data, so an mmap is used in place
+        view = memoryview(data)
+        if len(view) < AUTOMATON_HEADER.size:
+            raise ValueError("Truncated automaton data")
+        magic, width, rows, start, symbol_count, state_count = AUTOMATON_HEADER.unpack_from(view)
+        if magic != AUTOMATON_MAGIC:
+            raise ValueError("Not an automaton in this byte order")
+        offset = AUTOMATON_HEADER.size
+        if len(view) < offset + 4 * (symbol_count + state_count):
+            raise ValueError("Truncated automaton data")
+        lengths = view[offset:offset + 4 * (symbol_count + state_count)].cast('I')
+        offset += 4 * (symbol_count + state_count)
+        text = bytes(view[offset:offset + sum(lengths)])
+        if len(text) != sum(lengths):
+            raise ValueError("Truncated automaton data")
+        offset += len(text) + -len(text) % 4
+        if len(view) != offset + 5 * width * rows:
+            raise ValueError("Truncated automaton data")
+        table = view[offset:offset + 4 * width * rows].cast('i')
+        # Every transition and the start must be a row offset, or advance() reads past the table
+        if not start < len(table) or (len(table) and not 0 <= min(table) <= max(table) < len(table)):
+            raise ValueError("Corrupt automaton data")
+        names = []
+        position = 0
+        for length in lengths:
+            names.append(text[position:position + length].decode('utf-8'))
+            position += length
+
+        automaton = cls.__new__(cls)
+        automaton.symbol_ids = {name: i + 1 for i, name in enumerate(names[:symbol_count])}
+        automaton.state_ids = {name: i + 1 for i, name in enumerate(names[symbol_count:])}
+        automaton.width = width
+        automaton.table = table
+        automaton.accepting = view[offset + 4 * width * rows:]
+        automaton.start = start
+        automaton.byte_codes = cls.make_byte_codes(automaton.symbol_ids, width)
+        return automaton
+
+    def __reduce__(self):
+        # Views of an mmap cannot be pickled; worker processes get the bytes instead
+        return CompiledAutomaton.from_bytes, (self.to_bytes(),)
+
+    def check_string(self, input_string):
+        return self.accepting[self.advance(self.start, input_string)] == 1
+
+    def advance(self, state, input_string):
+        table = self.table
+        if not state:
+            return state
+        if self.byte_codes is not None and isinstance(input_string, str):
+            for code in input_string.translate(self.byte_codes).encode('latin-1'):
+                state = table[state + code]
+                if not state:
+                    return state
+        else:
+            symbol_ids = self.symbol_ids
+            for symbol in input_string:
+                state = table[state + symbol_ids.get(symbol, 0)]
+                if not state:
+                    return state
+        return state
+
+    def check_many(self, input_strings):
+        check_string = self.check_string
+        return [check_string(s) for s in input_strings]
+
+    def matcher(self):
+        return StreamMatcher(self)
+
+
+class StreamMatcher:
+    # Resumable match: the automaton state is carried across feed() calls
+    def __init__(self, automaton):
+        self.automaton = automaton
+        self.state = automaton.start
+
+    def feed(self, chunk):
+        self.state = self.automaton.advance(self.state, chunk)
+        return self.state != 0
+
+    def accepted(self):
+        return self.automaton.accepting[self.state] == 1
+
+    def reset(self):
+        self.state = self.automaton.start
+
+
+def read_chunks(path, chunk_size=1 << 16, use_mmap=True, encoding='utf-8'):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with open(path, 'rb') as file:
+        if use_mmap and os.fstat(file.fileno()).st_size > 0:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(0, len(mapped), chunk_size):
+                    yield decoder.decode(mapped[offset:offset + chunk_size])
+        else:
+            while True:
+                data = file.read(chunk_size)
+                if not data:
+                    break
+                yield decoder.decode(data)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def check_file(automaton, path, chunk_size=1 << 16, use_mmap=True):
+    # The whole file is matched as a single token stream
+    matcher = automaton.matcher()
+    for chunk in read_chunks(path, chunk_size, use_mmap):
+        if not matcher.feed(chunk):
+            return False
+    return matcher.accepted()
+
+
+def check_file_lines(automaton, path, chunk_size=1 << 16, use_mmap=True):
+    # Yields one result per line; lines may span chunk boundaries
+    matcher = automaton.matcher()
+    pending = False
+    carry = ''
+    for chunk in read_chunks(path, chunk_size, use_mmap):
+        if carry:
+            chunk = carry + chunk
+            carry = ''
+        # Hold back a trailing '\r' until we know whether '\n' follows it
+        if chunk.endswith('\r'):
+            carry = '\r'
+            chunk = chunk[:-1]
+        pieces = chunk.split('\n')
+        for piece in pieces[:-1]:
+            matcher.feed(piece[:-1] if piece.endswith('\r') else piece)
+            yield matcher.accepted()
+            matcher.reset()
+            pending = False
+        matcher.feed(pieces[-1])
+        pending = pending or bool(pieces[-1])
+    if carry:
+        # A '\r' ending the file ends its last line, as '\r\n' does anywhere else
+        pending = True
+    if pending:
+        yield matcher.accepted()
+
+
+class _ByteCodes(dict):
+    def __missing__(self, key):
+        return '\x00'
+
 
 def fa_to_regular_grammar(fa):
     non_terminals = set()
@@ -103,9 +894,9 @@ def fa_to_regular_grammar(fa):
     for state in fa.transitions:
         for symbol, next_state in fa.transitions[state].items():
             if next_state in fa.accepting_states:
-                productions[f'N_{state}'].append(symbol)
+                productions[f'N_{state}'].append((symbol,))
             else:
-                productions[f'N_{state}'].append(symbol + f'N_{next_state}')
+                productions[f'N_{state}'].append((symbol, f'N_{next_state}'))
 
     return Grammar(non_terminals, terminals, productions)
 
@@ -129,7 +920,411 @@ def draw_fa_graph(fa):
                     print(f"{state} -- {symbol} --> {s}")
 
 
+class NFA:
+    # Right-linear grammar as a nondeterministic automaton. Alternatives are kept
+    # as sets of next states; the bitset tables below index NFA states by bit position.
+    def __init__(self):
+        self.states = set()
+        self.alphabet = set()
+        self.transitions = {}
+        self.epsilon_transitions = {}
+        self.initial_state = None
+        self.accepting_states = set()
+        self._tables = None
+
+    def add_transition(self, state, symbol, next_state):
+        self.states.update((state, next_state))
+        self.transitions.setdefault(state, {}).setdefault(symbol, set()).add(next_state)
+        self._tables = None
+
+    def convert_from_grammar(self, grammar):
+        final_state = 'ε'
+        for non_terminal in grammar.non_terminals:
+            self.states.add(non_terminal)
+        for terminal in grammar.terminals:
+            self.alphabet.add(terminal)
+        self.states.add(final_state)
+
+        names = grammar.symbols.names
+        terminal = grammar.symbols.terminal
+        for rule, rhs in enumerate(grammar.rule_rhs):
+            if rhs is None:
+                continue
+            non_terminal = names[grammar.rule_lhs[rule]]
+            if not rhs:
+                self.accepting_states.add(non_terminal)
+                continue
+            last = len(rhs) - 1
+            state = non_terminal
+            for i, symbol in enumerate(rhs):
+                if not terminal[symbol]:
+                    if i != last:
+                        raise ValueError(f"Production is not right-linear: {non_terminal} -> {grammar.production_string(rule)}")
+                    self.epsilon_transitions.setdefault(state, set()).add(names[symbol])
+                    break
+                if i == last:
+                    next_state = final_state
+                elif i == last - 1 and not terminal[rhs[last]]:
+                    self.add_transition(state, names[symbol], names[rhs[last]])
+                    break
+                else:
+                    next_state = f"{non_terminal}_{grammar.production_string(rule)}_{i + 1}"
+                self.add_transition(state, names[symbol], next_state)
+                state = next_state
+
+        self.initial_state = 'S'
+        self.accepting_states.add(final_state)
+        self._tables = None
+
+    def __str__(self):
+        transitions_str = "\n".join([f"{state}: {transitions}" for state, transitions in self.transitions.items()])
+        return f"States: {self.states}\nAlphabet: {self.alphabet}\nTransitions:\n{transitions_str}"
+
+    def _build_tables(self):
+        names = sorted(self.states | {self.initial_state}, key=str)
+        ids = {name: i for i, name in enumerate(names)}
+        symbols = sorted(set(self.alphabet).union(*[t.keys() for t in self.transitions.values()]))
+
+        # ε-closure of every single state, as a bitmask
+        closure = [1 << i for i in range(len(names))]
+        for name, i in ids.items():
+            stack = [name]
+            while stack:
+                for target in self.epsilon_transitions.get(stack.pop(), ()):
+                    bit = 1 << ids[target]
+                    if not closure[i] & bit:
+                        closure[i] |= bit
+                        stack.append(target)
+
+        moves = {symbol: [0] * len(names) for symbol in symbols}
+        for state, transitions in self.transitions.items():
+            for symbol, targets in transitions.items():
+                mask = 0
+                for target in targets:
+                    mask |= closure[ids[target]]
+                moves[symbol][ids[state]] = mask
+
+        # A state is accepting when its ε-closure reaches an accepting state
+        accepting = 0
+        for name in self.accepting_states:
+            if name in ids:
+                accepting |= 1 << ids[name]
+        accepting_mask = 0
+        for i in range(len(names)):
+            if closure[i] & accepting:
+                accepting_mask |= 1 << i
+
+        self._tables = (names, moves, closure[ids[self.initial_state]], accepting_mask)
+        self._subset_cache = {}
+        return self._tables
+
+    def step(self, subset, symbol):
+        names, moves, start, accepting = self._tables or self._build_tables()
+        key = (subset, symbol)
+        result = self._subset_cache.get(key)
+        if result is None:
+            row = moves.get(symbol)
+            result = 0
+            if row is not None:
+                while subset:
+                    low = subset & -subset
+                    result |= row[low.bit_length() - 1]
+                    subset ^= low
+            self._subset_cache[key] = result
+        return result
+
+    def check_string(self, input_string):
+        # Lazy subset construction: only subsets actually visited are determinized
+        names, moves, subset, accepting = self._tables or self._build_tables()
+        step = self.step
+        for symbol in input_string:
+            subset = step(subset, symbol)
+            if not subset:
+                return False
+        return bool(subset & accepting)
+
+    def to_dfa(self):
+        names, moves, start, accepting = self._tables or self._build_tables()
+        dfa = FiniteAutomaton()
+        dfa.alphabet = set(self.alphabet)
+        subset_names = {start: 'q0'}
+        worklist = [start]
+        while worklist:
+            subset = worklist.pop()
+            state = subset_names[subset]
+            dfa.states.add(state)
+            if subset & accepting:
+                dfa.accepting_states.add(state)
+            for symbol in moves:
+                next_subset = self.step(subset, symbol)
+                if not next_subset:
+                    continue
+                if next_subset not in subset_names:
+                    subset_names[next_subset] = f"q{len(subset_names)}"
+                    worklist.append(next_subset)
+                dfa.transitions.setdefault(state, {})[symbol] = subset_names[next_subset]
+        dfa.initial_state = 'q0'
+        return dfa
+
+
+def minimize_dfa(fa):
+    # Hopcroft partition refinement over the reachable part of a (partial) DFA.
+    # Missing transitions go to an implicit dead state, which is dropped again at the end.
+    names = [fa.initial_state]
+    ids = {fa.initial_state: 0}
+    stack = [fa.initial_state]
+    while stack:
+        for next_state in fa.transitions.get(stack.pop(), {}).values():
+            if next_state not in ids:
+                ids[next_state] = len(names)
+                names.append(next_state)
+                stack.append(next_state)
+    dead = len(names)
+    symbols = sorted(set().union(*[fa.transitions.get(name, {}).keys() for name in names]))
+
+    inverse = {symbol: [[] for _ in range(dead + 1)] for symbol in symbols}
+    for symbol in symbols:
+        for i, name in enumerate(names):
+            target = fa.transitions.get(name, {}).get(symbol)
+            inverse[symbol][dead if target is None else ids[target]].append(i)
+        inverse[symbol][dead].append(dead)
+
+    accepting = {i for i, name in enumerate(names) if name in fa.accepting_states}
+    rejecting = set(range(dead + 1)) - accepting
+    blocks = [block for block in (accepting, rejecting) if block]
+    block_of = [0] * (dead + 1)
+    for b, block in enumerate(blocks):
+        for i in block:
+            block_of[i] = b
+    worklist = [min(range(len(blocks)), key=lambda b: len(blocks[b]))]
+    in_worklist = [b in worklist for b in range(len(blocks))]
+
+    while worklist:
+        splitter = list(blocks[worklist.pop()])
+        for symbol in symbols:
+            touched = {}
+            for target in splitter:
+                for source in inverse[symbol][target]:
+                    touched.setdefault(block_of[source], set()).add(source)
+            for b, inside in touched.items():
+                block = blocks[b]
+                if len(inside) == len(block):
+                    continue
+                block -= inside
+                new_block = len(blocks)
+                blocks.append(inside)
+                for i in inside:
+                    block_of[i] = new_block
+                if in_worklist[b]:
+                    in_worklist.append(True)
+                    worklist.append(new_block)
+                elif len(inside) <= len(block):
+                    in_worklist.append(True)
+                    worklist.append(new_block)
+                else:
+                    in_worklist.append(False)
+                    in_worklist[b] = True
+                    worklist.append(b)
+
+    # Each block is named after its first state in discovery order
+    block_names = {b: names[min(block)] for b, block in enumerate(blocks) if dead not in block}
+    minimized = FiniteAutomaton()
+    minimized.alphabet = set(fa.alphabet)
+    minimized.initial_state = block_names.get(block_of[0], fa.initial_state)
+    minimized.states = set(block_names.values()) | {minimized.initial_state}
+    for b, name in block_names.items():
+        representative = names[min(blocks[b])]
+        if representative in fa.accepting_states:
+            minimized.accepting_states.add(name)
+        for symbol, target in fa.transitions.get(representative, {}).items():
+            target_block = block_of[ids[target]]
+            if target_block in block_names:
+                minimized.transitions.setdefault(name, {})[symbol] = block_names[target_block]
+    return minimized
+
+
+class UniformSampler:
+    # Draws strings of an exact length uniformly from the language of a DFA, using
+    # counts[k][state] = number of accepted strings of length k starting in state.
+    def __init__(self, automaton, rng=None):
+        if isinstance(automaton, Grammar):
+            nfa = NFA()
+            nfa.convert_from_grammar(automaton)
+            automaton = minimize_dfa(nfa.to_dfa())
+        elif not is_deterministic(automaton):
+            raise ValueError("UniformSampler needs a deterministic automaton")
+        if rng is None:
+            rng = random
+        elif not isinstance(rng, random.Random):
+            rng = random.Random(rng)
+        self.rng = rng
+
+        ids = {automaton.initial_state: 0}
+        for state, transitions in automaton.transitions.items():
+            ids.setdefault(state, len(ids))
+            for next_state in transitions.values():
+                ids.setdefault(next_state, len(ids))
+        self.edges = [[] for _ in ids]
+        for state, transitions in automaton.transitions.items():
+            for symbol, next_state in sorted(transitions.items()):
+                self.edges[ids[state]].append((symbol, ids[next_state]))
+        self.counts = [[1 if state in automaton.accepting_states else 0 for state in ids]]
+
+    def _extend(self, length):
+        counts = self.counts
+        edges = self.edges
+        while len(counts) <= length:
+            previous = counts[-1]
+            counts.append([sum(previous[target] for _, target in state_edges) for state_edges in edges])
+
+    def count(self, length):
+        self._extend(length)
+        return self.counts[length][0]
+
+    def sample(self, length):
+        total = self.count(length)
+        if not total:
+            raise ValueError(f"No strings of length {length} in the language")
+        counts = self.counts
+        randbelow = self.rng.randrange
+        state = 0
+        result = []
+        for remaining in range(length, 0, -1):
+            below = counts[remaining - 1]
+            r = randbelow(counts[remaining][state])
+            for symbol, target in self.edges[state]:
+                r -= below[target]
+                if r < 0:
+                    result.append(symbol)
+                    state = target
+                    break
+        return ''.join(result)
+
+    def samples(self, length, num_strings=None):
+        counter = itertools.count() if num_strings is None else range(num_strings)
+        for _ in counter:
+            yield self.sample(length)
+
+
+def compile_grammar(grammar, cache=None):
+    # Minimal DFA table of a right-linear grammar. With a cache, a grammar compiled before
+    # is mapped from disk instead of going through the NFA, subsets and minimization again.
+    if cache is not None:
+        key = grammar_key(grammar, 'automaton')
+        automaton = cache.load(key, CompiledAutomaton.from_bytes)
+        if automaton is not None:
+            return automaton
+    nfa = NFA()
+    nfa.convert_from_grammar(grammar)
+    automaton = minimize_dfa(nfa.to_dfa()).compile()
+    if cache is not None:
+        cache.store(key, automaton.to_bytes())
+    return automaton
+
+
+_batch_worker = None
+
+
+def _init_batch_worker(grammar, automaton, max_depth):
+    # Runs once per worker process, so the grammar and table are shipped once per worker
+    global _batch_worker
+    _batch_worker = (StringGenerator(grammar, None, max_depth), automaton)
+
+
+def _run_batch_chunk(task):
+    seed, chunk_index, count, keep_strings = task
+    generator, automaton = _batch_worker
+    # Every chunk has its own seed stream, so results do not depend on which worker runs it
+    generator.rng = random.Random(f"{seed}:{chunk_index}")
+    started = time.process_time()
+    strings = [generator.generate() for _ in range(count)]
+    results = automaton.check_many(strings)
+    return os.getpid(), time.process_time() - started, strings if keep_strings else None, results
+
+
+def run_batch(grammar, num_strings, seed=0, workers=None, chunk_size=10000, max_depth=None, keep_strings=True,
+              cache=None):
+    hits = cache.hits if cache is not None else 0
+    started = time.perf_counter()
+    automaton = compile_grammar(grammar, cache)
+    compile_time = time.perf_counter() - started
+
+    tasks = [(seed, i, min(chunk_size, num_strings - start), keep_strings)
+             for i, start in enumerate(range(0, num_strings, chunk_size))]
+    strings = []
+    results = []
+    cpu_time = {}
+    started = time.perf_counter()
+    if workers == 1:
+        _init_batch_worker(grammar, automaton, max_depth)
+        chunks = map(_run_batch_chunk, tasks)
+        workers_used = 1
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_batch_worker,
+                                                          initargs=(grammar, automaton, max_depth))
+        chunks = executor.map(_run_batch_chunk, tasks)
+        workers_used = workers or os.cpu_count() or 1
+    try:
+        for pid, seconds, chunk_strings, chunk_results in chunks:
+            cpu_time[pid] = cpu_time.get(pid, 0.0) + seconds
+            if chunk_strings is not None:
+                strings.extend(chunk_strings)
+            results.extend(chunk_results)
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    elapsed = time.perf_counter() - started
+
+    stats = {
+        'strings': num_strings,
+        'accepted': sum(results),
+        'workers': workers_used,
+        'elapsed': elapsed,
+        'throughput': num_strings / elapsed if elapsed else 0.0,
+        'throughput_per_core': num_strings / elapsed / workers_used if elapsed else 0.0,
+        'cpu_time': cpu_time,
+        'compile_time': compile_time,
+        'cache_hit': cache is not None and cache.hits > hits,
+    }
+    return strings, results, stats
+
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate strings from a regular grammar and validate them in parallel.")
+    parser.add_argument('-n', '--num-strings', type=int, default=100000)
+    parser.add_argument('-g', '--grammar', default='S:aB, B:bB, B:cL, L:cL, L:aS, L:b')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('-o', '--output', default=None, help="write 'string<TAB>accepted' lines to this file")
+    parser.add_argument('--cache-dir', default=None, help="keep compiled automata in this directory")
+    parser.add_argument('--cache-size', type=int, default=64 << 20, help="cache size limit in bytes")
+    args = parser.parse_args(argv)
+
+    grammar = parse_grammar(args.grammar)
+    cache = ArtifactCache(args.cache_dir, args.cache_size) if args.cache_dir is not None else None
+    strings, results, stats = run_batch(grammar, args.num_strings, args.seed, args.workers, args.chunk_size,
+                                        args.max_depth, keep_strings=args.output is not None, cache=cache)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            for string, accepted in zip(strings, results):
+                file.write(f"{string}\t{int(accepted)}\n")
+
+    source = "loaded from cache" if stats['cache_hit'] else "compiled"
+    print(f"Automaton {source} in {stats['compile_time'] * 1000:.1f}ms")
+    print(f"Generated {stats['strings']} strings, {stats['accepted']} accepted")
+    print(f"Workers: {stats['workers']}, elapsed: {stats['elapsed']:.3f}s")
+    print(f"Throughput: {stats['throughput']:.0f} strings/s, {stats['throughput_per_core']:.0f} strings/s per core")
+    for pid, seconds in sorted(stats['cpu_time'].items()):
+        print(f"  worker {pid}: {seconds:.3f}s CPU")
+    return 0 if stats['accepted'] == stats['strings'] else 1
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+
     # Grammar definition
     non_terminals = {'S', 'B', 'L'}
     terminals = {'a', 'b', 'c'}
@@ -167,6 +1362,20 @@ if __name__ == "__main__":
     # Draw FA graphically
     draw_fa_graph(fa)
 
+    # Keep every alternative with an NFA, then determinize and minimize it
+    nfa = NFA()
+    nfa.convert_from_grammar(grammar)
+    min_dfa = minimize_dfa(nfa.to_dfa())
+    print("\nMinimized DFA:")
+    print(min_dfa)
+
     # Classify Grammar based on Chomsky Hierarchy
     grammar_classification = grammar.classify_chomsky()
     print(f"Grammar Classification: {grammar_classification}")
+
+    # Nullable / FIRST / FOLLOW sets and LL(1) conflicts
+    analysis = GrammarAnalysis(grammar)
+    for non_terminal in grammar.productions:
+        print(f"FIRST({non_terminal}) = {sorted(analysis.first_set(non_terminal))}, "
+              f"FOLLOW({non_terminal}) = {sorted(analysis.follow_set(non_terminal))}")
+    print(f"LL(1): {analysis.is_ll1()}")
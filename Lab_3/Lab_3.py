@@ -1,9 +1,62 @@
+import bisect
+import functools
+import operator
+import re
+import sys
+import time
+from array import array
+from itertools import accumulate
+from operator import itemgetter, sub
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
 class Token:
+    __slots__ = ('type', 'value')
+
     def __init__(self, type, value):
         self.type = type
         self.value = value
 
 
+# Type ids used by the array-based tokenizer; the index is the id
+TOKEN_TYPES = ("INTEGER", "OPERATOR", "L_PAREN", "R_PAREN", "IDENTIFIER")
+UNKNOWN_TYPE = len(TOKEN_TYPES)
+
+# Leading whitespace is matched with the token, so one findall covers the whole input
+TOKEN_PATTERN = re.compile(r'\s*(?:\d+|[^\W\d]\w*|\S)')
+
+
+class _TypeCodes(dict):
+    # Maps the first character of a lexeme to its type id, for str.translate
+    def __missing__(self, key):
+        char = chr(key)
+        if char.isdecimal():
+            return chr(0)
+        if char.isalpha():
+            return chr(4)
+        return chr(UNKNOWN_TYPE)
+
+
+TYPE_CODES = _TypeCodes({ord(char): chr(1) for char in '+-*=/^'})
+TYPE_CODES.update({ord(digit): chr(0) for digit in '0123456789'})
+TYPE_CODES[ord('(')] = chr(2)
+TYPE_CODES[ord(')')] = chr(3)
+TYPE_CODES[ord('_')] = chr(4)
+
+if numpy is not None:
+    # Per-byte tables for Lexer.scan_ascii: the class of each ASCII byte (0 whitespace,
+    # 1 digit, 2 letter or '_', 3 anything else) and the type id of a token starting with it
+    BYTE_CLASSES = numpy.array([0 if chr(byte).isspace() else 1 if chr(byte).isdigit() else
+                                2 if chr(byte).isalpha() or byte == ord('_') else 3 for byte in range(128)],
+                               dtype=numpy.uint8)
+    BYTE_TYPES = numpy.frombuffer(''.join(map(chr, range(128))).translate(TYPE_CODES).encode('latin-1'),
+                                  dtype=numpy.uint8)
+
+
 class Lexer:
     def __init__(self, input):
         self.input = input
@@ -30,6 +83,13 @@ class Lexer:
                     self.index += 1
                 return Token("INTEGER", int(num))
 
+            if current_char.isalpha() or current_char == '_':
+                name = ""
+                while self.index < len(self.input) and (self.input[self.index].isalnum() or self.input[self.index] == '_'):
+                    name += self.input[self.index]
+                    self.index += 1
+                return Token("IDENTIFIER", name)
+
             if self.is_operator(current_char):
                 self.index += 1
                 return Token("OPERATOR", current_char)
@@ -54,10 +114,374 @@ class Lexer:
             next_token = self.next_token()
         return tokens
 
+    def iter_tokens(self):
+        next_token = self.next_token()
+        while next_token.type != "EOF":
+            yield next_token
+            next_token = self.next_token()
+
+    def scan(self):
+        # Every step runs in C: one findall, then map/accumulate over the lexemes
+        pieces = TOKEN_PATTERN.findall(self.input, self.index)
+        lexemes = list(map(str.lstrip, pieces))
+        ends = array('i', accumulate(map(len, pieces), initial=self.index))[1:]
+        types = ''.join(map(itemgetter(0), lexemes)).translate(TYPE_CODES).encode('latin-1')
+        unknown = types.find(UNKNOWN_TYPE)
+        if unknown != -1:
+            raise ValueError(f"Unknown token: {lexemes[unknown]}")
+        self.index = len(self.input)
+        return lexemes, types, ends
+
+    def scan_ascii(self):
+        # NumPy scanner: a token starts at every byte of class 3 and at the first byte of
+        # every run of word bytes, and ends likewise, so no Python object is made per token.
+        # None when the regex is needed: non-ASCII input, or a digit followed by a letter,
+        # which \d+ splits ("2x") or not ("x2y") depending on how the run started.
+        text = self.input[self.index:]
+        if not text.isascii():
+            return None
+        data = numpy.frombuffer(text.encode('ascii'), dtype=numpy.uint8)
+        classes = BYTE_CLASSES[data]
+        if ((classes[1:] == 2) & (classes[:-1] == 1)).any():
+            return None
+        word = (classes == 1) | (classes == 2)
+        start = classes == 3
+        end = start.copy()
+        start[:1] |= word[:1]
+        start[1:] |= word[1:] & ~word[:-1]
+        end[-1:] |= word[-1:]
+        end[:-1] |= word[:-1] & ~word[1:]
+        starts = numpy.flatnonzero(start)
+        types = BYTE_TYPES[data[starts]]
+        unknown = numpy.flatnonzero(types == UNKNOWN_TYPE)
+        if len(unknown):
+            raise ValueError(f"Unknown token: {text[starts[unknown[0]]]}")
+        starts += self.index
+        ends = numpy.flatnonzero(end) + (self.index + 1)
+        self.index = len(self.input)
+        return (array('b', types.tobytes()), array('i', starts.astype(numpy.int32).tobytes()),
+                array('i', ends.astype(numpy.int32).tobytes()))
+
+    def tokenize_arrays(self):
+        # The high-throughput API: parallel arrays (type ids, start offsets, end offsets),
+        # see TOKEN_TYPES. With NumPy, ASCII input goes through scan_ascii; everything else
+        # is sliced by scan().
+        if numpy is not None:
+            arrays = self.scan_ascii()
+            if arrays is not None:
+                return arrays
+        lexemes, types, ends = self.scan()
+        starts = array('i', map(sub, ends, map(len, lexemes)))
+        return array('b', types), starts, ends
+
+    def tokenize_fast(self):
+        lexemes, types, ends = self.scan()
+        token_types = TOKEN_TYPES
+        return [Token("INTEGER", int(lexeme)) if type_id == 0 else Token(token_types[type_id], lexeme)
+                for type_id, lexeme in zip(types, lexemes)]
+
+
+class IncrementalLexer:
+    # Keeps the token arrays of a buffer and re-lexes only the region around an edit.
+    # The lexer carries no state between tokens, so lexing can restart at any old token
+    # end and stop once a new token ends where an old one did past the edit.
+    #
+    # Offsets of tokens from index _shift_from onwards are stored minus _shift. Moving that
+    # boundary costs the distance between two edits, so typing in one place stays cheap.
+    def __init__(self, text):
+        self.text = text
+        self.types, self._starts, self._ends = Lexer(text).tokenize_arrays()
+        self._shift_from = len(self.types)
+        self._shift = 0
+
+    def __len__(self):
+        return len(self.types)
+
+    def _move_shift(self, index):
+        shift = self._shift
+        low, high = sorted((index, self._shift_from))
+        if shift and low < high:
+            if index < self._shift_from:
+                shift = -shift
+            for offsets in (self._starts, self._ends):
+                offsets[low:high] = array('i', map(shift.__add__, offsets[low:high]))
+        self._shift_from = index
+        if index == len(self.types):
+            self._shift = 0
+
+    def _bisect(self, pos):
+        split = self._shift_from
+        ends = self._ends
+        if split and ends[split - 1] >= pos:
+            return bisect.bisect_left(ends, pos, 0, split)
+        return bisect.bisect_left(ends, pos - self._shift, split)
+
+    def edit(self, start, end, new_text):
+        # Replaces text[start:end] with new_text; returns the range of token indices that changed
+        text = self.text[:start] + new_text + self.text[end:]
+        delta = len(new_text) - (end - start)
+
+        # The token ending right at the edit may grow (e.g. digits typed after a number)
+        first = self._bisect(start)
+        self._move_shift(first)
+        shift = self._shift
+        ends = self._ends
+        pos = ends[first - 1] if first else 0
+        old = self._bisect(end)
+        edit_end = start + len(new_text)
+
+        types = array('b')
+        starts = array('i')
+        new_ends = array('i')
+        stored = shift + delta
+        match = TOKEN_PATTERN.match
+        while True:
+            token = match(text, pos)
+            if token is None:
+                old = len(ends)
+                break
+            lexeme = token.group().lstrip()
+            type_id = ord(TYPE_CODES[ord(lexeme[0])])
+            if type_id == UNKNOWN_TYPE:
+                raise ValueError(f"Unknown token: {lexeme}")
+            pos = token.end()
+            types.append(type_id)
+            starts.append(pos - len(lexeme) - stored)
+            new_ends.append(pos - stored)
+            if pos >= edit_end:
+                old_pos = pos - delta - shift
+                while old < len(ends) and ends[old] < old_pos:
+                    old += 1
+                if old < len(ends) and ends[old] == old_pos:
+                    old += 1
+                    break
+
+        self.text = text
+        self.types[first:old] = types
+        self._starts[first:old] = starts
+        self._ends[first:old] = new_ends
+        self._shift = stored
+        if first == len(self.types):
+            self._shift = 0
+        return first, first + len(types)
+
+    def arrays(self):
+        # Parallel arrays (type ids, start offsets, end offsets) in current buffer coordinates
+        self._move_shift(len(self.types))
+        return self.types, self._starts, self._ends
+
+    def tokens(self, first=0, last=None):
+        text = self.text
+        types, starts, ends = self.arrays()
+        for type_id, start, end in zip(types[first:last], starts[first:last], ends[first:last]):
+            if type_id == 0:
+                yield Token("INTEGER", int(text[start:end]))
+            else:
+                yield Token(TOKEN_TYPES[type_id], text[start:end])
+
+
+# Binary operators: precedence and whether they group to the right
+BINARY_OPERATORS = {
+    '=': (1, True),
+    '+': (2, False),
+    '-': (2, False),
+    '*': (3, False),
+    '/': (3, False),
+    '^': (5, True),
+}
+UNARY_PRECEDENCE = 4
+
+OPERATOR_FUNCTIONS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '^': operator.pow,
+}
+
+
+class ExpressionParser:
+    # Precedence climbing over the Lexer tokens. Nodes are tuples:
+    # ('num', value) ('var', name) ('neg', node) ('assign', name, node) ('binary', op, left, right)
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def peek(self):
+        if self.index < len(self.tokens):
+            return self.tokens[self.index]
+        return None
+
+    def parse(self):
+        node = self.parse_expression(1)
+        token = self.peek()
+        if token is not None:
+            raise ValueError(f"Unexpected token: {token.value}")
+        return node
+
+    def parse_expression(self, min_precedence):
+        left = self.parse_unary()
+        while True:
+            token = self.peek()
+            if token is None or token.type != "OPERATOR":
+                return left
+            precedence, right_associative = BINARY_OPERATORS[token.value]
+            if precedence < min_precedence:
+                return left
+            self.index += 1
+            right = self.parse_expression(precedence if right_associative else precedence + 1)
+            if token.value == '=':
+                if left[0] != 'var':
+                    raise ValueError("Left side of '=' must be a variable")
+                left = ('assign', left[1], right)
+            else:
+                left = ('binary', token.value, left, right)
+
+    def parse_unary(self):
+        token = self.peek()
+        if token is not None and token.type == "OPERATOR" and token.value in ('+', '-'):
+            self.index += 1
+            operand = self.parse_expression(UNARY_PRECEDENCE)
+            return ('neg', operand) if token.value == '-' else operand
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of expression")
+        self.index += 1
+        if token.type == "INTEGER":
+            return ('num', token.value)
+        if token.type == "IDENTIFIER":
+            return ('var', token.value)
+        if token.type == "L_PAREN":
+            node = self.parse_expression(1)
+            closing = self.peek()
+            if closing is None or closing.type != "R_PAREN":
+                raise ValueError("Missing ')'")
+            self.index += 1
+            return node
+        raise ValueError(f"Unexpected token: {token.value}")
+
+
+def fold_constants(node):
+    kind = node[0]
+    if kind == 'neg':
+        operand = fold_constants(node[1])
+        if operand[0] == 'num':
+            return ('num', -operand[1])
+        return ('neg', operand)
+    if kind == 'assign':
+        return ('assign', node[1], fold_constants(node[2]))
+    if kind == 'binary':
+        left = fold_constants(node[2])
+        right = fold_constants(node[3])
+        if left[0] == 'num' and right[0] == 'num':
+            try:
+                return ('num', OPERATOR_FUNCTIONS[node[1]](left[1], right[1]))
+            except ZeroDivisionError:
+                pass
+        return ('binary', node[1], left, right)
+    return node
+
+
+def compile_node(node):
+    # Turns a folded tree into nested closures taking the variable bindings
+    kind = node[0]
+    if kind == 'num':
+        value = node[1]
+        return lambda env: value
+    if kind == 'var':
+        name = node[1]
+
+        def variable(env):
+            try:
+                return env[name]
+            except KeyError:
+                raise NameError(f"Unbound variable: {name}") from None
+        return variable
+    if kind == 'neg':
+        operand = compile_node(node[1])
+        return lambda env: -operand(env)
+    if kind == 'assign':
+        name = node[1]
+        value = compile_node(node[2])
+
+        def assign(env):
+            result = env[name] = value(env)
+            return result
+        return assign
+
+    function = OPERATOR_FUNCTIONS[node[1]]
+    left_node, right_node = node[2], node[3]
+    # Specialise the common constant-operand shapes to save a call per evaluation
+    if right_node[0] == 'num':
+        left = compile_node(left_node)
+        constant = right_node[1]
+        return lambda env: function(left(env), constant)
+    if left_node[0] == 'num':
+        right = compile_node(right_node)
+        constant = left_node[1]
+        return lambda env: function(constant, right(env))
+    left = compile_node(left_node)
+    right = compile_node(right_node)
+    return lambda env: function(left(env), right(env))
+
+
+class CompiledExpression:
+    def __init__(self, text):
+        self.text = text
+        self.tree = fold_constants(ExpressionParser(Lexer(text).tokenize_fast()).parse())
+        self.function = compile_node(self.tree)
+
+    def __call__(self, env=None, **bindings):
+        if env is None:
+            env = bindings
+        elif bindings:
+            env.update(bindings)
+        return self.function(env)
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_expression(text):
+    return CompiledExpression(text)
+
+
+def evaluate(text, env=None, **bindings):
+    return compile_expression(text)(env, **bindings)
+
+
+def benchmark(text, repeat=3):
+    # Best-of-repeat tokens per second for the character loop and the regex scanner
+    results = {}
+    for name, run in (("tokenize", lambda: Lexer(text).tokenize()),
+                      ("tokenize_fast", lambda: Lexer(text).tokenize_fast()),
+                      ("tokenize_arrays", lambda: Lexer(text).tokenize_arrays()[0])):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            count = len(run())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = count / best
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as file:
+            for name, rate in benchmark(file.read()).items():
+                print(f"{name}: {rate:,.0f} tokens/s")
+        sys.exit()
+
+    input_expr = input("Enter an arithmetic expression: ")
+    lexer = Lexer(input_expr)
+    tokens = lexer.tokenize()
 
-input_expr = input("Enter an arithmetic expression: ")
-lexer = Lexer(input_expr)
-tokens = lexer.tokenize()
+    for token in tokens:
+        print(token.type, token.value)
 
-for token in tokens:
-    print(token.type, token.value)
+    try:
+        print("Result:", evaluate(input_expr))
+    except NameError as error:
+        print(error)
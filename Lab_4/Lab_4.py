@@ -1,52 +1,349 @@
+import functools
+import itertools
+import os
 import random
+import struct
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from artifact_cache import ArtifactCache
+
+# Serialized regex DFA: magic, state count, edge count, accepting state count
+DFA_MAGIC = b'RDF' + (b'<' if sys.byteorder == 'little' else b'>')
+DFA_HEADER = struct.Struct('=4s3I')
 
 #S:bA, S:BC, A:a, A:aS, A:bAaAb, B:A, B:bS, B:aAa, C:ε, C:AB, D:AB
 
-def generate_string(regex):
-    generated_string = ''
-    i = 0
-    while i < len(regex):
-        print("Current state of generated string:", generated_string)
-        print("Current character in regex:", regex[i])
-        if regex[i] == '?':
-            if random.choice([True, False]):
-                print("Optional character, skipping back")
-                i -= 1
+class Regex:
+    # A pattern is parsed once into a small tuple AST:
+    #   ('char', c) ('seq', [nodes]) ('alt', [nodes]) ('star', node) ('plus', node) ('opt', node) ('repeat', node, n)
+    # and compiled to a Thompson NFA and then a DFA for matching. With an ArtifactCache, the
+    # DFA is keyed by the AST, so patterns that parse alike ('a|b', '(a|b)') share it.
+    def __init__(self, pattern, cache=None):
+        self.pattern = pattern
+        self.pos = 0
+        self.ast = self.parse_alternation()
+        if self.pos != len(pattern):
+            raise ValueError(f"Unexpected '{pattern[self.pos]}' at position {self.pos} in {pattern!r}")
+        if cache is None:
+            self.transitions, self.accepting = self.build_dfa()
+        else:
+            key = repr(('regex-dfa', 1, self.ast))
+            dfa = cache.load(key, dfa_from_bytes)
+            if dfa is None:
+                dfa = self.build_dfa()
+                cache.store(key, dfa_to_bytes(*dfa))
+            self.transitions, self.accepting = dfa
+        self._generators = {}
+        self._capped_dfas = {}
+
+    def parse_alternation(self):
+        options = [self.parse_sequence()]
+        while self.pos < len(self.pattern) and self.pattern[self.pos] == '|':
+            self.pos += 1
+            options.append(self.parse_sequence())
+        return options[0] if len(options) == 1 else ('alt', options)
+
+    def parse_sequence(self):
+        items = []
+        pattern = self.pattern
+        while self.pos < len(pattern) and pattern[self.pos] not in '|)':
+            char = pattern[self.pos]
+            self.pos += 1
+            if char == '(':
+                node = self.parse_alternation()
+                if self.pos >= len(pattern) or pattern[self.pos] != ')':
+                    raise ValueError(f"Missing ')' in {pattern!r}")
+                self.pos += 1
+            elif char in '*+?^':
+                raise ValueError(f"Nothing to repeat before '{char}' at position {self.pos - 1} in {pattern!r}")
+            else:
+                if char == '\\' and self.pos < len(pattern):
+                    char = pattern[self.pos]
+                    self.pos += 1
+                node = ('char', char)
+            items.append(self.parse_postfix(node))
+        return items[0] if len(items) == 1 else ('seq', items)
+
+    def parse_postfix(self, node):
+        pattern = self.pattern
+        while self.pos < len(pattern) and pattern[self.pos] in '*+?^':
+            char = pattern[self.pos]
+            self.pos += 1
+            if char == '*':
+                node = ('star', node)
+            elif char == '+':
+                node = ('plus', node)
+            elif char == '?':
+                node = ('opt', node)
+            else:
+                start = self.pos
+                while self.pos < len(pattern) and pattern[self.pos].isdigit():
+                    self.pos += 1
+                if start == self.pos:
+                    raise ValueError(f"Expected a number after '^' at position {start} in {pattern!r}")
+                node = ('repeat', node, int(pattern[start:self.pos]))
+        return node
+
+    def build_nfa(self, ast):
+        # Thompson construction; returns epsilon edges, symbol edges, start and final state
+        epsilon = []
+        edges = []
+
+        def new_state():
+            epsilon.append([])
+            edges.append([])
+            return len(epsilon) - 1
+
+        def build(node):
+            kind = node[0]
+            if kind == 'char':
+                start, end = new_state(), new_state()
+                edges[start].append((node[1], end))
+            elif kind == 'seq' or kind == 'repeat':
+                parts = node[1] if kind == 'seq' else [node[1]] * node[2]
+                start = end = new_state()
+                for part in parts:
+                    part_start, part_end = build(part)
+                    epsilon[end].append(part_start)
+                    end = part_end
+            elif kind == 'alt':
+                start, end = new_state(), new_state()
+                for option in node[1]:
+                    option_start, option_end = build(option)
+                    epsilon[start].append(option_start)
+                    epsilon[option_end].append(end)
+            else:
+                start, end = new_state(), new_state()
+                inner_start, inner_end = build(node[1])
+                epsilon[start].append(inner_start)
+                epsilon[inner_end].append(end)
+                if kind != 'plus':
+                    epsilon[start].append(end)
+                if kind != 'opt':
+                    epsilon[inner_end].append(inner_start)
+            return start, end
+
+        start, end = build(ast)
+        return epsilon, edges, start, end
+
+    def build_dfa(self, ast=None):
+        epsilon, edges, start, end = self.build_nfa(self.ast if ast is None else ast)
+
+        def closure(states):
+            stack = list(states)
+            seen = set(states)
+            while stack:
+                for target in epsilon[stack.pop()]:
+                    if target not in seen:
+                        seen.add(target)
+                        stack.append(target)
+            return frozenset(seen)
+
+        start_set = closure([start])
+        ids = {start_set: 0}
+        transitions = [{}]
+        accepting = set()
+        worklist = [start_set]
+        while worklist:
+            subset = worklist.pop()
+            state = ids[subset]
+            if end in subset:
+                accepting.add(state)
+            moves = {}
+            for nfa_state in subset:
+                for symbol, target in edges[nfa_state]:
+                    moves.setdefault(symbol, []).append(target)
+            for symbol, targets in moves.items():
+                next_subset = closure(targets)
+                if next_subset not in ids:
+                    ids[next_subset] = len(transitions)
+                    transitions.append({})
+                    worklist.append(next_subset)
+                transitions[state][symbol] = ids[next_subset]
+        return transitions, accepting
+
+    def match(self, string):
+        transitions = self.transitions
+        state = 0
+        for char in string:
+            state = transitions[state].get(char)
+            if state is None:
+                return False
+        return state in self.accepting
+
+    def cap_repetitions(self, node, max_repeat):
+        # Rewrites '*' and '+' into at most max_repeat nested optional copies
+        kind = node[0]
+        if kind == 'char':
+            return node
+        if kind == 'seq' or kind == 'alt':
+            return (kind, [self.cap_repetitions(part, max_repeat) for part in node[1]])
+        inner = self.cap_repetitions(node[1], max_repeat)
+        if kind == 'opt':
+            return ('opt', inner)
+        if kind == 'repeat':
+            return ('repeat', inner, node[2])
+        low = 1 if kind == 'plus' else 0
+        capped = ('seq', [])
+        for _ in range(max(max_repeat, low) - low):
+            capped = ('opt', ('seq', [inner, capped]))
+        return ('seq', [inner] * low + [capped])
+
+    def enumerate_strings(self, max_length=None, max_count=None, max_repeat=None):
+        # Streams matching strings in shortlex order. Walking a DFA gives every string
+        # exactly once, so no set of already-emitted strings has to be kept.
+        if max_repeat is None:
+            transitions, accepting = self.transitions, self.accepting
+        else:
+            if max_repeat not in self._capped_dfas:
+                self._capped_dfas[max_repeat] = self.build_dfa(self.cap_repetitions(self.ast, max_repeat))
+            transitions, accepting = self._capped_dfas[max_repeat]
+        edges = [sorted(state_transitions.items()) for state_transitions in transitions]
+
+        # alive[k] holds the states that reach an accepting state in exactly k steps
+        alive = [set(accepting)]
+        count = 0
+        length = 0
+        while max_length is None or length <= max_length:
+            while len(alive) <= length:
+                previous = alive[-1]
+                alive.append({state for state, state_edges in enumerate(edges)
+                              if any(target in previous for _, target in state_edges)})
+            if not alive[length]:
+                return
+            for string in self.strings_of_length(edges, alive, length):
+                if max_count is not None and count >= max_count:
+                    return
+                count += 1
+                yield string
+            length += 1
+
+    def strings_of_length(self, edges, alive, length):
+        if 0 not in alive[length]:
+            return
+        if length == 0:
+            yield ''
+            return
+        prefix = []
+        stack = [iter(edges[0])]
+        while stack:
+            depth = len(stack)
+            for symbol, target in stack[-1]:
+                if target in alive[length - depth]:
+                    break
             else:
-                print("Optional character, proceeding")
-            i += 1
-        elif regex[i] == '^':
-            power = int(regex[i + 1])
-            generated_string += generated_string[-1] * (power - 1)
-            print("Repeating last character", power, "times")
-            i += 2
-        elif regex[i] == '(':
-            options = ''
-            i += 1
-            while regex[i] != ')':
-                options += regex[i]
-                i += 1
-            options_list = options.split('|')
-            chosen_option = random.choice(options_list)
-            generated_string += chosen_option
-            print("Choosing from options:", options_list, "Chosen:", chosen_option)
-            i += 1
-        elif regex[i] == '*':
-            times = random.randint(0, 5)
-            generated_string += generated_string[-1] * times
-            print("Repeating last character", times, "times")
-            i += 1
-        elif regex[i] == '+':
-            times = random.randint(1, 5)
-            generated_string += generated_string[-1] * times
-            print("Repeating last character (at least once)", times, "times")
-            i += 1
+                stack.pop()
+                if prefix:
+                    prefix.pop()
+                continue
+            if depth == length:
+                yield ''.join(prefix) + symbol
+                continue
+            prefix.append(symbol)
+            stack.append(iter(edges[target]))
+
+    def generate(self, rng=None, max_repeat=5, trace=None):
+        # Unbounded '*' and '+' repeat at most max_repeat times; trace(message) is an opt-in debug hook
+        key = (max_repeat, trace)
+        generator = self._generators.get(key)
+        if generator is None:
+            generator = self._generators[key] = self.compile_generator(self.ast, max_repeat, trace)
+        result = []
+        generator(result, rng or random)
+        return ''.join(result)
+
+    def compile_generator(self, node, max_repeat, trace):
+        kind = node[0]
+        if kind == 'char':
+            char = node[1]
+            if trace is None:
+                return lambda out, rng: out.append(char)
+
+            def emit(out, rng):
+                out.append(char)
+                trace(f"Appending character {char!r}, generated so far: {''.join(out)!r}")
+            return emit
+
+        if kind == 'seq':
+            parts = [self.compile_generator(part, max_repeat, trace) for part in node[1]]
+
+            def sequence(out, rng):
+                for part in parts:
+                    part(out, rng)
+            return sequence
+
+        if kind == 'alt':
+            options = [self.compile_generator(option, max_repeat, trace) for option in node[1]]
+
+            def alternation(out, rng):
+                index = rng.randrange(len(options))
+                if trace is not None:
+                    trace(f"Choosing option {index + 1} of {len(options)}")
+                options[index](out, rng)
+            return alternation
+
+        inner = self.compile_generator(node[1], max_repeat, trace)
+        if kind == 'repeat':
+            low = high = node[2]
         else:
-            generated_string += regex[i]
-            print("Appending character to generated string:", regex[i])
-            i += 1
+            low = 1 if kind == 'plus' else 0
+            high = 1 if kind == 'opt' else max(max_repeat, low)
 
-    return generated_string
+        def repetition(out, rng):
+            times = low if low == high else rng.randint(low, high)
+            if trace is not None:
+                trace(f"Repeating {kind} group {times} times")
+            for _ in range(times):
+                inner(out, rng)
+        return repetition
+
+
+def dfa_to_bytes(transitions, accepting):
+    # Header, then one int array: (state, code point, target) for every edge, followed by
+    # the accepting states
+    items = array('i')
+    for state, moves in enumerate(transitions):
+        for symbol, target in moves.items():
+            items.extend((state, ord(symbol), target))
+    edge_count = len(items) // 3
+    items.extend(sorted(accepting))
+    return DFA_HEADER.pack(DFA_MAGIC, len(transitions), edge_count, len(accepting)) + items.tobytes()
+
+
+def dfa_from_bytes(data):
+    view = memoryview(data)
+    if len(view) < DFA_HEADER.size:
+        raise ValueError("Truncated DFA data")
+    magic, state_count, edge_count, accepting_count = DFA_HEADER.unpack_from(view)
+    if magic != DFA_MAGIC:
+        raise ValueError("Not a regex DFA in this byte order")
+    if len(view) != DFA_HEADER.size + 4 * (3 * edge_count + accepting_count):
+        raise ValueError("Truncated DFA data")
+    items = view[DFA_HEADER.size:].cast('i')
+    edges = items[:3 * edge_count]
+    accepting = set(items[3 * edge_count:])
+    # Every state but the start one is the target of some edge
+    states = itertools.chain(edges[0::3], edges[2::3], accepting)
+    if not 0 < state_count <= edge_count + 1 or any(not 0 <= state < state_count for state in states):
+        raise ValueError("Corrupt DFA data")
+    transitions = [{} for _ in range(state_count)]
+    try:
+        for state, symbol, target in zip(edges[0::3], edges[1::3], edges[2::3]):
+            transitions[state][chr(symbol)] = target
+    except ValueError:
+        raise ValueError("Corrupt DFA data") from None
+    return transitions, accepting
+
+
+@functools.lru_cache(maxsize=256)
+def compile_regex(pattern, cache=None):
+    return Regex(pattern, cache)
+
+
+def generate_string(regex, rng=None, trace=None):
+    return compile_regex(regex).generate(rng, trace=trace)
 
 
 def generate_strings(regex):
@@ -57,9 +354,14 @@ def generate_strings(regex):
     return generated_strings
 
 
-# Prompt user for regular expression input
-user_regex = input("Enter a regular expression: ")
+def enumerate_strings(regex, max_length=None, max_count=None, max_repeat=None):
+    return compile_regex(regex).enumerate_strings(max_length, max_count, max_repeat)
+
+
+if __name__ == "__main__":
+    # Prompt user for regular expression input
+    user_regex = input("Enter a regular expression: ")
 
-# Generate strings complying with the input regular expression
-generated_strings = generate_strings(user_regex)
-print("Generated strings:", generated_strings)
+    # Generate strings complying with the input regular expression
+    generated_strings = generate_strings(user_regex)
+    print("Generated strings:", generated_strings)
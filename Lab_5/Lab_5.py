@@ -1,125 +1,1021 @@
+import collections
+import os
+import re
+import struct
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from artifact_cache import ArtifactCache, grammar_key
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Serialized CNF grammar: magic, name count, item count
+CNF_MAGIC = b'CNF' + (b'<' if sys.byteorder == 'little' else b'>')
+CNF_HEADER = struct.Struct('=4s2I')
+
+
+# Grammar IR shared by Lab_1, Lab_2 and Lab_5. The labs run standalone, so each keeps a
+# copy; the three copies are identical, from here down to the end of parse_grammar.
+class SymbolTable:
+    # Grammar symbols interned to dense ids, so per-symbol data can live in lists
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.terminal = bytearray()
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name, terminal=False):
+        symbol = self.ids.get(name)
+        if symbol is None:
+            symbol = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.terminal.append(terminal)
+        return symbol
+
+    def copy(self):
+        table = SymbolTable()
+        table.ids = dict(self.ids)
+        table.names = list(self.names)
+        table.terminal = bytearray(self.terminal)
+        return table
+
+
+class Grammar:
+    # productions is the {non-terminal: [production]} view the grammar was built from.
+    # Everything else works on the interned form: rule r is rule_lhs[r] -> rule_rhs[r]
+    # (a tuple of symbol ids), rules_for[A] lists the rules of A and uses[X] lists the
+    # rules with X on their right-hand side. Productions are strings split by longest
+    # match against the declared symbol names (so 'aN_q1' is 'a', 'N_q1'), or tuples of names.
+    # A removed rule leaves None in rule_rhs, so rule ids stay stable.
+    def __init__(self, non_terminals, terminals, productions, start='S'):
+        self.non_terminals = non_terminals
+        self.terminals = terminals
+        self.productions = productions
+        self.start = start
+        self.symbols = SymbolTable()
+        self.rule_lhs = array('i')
+        self.rule_rhs = []
+        self.rules_for = []
+        self.uses = []
+
+        for non_terminal in productions:
+            self.intern(non_terminal)
+        for non_terminal in sorted(set(non_terminals).difference(productions)):
+            self.intern(non_terminal)
+        for terminal in sorted(terminals):
+            self.intern(terminal, True)
+        self.build_pattern()
+        for non_terminal, alternatives in productions.items():
+            lhs = self.symbols.ids[non_terminal]
+            for production in alternatives:
+                self.add_rule(lhs, self.split(production))
+
+    def build_pattern(self):
+        names = sorted(self.symbols.names, key=len, reverse=True)
+        self.symbol_pattern = re.compile('|'.join(map(re.escape, names)) + '|.' if names else '.', re.DOTALL)
+
+    def intern(self, name, terminal=False):
+        symbol = self.symbols.intern(name, terminal)
+        if symbol == len(self.rules_for):
+            self.rules_for.append([])
+            self.uses.append([])
+        return symbol
+
+    def split(self, production):
+        # Symbols that were not declared are terminals until add_production gives them a rule
+        if isinstance(production, str):
+            if production == 'ε':
+                return ()
+            production = self.symbol_pattern.findall(production)
+        ids = self.symbols.ids
+        return tuple(ids[name] if name in ids else self.intern(name, True) for name in production)
+
+    def add_rule(self, lhs, rhs):
+        rule = len(self.rule_rhs)
+        self.rule_lhs.append(lhs)
+        self.rule_rhs.append(rhs)
+        self.rules_for[lhs].append(rule)
+        for symbol in set(rhs):
+            self.uses[symbol].append(rule)
+        return rule
+
+    def add_production(self, non_terminal, production):
+        lhs = self.symbols.ids.get(non_terminal)
+        if lhs is None:
+            lhs = self.intern(non_terminal)
+            self.non_terminals.add(non_terminal)
+            if len(non_terminal) > 1:
+                self.build_pattern()
+        elif self.symbols.terminal[lhs]:
+            if non_terminal in self.terminals:
+                raise ValueError(f"Cannot add a production to terminal {non_terminal}")
+            # It was only seen on right-hand sides so far
+            self.symbols.terminal[lhs] = False
+            self.non_terminals.add(non_terminal)
+        rule = self.add_rule(lhs, self.split(production))
+        self.productions.setdefault(non_terminal, []).append(production)
+        return rule
+
+    def remove_production(self, non_terminal, production):
+        lhs = self.symbols.ids.get(non_terminal)
+        rhs = self.split(production)
+        rules = self.rules_for[lhs] if lhs is not None else ()
+        for rule in rules:
+            if self.rule_rhs[rule] == rhs:
+                break
+        else:
+            raise ValueError(f"No production {non_terminal} -> {production}")
+        rules.remove(rule)
+        for symbol in set(rhs):
+            self.uses[symbol].remove(rule)
+        self.rule_rhs[rule] = None
+        alternatives = self.productions[non_terminal]
+        for i, alternative in enumerate(alternatives):
+            if self.split(alternative) == rhs:
+                del alternatives[i]
+                break
+        return rule
+
+    def production_string(self, rule):
+        rhs = self.rule_rhs[rule]
+        return ''.join(self.symbols.names[symbol] for symbol in rhs) if rhs else 'ε'
+
+    def __str__(self):
+        ids = self.symbols.ids
+        productions_str = "\n".join([f"{non_terminal} -> {' | '.join(map(self.production_string, self.rules_for[ids[non_terminal]]))}" for non_terminal in self.productions])
+        return f"Non-terminals: {self.non_terminals}\nTerminals: {self.terminals}\nProductions:\n{productions_str}"
+
+    def classify_chomsky(self):
+        terminal = self.symbols.terminal
+        rules = [rhs for rhs in self.rule_rhs if rhs is not None]
+        # ε counts as a single symbol, as it did when productions were strings
+        lengths = [len(rhs) or 1 for rhs in rules]
+
+        # Check if the grammar is regular
+        regular = all(length <= 2 and (length == 1 or not terminal[rhs[0]])
+                      for length, rhs in zip(lengths, rules))
+
+        # Check if the grammar is context-free
+        context_free = all(length == 1 for length in lengths)
+
+        # Check if the grammar is context-sensitive
+        context_sensitive = not regular and not context_free
+
+        # If none of the above are True, the grammar is unrestricted
+        if not any([regular, context_free, context_sensitive]):
+            return "Type 0 : Unrestricted"
+        elif regular:
+            return "Type 3 : Regular"
+        elif context_free:
+            return "Type 2 : Context-Free"
+        elif context_sensitive:
+            return "Type 1 : Context-Sensitive"
+
+
+def parse_grammar(grammar_str):
+    # 'S:aB, B:bB, ...'; the first left-hand side is the start symbol, and upper-case
+    # symbols are non-terminals even without rules of their own. Non-terminal names may be
+    # longer than one character; right-hand sides are split by Grammar.
+    productions = {}
+    for production in grammar_str.split(','):
+        left, right = production.strip().split(':')
+        productions.setdefault(left.strip(), []).append(right.strip())
+    grammar = Grammar(set(productions), set(), productions, next(iter(productions)))
+    symbols = grammar.symbols
+    for symbol, name in enumerate(symbols.names):
+        if not symbols.terminal[symbol]:
+            continue
+        if name.isupper():
+            symbols.terminal[symbol] = False
+            grammar.non_terminals.add(name)
+        else:
+            grammar.terminals.add(name)
+    return grammar
+
+
+def cnf_to_bytes(cnf_grammar):
+    # Header, name lengths, UTF-8 names padded to 4 bytes, then one int array: the number
+    # of non-terminals and, for each, its name id, alternative count and the alternatives
+    # as a length followed by name ids
+    ids = {}
+    items = array('i', [len(cnf_grammar)])
+    for lhs, alternatives in cnf_grammar.items():
+        items.extend((ids.setdefault(lhs, len(ids)), len(alternatives)))
+        for rhs in alternatives:
+            items.append(len(rhs))
+            items.extend(ids.setdefault(name, len(ids)) for name in rhs)
+    encoded = [name.encode('utf-8') for name in ids]
+    text = b''.join(encoded)
+    text += bytes(-len(text) % 4)
+    return b''.join([CNF_HEADER.pack(CNF_MAGIC, len(encoded), len(items)),
+                     array('I', map(len, encoded)).tobytes(), text, items.tobytes()])
+
+
+def cnf_from_bytes(data):
+    view = memoryview(data)
+    if len(view) < CNF_HEADER.size:
+        raise ValueError("Truncated CNF data")
+    magic, name_count, item_count = CNF_HEADER.unpack_from(view)
+    if magic != CNF_MAGIC:
+        raise ValueError("Not a CNF grammar in this byte order")
+    offset = CNF_HEADER.size
+    if len(view) < offset + 4 * name_count:
+        raise ValueError("Truncated CNF data")
+    lengths = view[offset:offset + 4 * name_count].cast('I')
+    offset += 4 * name_count
+    text = bytes(view[offset:offset + sum(lengths)])
+    if len(text) != sum(lengths):
+        raise ValueError("Truncated CNF data")
+    offset += len(text) + -len(text) % 4
+    if len(view) != offset + 4 * item_count:
+        raise ValueError("Truncated CNF data")
+    names = []
+    position = 0
+    for length in lengths:
+        names.append(text[position:position + length].decode('utf-8'))
+        position += length
+
+    items = view[offset:].cast('i')
+    cnf_grammar = {}
+    i = 1
+    try:
+        for _ in range(items[0]):
+            lhs, count = items[i], items[i + 1]
+            i += 2
+            alternatives = cnf_grammar[names[lhs]] = []
+            for _ in range(count):
+                rhs = items[i + 1:i + 1 + items[i]]
+                if len(rhs) != items[i]:
+                    raise ValueError("Corrupt CNF data")
+                alternatives.append(tuple(names[symbol] for symbol in rhs))
+                i += 1 + len(rhs)
+    except IndexError:
+        raise ValueError("Corrupt CNF data") from None
+    return cnf_grammar
+
+
 class CNFConverter:
+    # Works on a copy of the grammar's symbol table; rules[lhs] maps each right-hand side
+    # (a tuple of symbol ids) to None, which keeps insertion order and drops duplicates.
     def __init__(self):
-        pass
-
-    def convert_to_cnf(self, grammar_str):
-        # Parse the input grammar string
-        productions = {}
-        for production in grammar_str.split(','):
-            left, right = production.strip().split(':')
-            left = left.strip()
-            right = right.strip()
-            if left not in productions:
-                productions[left] = []
-            productions[left].append(right)
+        self.symbols = SymbolTable()
+        self.names = self.symbols.names
+        self.ids = self.symbols.ids
+        self.terminal = self.symbols.terminal
+        self.rules = {}
+        self.start = None
+        self.name_counters = {}
+        self.parents = {}
 
-        cnf_grammar = {}
+    def intern(self, name, terminal=False):
+        return self.symbols.intern(name, terminal)
+
+    def new_nonterminal(self, base):
+        name = base
+        counter = self.name_counters.get(base, 0)
+        while name in self.ids:
+            counter += 1
+            name = f"{base}{counter}"
+        self.name_counters[base] = counter
+        symbol = self.intern(name)
+        self.rules[symbol] = {}
+        return symbol
+
+    def parse(self, grammar):
+        # Accepts a Grammar or a grammar string
+        if isinstance(grammar, str):
+            grammar = parse_grammar(grammar)
+        self.__init__()
+        self.symbols = grammar.symbols.copy()
+        self.names = self.symbols.names
+        self.ids = self.symbols.ids
+        self.terminal = self.symbols.terminal
+        for symbol in range(len(self.symbols)):
+            if not self.terminal[symbol]:
+                self.rules[symbol] = {}
+        for lhs, rhs in zip(grammar.rule_lhs, grammar.rule_rhs):
+            if rhs is not None:
+                self.rules[lhs][rhs] = None
+        self.start = self.ids[grammar.start]
+
+    def convert_to_cnf(self, grammar, cache=None):
+        # With an ArtifactCache, a grammar converted before is read back from disk and the
+        # converter's own state is left as it was
+        if cache is not None:
+            if isinstance(grammar, str):
+                grammar = parse_grammar(grammar)
+            key = grammar_key(grammar, 'cnf')
+            cnf_grammar = cache.load(key, cnf_from_bytes)
+            if cnf_grammar is not None:
+                return cnf_grammar
+        self.parse(grammar)
+        self.add_start_symbol()
+        self.eliminate_terminals()
+        self.introduce_new_nonterminals()
+        self.eliminate_epsilon()
+        self.inline_chain_units()
+        self.eliminate_unit_productions()
+        cnf_grammar = self.convert_to_cnf_form()
+        if cache is not None:
+            cache.store(key, cnf_to_bytes(cnf_grammar))
+        return cnf_grammar
+
+    def add_start_symbol(self):
+        # A fresh start symbol keeps the original one off every right-hand side
+        if any(self.start in rhs for alternatives in self.rules.values() for rhs in alternatives):
+            start = self.new_nonterminal(f"{self.names[self.start]}0")
+            self.rules[start][(self.start,)] = None
+            self.start = start
+
+    def eliminate_terminals(self):
+        # Terminals inside longer rules are replaced by a_NT -> a
+        replacements = {}
+        for lhs in list(self.rules):
+            alternatives = self.rules[lhs]
+            if not any(len(rhs) > 1 and any(self.terminal[s] for s in rhs) for rhs in alternatives):
+                continue
+            updated = {}
+            for rhs in alternatives:
+                if len(rhs) > 1:
+                    rhs = tuple(self.terminal_nonterminal(s, replacements) if self.terminal[s] else s for s in rhs)
+                updated[rhs] = None
+            self.rules[lhs] = updated
+
+    def terminal_nonterminal(self, terminal, replacements):
+        symbol = replacements.get(terminal)
+        if symbol is None:
+            symbol = replacements[terminal] = self.new_nonterminal(f"{self.names[terminal]}_NT")
+            self.rules[symbol][(terminal,)] = None
+        return symbol
+
+    def introduce_new_nonterminals(self):
+        # Rules longer than two symbols become chains of binary rules
+        for lhs in list(self.rules):
+            alternatives = self.rules[lhs]
+            if all(len(rhs) <= 2 for rhs in alternatives):
+                continue
+            updated = {}
+            for rhs in alternatives:
+                head = lhs
+                while len(rhs) > 2:
+                    tail = self.new_nonterminal(f"{self.names[lhs]}_{len(rhs) - 1}")
+                    self.parents[tail] = head
+                    if head == lhs:
+                        updated[(rhs[0], tail)] = None
+                    else:
+                        self.rules[head][(rhs[0], tail)] = None
+                    head = tail
+                    rhs = rhs[1:]
+                if head == lhs:
+                    updated[rhs] = None
+                else:
+                    self.rules[head][rhs] = None
+            self.rules[lhs] = updated
 
-        self.eliminate_epsilon(productions, cnf_grammar)
-        self.eliminate_unit_productions(productions, cnf_grammar)
-        self.eliminate_terminals(productions, cnf_grammar)
-        self.introduce_new_nonterminals(productions, cnf_grammar)
-        for symbol in productions.keys():
-            cnf_grammar[symbol] = []
-        self.convert_to_cnf_form(productions, cnf_grammar)
+    def nullable_symbols(self):
+        # Fixed point with a worklist: a rule becomes nullable once its count of
+        # not-yet-nullable symbols drops to zero
+        remaining = []
+        occurrences = {}
+        rule_lhs = []
+        nullable = set()
+        worklist = []
+        for lhs, alternatives in self.rules.items():
+            for rhs in alternatives:
+                rule = len(rule_lhs)
+                rule_lhs.append(lhs)
+                remaining.append(len(rhs))
+                for symbol in rhs:
+                    occurrences.setdefault(symbol, []).append(rule)
+                if not rhs and lhs not in nullable:
+                    nullable.add(lhs)
+                    worklist.append(lhs)
+        while worklist:
+            symbol = worklist.pop()
+            for rule in occurrences.get(symbol, ()):
+                remaining[rule] -= 1
+                if remaining[rule] == 0 and rule_lhs[rule] not in nullable:
+                    nullable.add(rule_lhs[rule])
+                    worklist.append(rule_lhs[rule])
+        return nullable
 
+    def eliminate_epsilon(self):
+        # Rules are at most binary here, so each one expands into at most three
+        nullable = self.nullable_symbols()
+        for lhs, alternatives in self.rules.items():
+            updated = {}
+            for rhs in alternatives:
+                if rhs:
+                    updated[rhs] = None
+                if len(rhs) == 2:
+                    if rhs[0] in nullable:
+                        updated[rhs[1:]] = None
+                    if rhs[1] in nullable:
+                        updated[rhs[:1]] = None
+            self.rules[lhs] = updated
+        if self.start in nullable:
+            self.rules[self.start][()] = None
+
+    def inline_chain_units(self):
+        # A chain non-terminal from introduce_new_nonterminals is used in exactly one rule
+        # of its parent, so its unit rules can be moved up there instead of copying whole
+        # unit closures into every link. Deepest links go first so units keep moving up.
+        for symbol in reversed(list(self.parents)):
+            alternatives = self.rules[symbol]
+            units = [rhs[0] for rhs in alternatives if len(rhs) == 1 and not self.terminal[rhs[0]]]
+            if not units:
+                continue
+            for unit in units:
+                del alternatives[(unit,)]
+            parent_rules = self.rules[self.parents[symbol]]
+            for rhs in list(parent_rules):
+                if symbol in rhs:
+                    for unit in units:
+                        parent_rules[tuple(unit if s == symbol else s for s in rhs)] = None
+
+    def eliminate_unit_productions(self):
+        # Unit closure of every non-terminal by BFS over the A -> B graph
+        unit_targets = {}
+        for lhs, alternatives in self.rules.items():
+            unit_targets[lhs] = [rhs[0] for rhs in alternatives if len(rhs) == 1 and not self.terminal[rhs[0]]]
+        updated_rules = {}
+        for lhs, alternatives in self.rules.items():
+            reached = {lhs}
+            queue = collections.deque([lhs])
+            updated = {}
+            while queue:
+                symbol = queue.popleft()
+                for rhs in self.rules[symbol]:
+                    if len(rhs) == 1 and not self.terminal[rhs[0]]:
+                        continue
+                    if rhs or symbol == lhs:
+                        updated[rhs] = None
+                for target in unit_targets[symbol]:
+                    if target not in reached:
+                        reached.add(target)
+                        queue.append(target)
+            updated_rules[lhs] = updated
+        self.rules = updated_rules
+
+    def remove_useless_symbols(self):
+        # Productive symbols with the same counting worklist as nullable_symbols,
+        # then reachable symbols from the start over productive rules only
+        remaining = []
+        occurrences = {}
+        rule_lhs = []
+        productive = set()
+        worklist = []
+        for lhs, alternatives in self.rules.items():
+            for rhs in alternatives:
+                rule = len(rule_lhs)
+                rule_lhs.append(lhs)
+                nonterminals = [s for s in rhs if not self.terminal[s]]
+                remaining.append(len(nonterminals))
+                for symbol in nonterminals:
+                    occurrences.setdefault(symbol, []).append(rule)
+                if not nonterminals and lhs not in productive:
+                    productive.add(lhs)
+                    worklist.append(lhs)
+        while worklist:
+            symbol = worklist.pop()
+            for rule in occurrences.get(symbol, ()):
+                remaining[rule] -= 1
+                if remaining[rule] == 0 and rule_lhs[rule] not in productive:
+                    productive.add(rule_lhs[rule])
+                    worklist.append(rule_lhs[rule])
+
+        rules = {}
+        stack = [self.start] if self.start in productive else []
+        reachable = set(stack)
+        while stack:
+            lhs = stack.pop()
+            alternatives = rules[lhs] = {}
+            for rhs in self.rules[lhs]:
+                if all(self.terminal[s] or s in productive for s in rhs):
+                    alternatives[rhs] = None
+                    for symbol in rhs:
+                        if not self.terminal[symbol] and symbol not in reachable:
+                            reachable.add(symbol)
+                            stack.append(symbol)
+        self.rules = {lhs: alternatives for lhs, alternatives in self.rules.items() if lhs in rules}
+        self.rules.update((lhs, rules[lhs]) for lhs in self.rules)
+
+    def convert_to_cnf_form(self):
+        # Returns {non-terminal: [right-hand sides as tuples of symbol names]}, start symbol first
+        self.remove_useless_symbols()
+        names = self.names
+        cnf_grammar = {}
+        for lhs in sorted(self.rules, key=lambda symbol: symbol != self.start):
+            cnf_grammar[names[lhs]] = [tuple(names[s] for s in rhs) if rhs else ('ε',) for rhs in self.rules[lhs]]
         return cnf_grammar
 
-    def eliminate_epsilon(self, productions, cnf_grammar):
-        # Step 1: Identify non-terminals that can derive ε
-        epsilon_nonterminals = set()
-        for nonterminal, symbols in productions.items():
-            if "ε" in symbols:
-                epsilon_nonterminals.add(nonterminal)
-
-        # Step 2: For each epsilon-producing non-terminal, generate new productions
-        for nonterminal, symbols in productions.items():
-            new_productions = []
-            for symbol in symbols:
-                if symbol != "ε":
-                    for epsilon_set in self.power_set(epsilon_nonterminals):
-                        new_production = symbol
-                        for epsilon_symbol in epsilon_set:
-                            new_production = new_production.replace(epsilon_symbol, "")
-                        if new_production:
-                            new_productions.append(new_production)
-            cnf_grammar[nonterminal] = new_productions
-
-    def eliminate_unit_productions(self, productions, cnf_grammar):
-        # Step 1: Identify and eliminate unit productions
-        for nonterminal, symbols in productions.items():
-            unit_productions = [symbol for symbol in symbols if len(symbol) == 1 and symbol.isupper()]
-            while unit_productions:
-                unit = unit_productions.pop(0)
-                if unit in productions:
-                    for unit_symbol in productions[unit]:
-                        if unit_symbol not in cnf_grammar[nonterminal]:
-                            cnf_grammar[nonterminal].append(unit_symbol)
-                            if len(unit_symbol) == 1 and unit_symbol.isupper():
-                                unit_productions.append(unit_symbol)
-                elif unit not in cnf_grammar[nonterminal]:
-                    cnf_grammar[nonterminal].append(unit)
-
-    def eliminate_terminals(self, productions, cnf_grammar):
-        # Step 1: Identify and replace terminals with corresponding non-terminals
-        terminal_productions = [(nonterminal, symbol) for nonterminal, symbols in productions.items() for symbol in symbols if len(symbol) == 1 and not symbol.isupper()]
-        terminal_symbols = set(symbol for _, symbol in terminal_productions)
-
-        # Introduce new non-terminal symbols for terminals
-        new_nonterminals = {}
-        for symbol in terminal_symbols:
-            new_nonterminal = f"{symbol}_NT"
-            new_nonterminals[symbol] = new_nonterminal
-            cnf_grammar[new_nonterminal] = [symbol]
-
-        # Replace terminals with corresponding non-terminals
-        for nonterminal, symbol in terminal_productions:
-            if symbol in cnf_grammar[nonterminal]:
-                cnf_grammar[nonterminal].remove(symbol)
-                cnf_grammar[nonterminal].append(new_nonterminals[symbol])
-
-        # Ensure introduced non-terminals are in all productions
-        for _, symbol in terminal_productions:
-            for nonterminal in cnf_grammar:
-                if symbol not in cnf_grammar[nonterminal]:
-                    cnf_grammar[nonterminal].append(new_nonterminals[symbol])
-
-    def introduce_new_nonterminals(self, productions, cnf_grammar):
-        # Introduce new non-terminal symbols for any remaining terminal symbols
-        terminal_symbols = set(symbol for symbols in productions.values() for symbol in symbols if len(symbol) == 1 and not symbol.isupper())
-        for symbol in terminal_symbols:
-            if symbol not in cnf_grammar:
-                new_nonterminal = f"{symbol}_NT"
-                cnf_grammar[new_nonterminal] = [symbol]
-
-    def convert_to_cnf_form(self, productions, cnf_grammar):
-        # Convert productions to Chomsky Normal Form
-        for nonterminal, symbols in productions.items():
-            new_productions = []
-            for symbol in symbols:
-                if len(symbol) > 2:
-                    # Split the production into binary productions
-                    for i in range(len(symbol) - 1):
-                        binary_production = symbol[i:i + 2]
-                        if binary_production not in new_productions:
-                            new_productions.append(binary_production)
+
+# CYKParser.recognize switches to recognize_dense once more than DENSE_FILL of the cells
+# in the first DENSE_MIN_COLUMNS or more columns are filled, if NumPy is there and the
+# dense arrays fit in DENSE_MAX_BYTES. combine() memoizes at most COMBINED_LIMIT pairs.
+DENSE_FILL = 0.1
+DENSE_MIN_COLUMNS = 32
+DENSE_MAX_BYTES = 1 << 28
+COMBINED_LIMIT = 1 << 16
+
+
+class CYKParser:
+    # CYK over the dict returned by CNFConverter.convert_to_cnf. Every table cell is an
+    # int bitmask over the non-terminals; binary rules are indexed by their left child.
+    def __init__(self, cnf_grammar, start=None):
+        self.names = list(cnf_grammar)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        # convert_to_cnf returns {} for a grammar whose language is empty: there is no
+        # start symbol and no terminal rule, so the table rejects every input
+        if start is None and self.names:
+            start = self.names[0]
+        self.start = self.ids[start] if start is not None else None
+        self.accepts_empty = False
+        self.terminal_masks = {}
+        self.pair_index = {}
+        for lhs, alternatives in cnf_grammar.items():
+            bit = 1 << self.ids[lhs]
+            for rhs in alternatives:
+                if rhs == ('ε',):
+                    self.accepts_empty = self.accepts_empty or self.ids[lhs] == self.start
+                elif len(rhs) == 1:
+                    self.terminal_masks[rhs[0]] = self.terminal_masks.get(rhs[0], 0) | bit
+                else:
+                    pair = (self.ids[rhs[0]], self.ids[rhs[1]])
+                    self.pair_index[pair] = self.pair_index.get(pair, 0) | bit
+        # by_left[B] lists (bit of C, mask of every A with A -> B C)
+        self.by_left = [[] for _ in self.names]
+        for (left, right), lhs_mask in self.pair_index.items():
+            self.by_left[left].append((1 << right, lhs_mask))
+        self._combined = {}
+
+    def combine(self, left, right):
+        key = (left, right)
+        result = self._combined.get(key)
+        if result is None:
+            result = 0
+            by_left = self.by_left
+            mask = left
+            while mask:
+                low = mask & -mask
+                for right_bit, lhs_mask in by_left[low.bit_length() - 1]:
+                    if right & right_bit:
+                        result |= lhs_mask
+                mask ^= low
+            if len(self._combined) >= COMBINED_LIMIT:
+                self._combined.clear()
+            self._combined[key] = result
+        return result
+
+    def table(self, symbols, dense_fill=None):
+        # ending_at[j][i] is the mask of non-terminals deriving symbols[i:j]; only
+        # non-empty cells are stored. Splits k are visited right to left, so cell (k, j)
+        # is complete before it is combined with the cells ending at k. With dense_fill,
+        # the table is abandoned (False) once more than that fraction of the cells in its
+        # first DENSE_MIN_COLUMNS or more columns are filled.
+        n = len(symbols)
+        ending_at = [{} for _ in range(n + 1)]
+        combine = self.combine
+        filled = 0
+        for j in range(1, n + 1):
+            column = ending_at[j]
+            mask = self.terminal_masks.get(symbols[j - 1], 0)
+            if not mask:
+                return None
+            column[j - 1] = mask
+            for k in range(j - 1, 0, -1):
+                right = column.get(k)
+                if not right:
+                    continue
+                for i, left in ending_at[k].items():
+                    lhs_mask = combine(left, right)
+                    if lhs_mask:
+                        column[i] = column.get(i, 0) | lhs_mask
+            if dense_fill is not None:
+                filled += len(column)
+                if j >= DENSE_MIN_COLUMNS and filled > dense_fill * j * (j + 1) / 2:
+                    return False
+        return ending_at
+
+    def recognize(self, symbols, dense=None):
+        # recognize_dense only pays off when a good part of the table is filled, as with
+        # ambiguous grammars; the sparse table is faster otherwise. dense=None starts sparse
+        # and switches once the table turns out to be dense, True and False force either.
+        if not symbols:
+            return self.accepts_empty
+        if dense:
+            if numpy is None:
+                raise ValueError("dense CYK needs NumPy")
+            return self.recognize_dense(symbols)
+        if dense is None and numpy is not None and 2 * len(self.names) * (len(symbols) + 1) ** 2 <= DENSE_MAX_BYTES:
+            ending_at = self.table(symbols, DENSE_FILL)
+            if ending_at is False:
+                return self.recognize_dense(symbols)
+        else:
+            ending_at = self.table(symbols)
+        return ending_at is not None and bool(ending_at[-1].get(0, 0) >> self.start & 1)
+
+    def recognize_dense(self, symbols):
+        # NumPy variant: by_start[A][i, l] and by_end[A][j, l] say whether A derives the span
+        # of length l starting at i / ending at j. For each length, all start positions and
+        # split points are handled with one boolean AND per rule. Both arrays take
+        # (non-terminals * n * n) bytes, and every rule is ANDed at every length whether its
+        # cells are empty or not.
+        n = len(symbols)
+        count = len(self.names)
+        by_start = numpy.zeros((count, n + 1, n + 1), dtype=bool)
+        by_end = numpy.zeros((count, n + 1, n + 1), dtype=bool)
+        for i, symbol in enumerate(symbols):
+            mask = self.terminal_masks.get(symbol, 0)
+            if not mask:
+                return False
+            for a in range(count):
+                if mask >> a & 1:
+                    by_start[a, i, 1] = True
+                    by_end[a, i + 1, 1] = True
+        rules = [(b, c, a) for (b, c), lhs_mask in self.pair_index.items()
+                 for a in range(count) if lhs_mask >> a & 1]
+        for length in range(2, n + 1):
+            starts = n - length + 1
+            for b, c, a in rules:
+                # left: B derives [i, i + s); right: C derives [i + s, i + length)
+                left = by_start[b, :starts, 1:length]
+                right = by_end[c, length:n + 1, length - 1:0:-1]
+                hits = (left & right).any(axis=1)
+                by_start[a, :starts, length] |= hits
+                by_end[a, length:n + 1, length] |= hits
+        return bool(by_start[self.start, 0, n])
+
+    def count_parses(self, symbols):
+        # Number of distinct parse trees, with exact big-integer counts per cell
+        if not symbols:
+            return 1 if self.accepts_empty else 0
+        ending_at = self.table(symbols)
+        if ending_at is None or not ending_at[-1].get(0, 0) >> self.start & 1:
+            return 0
+        n = len(symbols)
+        rules_by_left = [[(right_bit.bit_length() - 1, lhs_mask) for right_bit, lhs_mask in pairs]
+                         for pairs in self.by_left]
+        counts = [{} for _ in range(n + 1)]
+        for j in range(1, n + 1):
+            column = counts[j]
+            column[j - 1] = {a: 1 for a in self._bits(self.terminal_masks[symbols[j - 1]])}
+            for k in range(j - 1, 0, -1):
+                right = column.get(k)
+                if not right:
+                    continue
+                for i, left in counts[k].items():
+                    cell = column.get(i)
+                    for b, left_count in left.items():
+                        for c, lhs_mask in rules_by_left[b]:
+                            right_count = right.get(c)
+                            if right_count:
+                                if cell is None:
+                                    cell = column[i] = {}
+                                for a in self._bits(lhs_mask):
+                                    cell[a] = cell.get(a, 0) + left_count * right_count
+        return counts[n].get(0, {}).get(self.start, 0)
+
+    def parse(self, symbols):
+        # One parse tree as nested lists [name, children...], or None
+        if not symbols:
+            return [self.names[self.start], 'ε'] if self.accepts_empty else None
+        ending_at = self.table(symbols)
+        if ending_at is None or not ending_at[-1].get(0, 0) >> self.start & 1:
+            return None
+        root = [self.names[self.start]]
+        stack = [(self.start, 0, len(symbols), root)]
+        while stack:
+            a, i, j, node = stack.pop()
+            if j == i + 1:
+                node.append(symbols[i])
+                continue
+            for (b, c), lhs_mask in self.pair_index.items():
+                if not lhs_mask >> a & 1:
+                    continue
+                k = next((k for k in range(i + 1, j)
+                          if ending_at[k].get(i, 0) >> b & 1 and ending_at[j].get(k, 0) >> c & 1), None)
+                if k is not None:
+                    left, right = [self.names[b]], [self.names[c]]
+                    node.extend((left, right))
+                    stack.append((c, k, j, right))
+                    stack.append((b, i, k, left))
+                    break
+        return root
+
+    def _bits(self, mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+
+class SPPFNode:
+    # Shared packed parse forest node. label is (symbol, start, end) for symbol nodes and
+    # ((rule, dot), start, end) for intermediate nodes; every key of families is one
+    # packed alternative, a tuple of one or two child nodes.
+    __slots__ = ('label', 'families')
+
+    def __init__(self, label):
+        self.label = label
+        self.families = {}
+
+    def __repr__(self):
+        return f'SPPFNode({self.label}, {len(self.families)} families)'
+
+
+class EarleyParser:
+    # General CFG parser over a Grammar or a 'S:bA, S:BC, ...' string. Both recognize()
+    # and parse() apply Leo's optimisation so right recursion stays linear; parse() builds
+    # a shared packed parse forest with Scott's algorithm, so ambiguous inputs never
+    # enumerate trees.
+    def __init__(self, grammar):
+        if isinstance(grammar, str):
+            grammar = parse_grammar(grammar)
+        symbols = grammar.symbols
+        self.ids = symbols.ids
+        self.rules = list(zip(grammar.rule_lhs, grammar.rule_rhs))
+        self.rules_for = {symbol: grammar.rules_for[symbol] for symbol in range(len(symbols))
+                          if not symbols.terminal[symbol]}
+        self.start = self.ids[grammar.start]
+        self.nullable = self.nullable_symbols()
+        # Augmented rule -> start: a completed start item can be
+        # skipped over by a Leo chain, but the augmented item never is.
+        # Its left-hand side is a fresh id whose name is None.
+        self.names = symbols.names + [None]
+        self.accept_rule = len(self.rules)
+        self.rules.append((len(symbols), (self.start,)))
+
+    def tokens(self, symbols):
+        # Input symbols as ids; anything outside the grammar becomes -1 and never matches
+        ids = self.ids
+        return [ids.get(symbol, -1) for symbol in symbols]
+
+    def is_nonterminal(self, symbol):
+        return self.ids.get(symbol) in self.rules_for
+
+    def nullable_symbols(self):
+        nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for lhs, rhs in self.rules:
+                if lhs not in nullable and all(symbol in nullable for symbol in rhs):
+                    nullable.add(lhs)
+                    changed = True
+        return nullable
+
+    def recognize(self, symbols):
+        symbols = self.tokens(symbols)
+        n = len(symbols)
+        rules = self.rules
+        rules_for = self.rules_for
+        nullable = self.nullable
+        sets = [[] for _ in range(n + 1)]
+        seen = [set() for _ in range(n + 1)]
+        waiting = [{} for _ in range(n + 1)]
+        leo_memo = {}
+
+        def add(i, item):
+            if item not in seen[i]:
+                seen[i].add(item)
+                sets[i].append(item)
+
+        add(0, (self.accept_rule, 0, 0))
+
+        for i in range(n + 1):
+            items = sets[i]
+            predicted = set()
+            index = 0
+            while index < len(items):
+                item = items[index]
+                index += 1
+                rule, dot, origin = item
+                lhs, rhs = rules[rule]
+                if dot < len(rhs):
+                    symbol = rhs[dot]
+                    if symbol in rules_for:
+                        waiting[i].setdefault(symbol, []).append(item)
+                        if symbol not in predicted:
+                            predicted.add(symbol)
+                            for predicted_rule in rules_for[symbol]:
+                                add(i, (predicted_rule, 0, i))
+                        # Aycock-Horspool: step over nullable symbols right away
+                        if symbol in nullable:
+                            add(i, (rule, dot + 1, origin))
+                    elif i < n and symbols[i] == symbol:
+                        add(i + 1, (rule, dot + 1, origin))
+                elif origin != i:
+                    top = self.leo_item(origin, lhs, waiting, leo_memo)
+                    if top is not None:
+                        add(i, top)
+                    else:
+                        for waiting_rule, waiting_dot, waiting_origin in waiting[origin].get(lhs, ()):
+                            add(i, (waiting_rule, waiting_dot + 1, waiting_origin))
+            if i < n and not sets[i + 1]:
+                return False
+
+        return (self.accept_rule, 1, 0) in seen[n]
+
+    def leo_item(self, origin, symbol, waiting, memo):
+        # Topmost completed item of the deterministic reduction path above (symbol, origin):
+        # while exactly one item waits on the symbol and the symbol is its last one,
+        # completing it can only complete that item, so the whole chain is skipped
+        chain = []
+        key = (origin, symbol)
+        while key not in memo:
+            waiters = waiting[key[0]].get(key[1], ())
+            if len(waiters) != 1:
+                memo[key] = None
+                break
+            rule, dot, waiter_origin = waiters[0][:3]
+            if dot + 1 != len(self.rules[rule][1]):
+                memo[key] = None
+                break
+            chain.append((key, (rule, dot + 1, waiter_origin)))
+            memo[key] = None  # guards against cycles while the chain is followed
+            key = (waiter_origin, self.rules[rule][0])
+        top = memo[key]
+        for chain_key, completed in reversed(chain):
+            if top is None:
+                top = completed
+            memo[chain_key] = top
+        return top
+
+    def parse(self, symbols):
+        # Returns the root SPPFNode labelled (start, 0, n), or None if the input is rejected.
+        # Leo chains are used here as well: the top node of a chain only records which
+        # completion it stands for, and is expanded once the forest is known to reach it.
+        tokens = self.tokens(symbols)
+        n = len(symbols)
+        rules = self.rules
+        rules_for = self.rules_for
+        names = self.names
+
+        def starts_with_nonterminal(rhs, position):
+            return position == len(rhs) or rhs[position] in rules_for
+
+        def make_node(rule, dot, start, end, w, v):
+            lhs, rhs = rules[rule]
+            if dot == 1 and dot < len(rhs):
+                return v
+            label = (names[lhs] if dot == len(rhs) else (rule, dot), start, end)
+            nodes = nodes_at[end]
+            node = nodes.get(label)
+            if node is None:
+                node = nodes[label] = SPPFNode(label)
+            node.families[(v,) if w is None else (w, v)] = None
+            return node
+
+        sets = [[] for _ in range(n + 1)]
+        seen = [set() for _ in range(n + 1)]
+        waiting = [{} for _ in range(n + 1)]
+        nodes_at = [{} for _ in range(n + 1)]
+        leo_memo = {}
+        deferred = {}
+        next_scan = []
+        accept_item = (self.accept_rule, 0, 0, None)
+        seen[0].add(accept_item)
+        sets[0].append(accept_item)
+
+        for i in range(n + 1):
+            completed_empty = {}
+            items = sets[i]
+            scan = next_scan
+            next_scan = []
+            predicted = set()
+
+            def advance(rule, dot, origin, node):
+                rhs = rules[rule][1]
+                item = (rule, dot, origin, node)
+                if starts_with_nonterminal(rhs, dot):
+                    if item not in seen[i]:
+                        seen[i].add(item)
+                        items.append(item)
+                elif i < n and rhs[dot] == tokens[i]:
+                    scan.append(item)
+
+            index = 0
+            while index < len(items):
+                rule, dot, origin, w = items[index]
+                index += 1
+                lhs, rhs = rules[rule]
+                if dot < len(rhs):
+                    symbol = rhs[dot]
+                    waiting[i].setdefault(symbol, []).append((rule, dot, origin, w))
+                    if symbol not in predicted:
+                        predicted.add(symbol)
+                        for predicted_rule in rules_for[symbol]:
+                            advance(predicted_rule, 0, i, None)
+                    if symbol in completed_empty:
+                        y = make_node(rule, dot + 1, origin, i, w, completed_empty[symbol])
+                        advance(rule, dot + 1, origin, y)
+                    continue
+
+                if w is None:
+                    label = (names[lhs], i, i)
+                    w = nodes_at[i].get(label)
+                    if w is None:
+                        w = nodes_at[i][label] = SPPFNode(label)
+                    w.families[()] = None
+                if origin == i:
+                    completed_empty[lhs] = w
                 else:
-                    # If the production has at most two symbols, add it unchanged
-                    if symbol not in new_productions:
-                        new_productions.append(symbol)
-
-            # Replace symbols with corresponding non-terminals
-            for i in range(len(new_productions)):
-                if len(new_productions[i]) == 1 and not new_productions[i].isupper():
-                    if new_productions[i] in cnf_grammar:
-                        new_productions[i] = f"{new_productions[i]}_NT"
-
-            # Update the CNF grammar
-            cnf_grammar[nonterminal] = new_productions
-
-    def power_set(self, s):
-        s = list(s)
-        return [set(s[j] for j in range(len(s)) if (i >> j) & 1) for i in range(2 ** len(s))]
+                    top = self.leo_item(origin, lhs, waiting, leo_memo)
+                    if top is not None:
+                        top_rule, top_dot, top_origin = top
+                        label = (names[rules[top_rule][0]], top_origin, i)
+                        node = nodes_at[i].get(label)
+                        if node is None:
+                            node = nodes_at[i][label] = SPPFNode(label)
+                        deferred.setdefault(node, {})[((origin, lhs), w)] = None
+                        advance(top_rule, top_dot, top_origin, node)
+                        continue
+                for waiting_rule, waiting_dot, waiting_origin, z in list(waiting[origin].get(lhs, ())):
+                    y = make_node(waiting_rule, waiting_dot + 1, waiting_origin, i, z, w)
+                    advance(waiting_rule, waiting_dot + 1, waiting_origin, y)
+
+            if i == n:
+                break
+            token = SPPFNode((symbols[i], i, i + 1))
+            for rule, dot, origin, w in scan:
+                y = make_node(rule, dot + 1, origin, i + 1, w, token)
+                rhs = rules[rule][1]
+                item = (rule, dot + 1, origin, y)
+                if starts_with_nonterminal(rhs, dot + 1):
+                    if item not in seen[i + 1]:
+                        seen[i + 1].add(item)
+                        sets[i + 1].append(item)
+                elif i + 1 < n and rhs[dot + 1] == tokens[i + 1]:
+                    next_scan.append(item)
+            if not sets[i + 1] and not next_scan:
+                return None
+
+        accepted = [w for rule, dot, origin, w in sets[n] if rule == self.accept_rule and dot == 1]
+        if not accepted:
+            return None
+        root = accepted[0]
+
+        # Expand the deferred Leo chains that the finished forest actually reaches
+        visited = {root}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            end = node.label[2]
+            for (origin, symbol), child in deferred.pop(node, ()):
+                while True:
+                    waiting_rule, waiting_dot, waiting_origin, z = waiting[origin][symbol][0]
+                    child = make_node(waiting_rule, waiting_dot + 1, waiting_origin, end, z, child)
+                    origin, symbol = waiting_origin, rules[waiting_rule][0]
+                    if child is node:
+                        break
+            for family in node.families:
+                for child in family:
+                    if child not in visited:
+                        visited.add(child)
+                        stack.append(child)
+        # The augmented node has the single family (start node,)
+        return next(iter(root.families))[0]
+
+    def count_derivations(self, root):
+        # Number of parse trees in a forest; cyclic forests (infinitely ambiguous) raise
+        counts = {}
+        on_stack = set()
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                on_stack.discard(node)
+                total = 0
+                for family in node.families:
+                    product = 1
+                    for child in family:
+                        product *= counts[child]
+                    total += product
+                counts[node] = total
+                continue
+            if node in counts:
+                continue
+            if node in on_stack:
+                raise ValueError(f"Infinitely many derivations through {node.label}")
+            on_stack.add(node)
+            stack.append((node, True))
+            if not node.families and isinstance(node.label[0], str) and node.label[2] == node.label[1] + 1:
+                counts[node] = 1
+                stack.pop()
+                on_stack.discard(node)
+                continue
+            for family in node.families:
+                for child in family:
+                    if child not in counts:
+                        stack.append((child, False))
+        return counts[root]
 
 
 def get_input_grammar():
@@ -1,4 +1,13 @@
+import bisect
 import enum
+import functools
+import itertools
+import math
+import random
+import re
+import sys
+import time
+from array import array
 
 class TokenType(enum.Enum):
     EOF = -1
@@ -13,104 +22,269 @@ class TokenType(enum.Enum):
     IF = -10
     THEN = -11
     ELSE = -12
+    ERROR = -13
+
+    # Members are singletons, so identity hashing is enough; Enum.__hash__ is a Python call
+    # on every dict lookup the parsers make
+    __hash__ = object.__hash__
+
+# Binary operators by precedence; all of them are left-associative
+BINARY_PRECEDENCE = {'<': 10, '>': 10, '+': 20, '-': 20, '*': 40, '/': 40}
+
+class ParseError(Exception):
+    def __init__(self, message, token=None):
+        if token is not None and token.source is not None:
+            line, column = token.position()
+            message = f'{message} at line {line}, column {column}'
+        super().__init__(message)
+        self.token = token
+
+class SourceText:
+    # The lexer input with the offsets of its tokens and of every line start. ASCII input is
+    # tokenized identically by TOKEN_PATTERN, so its offsets are left to one regex pass on the
+    # first lookup; for other input the character loop records them as it makes each token.
+    def __init__(self, text):
+        self.text = text
+        self.starts = array('q')
+        self.ends = array('q')
+        self.lazy = text.isascii()
+        self.line_starts = None
+
+    def span(self, index):
+        # (start, end) of token index; tokens past the last one (EOF) sit at the end
+        if self.lazy:
+            self.scan()
+        if 0 <= index < len(self.starts):
+            return self.starts[index], self.ends[index]
+        return len(self.text), len(self.text)
+
+    def scan(self):
+        self.lazy = False
+        text = self.text
+        for match in TOKEN_PATTERN.finditer(text):
+            start, end = match.span()
+            if text[start] != '#':
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def position(self, offset):
+        # 1-based (line, column) of an offset
+        if self.line_starts is None:
+            self.line_starts = array('q', [0])
+            self.line_starts.extend(match.end() for match in re.finditer('\n', self.text))
+        line = bisect.bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
 
 class Token:
-    def __init__(self, type, value):
+    # index is the token's place in its lexer's output, which source maps to offsets;
+    # tokens made outside a lexer have no source. Number tokens keep their lexeme as value:
+    # the parser converts it when it builds the Number node.
+    __slots__ = ('type', 'value', 'index', 'source')
+
+    def __init__(self, type, value, index=-1, source=None):
         self.type = type
         self.value = value
+        self.index = index
+        self.source = source
+
+    @property
+    def start(self):
+        return self.source.span(self.index)[0] if self.source is not None else -1
+
+    @property
+    def end(self):
+        return self.source.span(self.index)[1] if self.source is not None else -1
+
+    @property
+    def text(self):
+        if self.source is None:
+            return '' if self.value is None else str(self.value)
+        start, end = self.source.span(self.index)
+        return self.source.text[start:end]
+
+    def position(self):
+        return self.source.position(self.start)
+
+    @property
+    def line(self):
+        return self.position()[0]
+
+    @property
+    def column(self):
+        return self.position()[1]
 
     def __repr__(self):
         return f'Token({self.type}, {repr(self.value)})'
 
+KEYWORDS = {
+    'def': TokenType.DEF,
+    'extern': TokenType.EXTERN,
+    'if': TokenType.IF,
+    'then': TokenType.THEN,
+    'else': TokenType.ELSE,
+}
+
+# Token type of every fixed lexeme; other lexemes are identifiers, numbers or comments
+LEXEME_TYPES = dict(KEYWORDS)
+LEXEME_TYPES.update({op: TokenType.OPERATOR for op in '+-*/<>'})
+LEXEME_TYPES.update({'(': TokenType.LPAREN, ')': TokenType.RPAREN, ',': TokenType.COMMA,
+                     '=': TokenType.DEF, '?': TokenType.EXTERN})
+
+# One findall over the whole input; characters no alternative matches are skipped, just
+# as get_next_token skips them. ASCII only: isalpha/isdigit differ from \w and \d beyond it.
+TOKEN_PATTERN = re.compile(r'[A-Za-z_]\w*|[0-9.]+|[-+*/<>(),=?]|#[^\n]*', re.ASCII)
+NUMBER_START = frozenset('0123456789.')
+
+# Runs get_next_token takes in one match: \s and \w agree with isspace and with isalnum
+# or '_' on all of Unicode; \d is only isdecimal, so a number run also resumes past any
+# other isdigit character
+SPACE_RUN = re.compile(r'\s*')
+WORD_RUN = re.compile(r'\w*')
+NUMBER_RUN = re.compile(r'[\d.]*')
+
+# Characters get_next_token tokenizes at once, rounded up to the end of a line
+BLOCK_SIZE = 1 << 16
+
+def valid_number(lexeme):
+    # A run of digits and dots is a float literal iff it has one dot at most and a digit
+    return lexeme.count('.') <= 1 and lexeme != '.'
+
+class LexemeTypes(dict):
+    # LEXEME_TYPES extended with each identifier the first time it is seen, which is also
+    # when it is interned into symbols, so typing a name is one C-level lookup. Numbers and
+    # comments are classified on every lookup and never kept: a long-lived lexer would
+    # otherwise hold on to every literal it ever read.
+    def __init__(self, symbols):
+        super().__init__(LEXEME_TYPES)
+        self.symbols = symbols
+
+    def __missing__(self, lexeme):
+        if lexeme[0] == '#':
+            return None
+        if lexeme[0] in NUMBER_START:
+            return TokenType.NUMBER if valid_number(lexeme) else TokenType.ERROR
+        self.symbols.setdefault(lexeme, lexeme)
+        self[lexeme] = TokenType.IDENTIFIER
+        return TokenType.IDENTIFIER
+
 class Lexer:
-    def __init__(self, input_text):
+    # Names are interned through symbols, which callers may share between lexers so
+    # repeated names are one string object; numbers are never interned
+    def __init__(self, input_text, symbols=None):
         self.input_text = input_text
+        self.source = SourceText(input_text)
+        self.symbols = {} if symbols is None else symbols
+        self.lexeme_types = LexemeTypes(self.symbols)
+        self.pending = iter(())
         self.pos = 0
-        self.current_char = input_text[self.pos]
-
-    def advance(self):
-        self.pos += 1
-        if self.pos >= len(self.input_text):
-            self.current_char = None
-        else:
-            self.current_char = self.input_text[self.pos]
+        self.count = 0
+        if input_text.isascii():
+            # tokenize_block tokenizes ASCII input a block of lines at a time, and handing
+            # the tokens out is then one C-level call each, as in TokenReplay
+            self.get_next_token = itertools.chain.from_iterable(self.blocks()).__next__
 
-    def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
+    def blocks(self):
+        # Iterators over the blocks, the current one kept as pending, then EOF for good.
+        # Past the end get_next_token itself returns EOF, so the lexer drops its binding,
+        # and with it the reference cycle through this generator.
+        text = self.input_text
+        while self.pos < len(text):
+            self.pending = iter(self.tokenize_block(text.find('\n', self.pos + BLOCK_SIZE) + 1 or len(text)))
+            yield self.pending
+        del self.get_next_token
+        yield itertools.repeat(Token(TokenType.EOF, None, self.count, self.source))
 
     def get_next_token(self):
-        while self.current_char is not None:
-            if self.current_char.isspace():
-                self.skip_whitespace()
+        # The next token of non-ASCII input, recording its offsets; whitespace, name and
+        # number runs are each one regex match from pos
+        text = self.input_text
+        pos = self.pos
+        while True:
+            pos = SPACE_RUN.match(text, pos).end()
+            if pos >= len(text):
+                break
+            char = text[pos]
+            if char.isalpha() or char == '_':
+                end = WORD_RUN.match(text, pos + 1).end()
+                lexeme = text[pos:end]
+                lexeme = self.symbols.setdefault(lexeme, lexeme)
+                token_type = KEYWORDS.get(lexeme, TokenType.IDENTIFIER)
+            elif char.isdigit() or char == '.':
+                end = NUMBER_RUN.match(text, pos + 1).end()
+                while end < len(text) and text[end].isdigit():
+                    end = NUMBER_RUN.match(text, end + 1).end()
+                lexeme = text[pos:end]
+                # An invalid one is reported by the parser when it reaches it, not while looking ahead
+                token_type = TokenType.NUMBER if valid_number(lexeme) else TokenType.ERROR
+            elif char in LEXEME_TYPES:
+                end = pos + 1
+                lexeme = char
+                token_type = LEXEME_TYPES[char]
+            elif char == '#':
+                pos = text.find('\n', pos)
+                if pos < 0:
+                    break
                 continue
-
-            if self.current_char.isalpha() or self.current_char == '_':
-                return self.get_identifier()
-
-            if self.current_char.isdigit() or self.current_char == '.':
-                return self.get_number()
-
-            if self.current_char in {'+', '-', '*', '/'}:
-                op = self.current_char
-                self.advance()
-                return Token(TokenType.OPERATOR, op)
-
-            if self.current_char == '(':
-                self.advance()
-                return Token(TokenType.LPAREN, '(')
-            if self.current_char == ')':
-                self.advance()
-                return Token(TokenType.RPAREN, ')')
-            if self.current_char == ',':
-                self.advance()
-                return Token(TokenType.COMMA, ',')
-
-            if self.current_char == '=':
-                self.advance()
-                return Token(TokenType.DEF, '=')
-
-            if self.current_char == '?':
-                self.advance()
-                return Token(TokenType.EXTERN, '?')
-
-            if self.current_char == '#':
-                while self.current_char is not None and self.current_char != '\n':
-                    self.advance()
+            else:
+                pos += 1
                 continue
+            self.pos = end
+            self.source.starts.append(pos)
+            self.source.ends.append(end)
+            self.count += 1
+            return Token(token_type, lexeme, self.count - 1, self.source)
+        self.pos = len(text)
+        return Token(TokenType.EOF, None, self.count, self.source)
 
-            self.advance()
+    def tokenize_block(self, end):
+        # The tokens of ASCII input from pos to end, which must not fall inside a token: one
+        # findall slices the lexemes, and typing, interning and building the tokens are maps
+        # that never return to a Python loop per token. Typing interns the names, so
+        # symbols.get hands back the interned name and leaves every other lexeme as it is.
+        # Offsets are left to SourceText.
+        lexemes = TOKEN_PATTERN.findall(self.input_text, self.pos, end)
+        types = list(map(self.lexeme_types.__getitem__, lexemes))
+        if None in types:
+            lexemes = list(itertools.compress(lexemes, types))
+            types = list(filter(None, types))
+        values = map(self.symbols.get, lexemes, lexemes)
+        first = self.count
+        self.count += len(types)
+        self.pos = end
+        return list(map(Token, types, values, range(first, self.count), itertools.repeat(self.source)))
 
-        return Token(TokenType.EOF, None)
+    def tokenize(self):
+        tokens = []
+        token = self.get_next_token()
+        while token.type != TokenType.EOF:
+            tokens.append(token)
+            token = self.get_next_token()
+        return tokens
 
-    def get_identifier(self):
-        result = ''
-        while self.current_char is not None and (self.current_char.isalnum() or self.current_char == '_'):
-            result += self.current_char
-            self.advance()
+    def tokenize_fast(self):
+        # Same tokens as tokenize(), as one block after what is left of the current one
+        if not self.input_text.isascii():
+            return self.tokenize()
+        tokens = list(self.pending)
+        tokens += self.tokenize_block(len(self.input_text))
+        return tokens
 
-        if result == 'def':
-            return Token(TokenType.DEF, result)
-        elif result == 'if':
-            return Token(TokenType.IF, result)
-        elif result == 'then':
-            return Token(TokenType.THEN, result)
-        elif result == 'else':
-            return Token(TokenType.ELSE, result)
-        else:
-            return Token(TokenType.IDENTIFIER, result)
-
-    def get_number(self):
-        result = ''
-        while self.current_char is not None and (self.current_char.isdigit() or self.current_char == '.'):
-            result += self.current_char
-            self.advance()
-        return Token(TokenType.NUMBER, float(result))
+    def stream(self):
+        # The tokens one at a time, ending with EOF: a parser fed from it never holds more
+        # than its lookahead and one block, and parses while the input is still being scanned
+        token = self.get_next_token()
+        while token.type != TokenType.EOF:
+            yield token
+            token = self.get_next_token()
+        yield token
 
 class ASTNode:
-    pass
+    # Nodes use __slots__: no per-instance __dict__, and far less memory per node
+    __slots__ = ()
 
 class Number(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -118,6 +292,8 @@ class Number(ASTNode):
         return f'Number({self.value})'
 
 class Identifier(ASTNode):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
@@ -125,6 +301,8 @@ class Identifier(ASTNode):
         return f'Identifier({self.name})'
 
 class BinaryOp(ASTNode):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
@@ -134,14 +312,20 @@ class BinaryOp(ASTNode):
         return f'BinaryOp({self.left}, {self.op}, {self.right})'
 
 class FunctionCall(ASTNode):
-    def __init__(self, name, args):
+    # tail is set by TailCallMarking on calls whose value the function returns directly
+    __slots__ = ('name', 'args', 'tail')
+
+    def __init__(self, name, args, tail=False):
         self.name = name
         self.args = args
+        self.tail = tail
 
     def __repr__(self):
         return f'FunctionCall({self.name}, {self.args})'
 
 class FunctionDef(ASTNode):
+    __slots__ = ('name', 'params', 'body')
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
@@ -151,6 +335,8 @@ class FunctionDef(ASTNode):
         return f'FunctionDef({self.name}, {self.params}, {self.body})'
 
 class IfStatement(ASTNode):
+    __slots__ = ('condition', 'then_branch', 'else_branch')
+
     def __init__(self, condition, then_branch, else_branch):
         self.condition = condition
         self.then_branch = then_branch
@@ -159,6 +345,344 @@ class IfStatement(ASTNode):
     def __repr__(self):
         return f'IfStatement({self.condition}, {self.then_branch}, {self.else_branch})'
 
+class Extern(ASTNode):
+    __slots__ = ('name', 'params')
+
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+
+    def __repr__(self):
+        return f'Extern({self.name}, {self.params})'
+
+class ASTArena:
+    # Flat AST: node i is kinds[i] with operands a[i], b[i], c[i]. Names and operators are
+    # interned into names, numbers live in constants, and variable-length lists (params,
+    # args) live in extra as a count followed by the items. Children are always stored
+    # before their parent, so bottom-up walks are a single forward loop over the arrays.
+    #   NUMBER      a = constant index
+    #   IDENTIFIER  a = name id
+    #   BINARY      a = left, b = right, c = operator name id
+    #   CALL        a = name id, b = offset of the argument nodes in extra, c = tail flag
+    #   FUNCTION    a = name id, b = offset of the parameter name ids in extra, c = body
+    #   IF          a = condition, b = then branch, c = else branch
+    #   EXTERN      a = name id, b = offset of the parameter name ids in extra
+    NUMBER, IDENTIFIER, BINARY, CALL, FUNCTION, IF, EXTERN = range(7)
+
+    def __init__(self):
+        self.kinds = array('b')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('i')
+        self.extra = array('i')
+        self.constants = array('d')
+        self.names = []
+        self.name_ids = {}
+        self.roots = []
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def add_list(self, items):
+        offset = len(self.extra)
+        self.extra.append(len(items))
+        self.extra.extend(items)
+        return offset
+
+    def emit(self, kind, a, b=0, c=0):
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        return len(self.kinds) - 1
+
+    def add(self, tree):
+        # Appends a tree in post-order without recursion and returns its root index
+        index_of = {}
+        stack = [(tree, False)]
+        while stack:
+            node, ready = stack.pop()
+            if not ready:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(self.children(node)))
+                continue
+            cls = node.__class__
+            if cls is Number:
+                self.constants.append(node.value)
+                index = self.emit(self.NUMBER, len(self.constants) - 1)
+            elif cls is Identifier:
+                index = self.emit(self.IDENTIFIER, self.intern(node.name))
+            elif cls is BinaryOp:
+                index = self.emit(self.BINARY, index_of[id(node.left)], index_of[id(node.right)], self.intern(node.op))
+            elif cls is FunctionCall:
+                index = self.emit(self.CALL, self.intern(node.name), self.add_list([index_of[id(arg)] for arg in node.args]), node.tail)
+            elif cls is FunctionDef:
+                params = self.add_list([self.intern(param) for param in node.params])
+                index = self.emit(self.FUNCTION, self.intern(node.name), params, index_of[id(node.body)])
+            elif cls is IfStatement:
+                index = self.emit(self.IF, index_of[id(node.condition)], index_of[id(node.then_branch)], index_of[id(node.else_branch)])
+            elif cls is Extern:
+                index = self.emit(self.EXTERN, self.intern(node.name), self.add_list([self.intern(param) for param in node.params]))
+            else:
+                raise ValueError(f'Unknown AST node {node!r}')
+            index_of[id(node)] = index
+        self.roots.append(index)
+        return index
+
+    @staticmethod
+    def children(node):
+        cls = node.__class__
+        if cls is BinaryOp:
+            return (node.left, node.right)
+        if cls is FunctionCall:
+            return node.args
+        if cls is FunctionDef:
+            return (node.body,)
+        if cls is IfStatement:
+            return (node.condition, node.then_branch, node.else_branch)
+        return ()
+
+    def get_list(self, offset):
+        count = self.extra[offset]
+        return self.extra[offset + 1:offset + 1 + count]
+
+    def to_tree(self, root=None):
+        # Rebuilds the object tree of one root (the last one added by default); children
+        # have lower indices, so visiting the subtree in index order builds them first
+        if root is None:
+            root = self.roots[-1]
+        names = self.names
+        kinds, a, b, c = self.kinds, self.a, self.b, self.c
+        nodes = {}
+        for index in sorted(set(self.subtree(root))):
+            kind = kinds[index]
+            if kind == self.NUMBER:
+                node = Number(self.constants[a[index]])
+            elif kind == self.IDENTIFIER:
+                node = Identifier(names[a[index]])
+            elif kind == self.BINARY:
+                node = BinaryOp(nodes[a[index]], names[c[index]], nodes[b[index]])
+            elif kind == self.CALL:
+                node = FunctionCall(names[a[index]], [nodes[arg] for arg in self.get_list(b[index])], bool(c[index]))
+            elif kind == self.FUNCTION:
+                node = FunctionDef(names[a[index]], [names[param] for param in self.get_list(b[index])], nodes[c[index]])
+            elif kind == self.IF:
+                node = IfStatement(nodes[a[index]], nodes[b[index]], nodes[c[index]])
+            else:
+                node = Extern(names[a[index]], [names[param] for param in self.get_list(b[index])])
+            nodes[index] = node
+        return nodes[root]
+
+    def subtree(self, root):
+        # Node indices of the tree under root
+        kinds, a, b, c = self.kinds, self.a, self.b, self.c
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            yield index
+            kind = kinds[index]
+            if kind == self.BINARY:
+                stack.append(a[index])
+                stack.append(b[index])
+            elif kind == self.CALL:
+                stack.extend(self.get_list(b[index]))
+            elif kind == self.FUNCTION:
+                stack.append(c[index])
+            elif kind == self.IF:
+                stack.append(a[index])
+                stack.append(b[index])
+                stack.append(c[index])
+
+    def depths(self):
+        # Height of every node, in one forward loop over the arrays
+        kinds, a, b, c, extra = self.kinds, self.a, self.b, self.c, self.extra
+        BINARY, CALL, FUNCTION, IF = self.BINARY, self.CALL, self.FUNCTION, self.IF
+        depth = array('i', bytes(4 * len(kinds)))
+        for index, kind in enumerate(kinds):
+            if kind == BINARY:
+                depth[index] = max(depth[a[index]], depth[b[index]]) + 1
+            elif kind == IF:
+                depth[index] = max(depth[a[index]], depth[b[index]], depth[c[index]]) + 1
+            elif kind == FUNCTION:
+                depth[index] = depth[c[index]] + 1
+            elif kind == CALL:
+                offset = b[index]
+                deepest = 0
+                for arg in extra[offset + 1:offset + 1 + extra[offset]]:
+                    deepest = max(deepest, depth[arg])
+                depth[index] = deepest + 1
+            else:
+                depth[index] = 1
+        return depth
+
+def fold_binary(op, left, right):
+    # Value of a binary operator on two constants; None where it must stay a run-time error
+    if op == '+':
+        return left + right
+    if op == '-':
+        return left - right
+    if op == '*':
+        return left * right
+    if op == '/':
+        return left / right if right != 0.0 else None
+    if op == '<':
+        return 1.0 if left < right else 0.0
+    if op == '>':
+        return 1.0 if left > right else 0.0
+    return None
+
+def count_nodes(tree):
+    # Distinct node objects, so subtrees shared after hash-consing count once
+    seen = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            stack.extend(ASTArena.children(node))
+    return len(seen)
+
+class ASTPass:
+    # Rebuilds a tree bottom-up: visit_<class name> methods receive a node whose children
+    # were already visited and return its replacement. Nodes are never changed in place,
+    # as after hash-consing one node can appear in several places; each distinct node is
+    # visited once per run.
+    def run(self, tree):
+        self.visited = {}
+        return self.visit(tree)
+
+    def visit(self, node):
+        # visited keeps node itself alive as well, so its id cannot be reused during the run
+        entry = self.visited.get(id(node))
+        if entry is not None:
+            return entry[1]
+        result = self.visit_children(node)
+        method = getattr(self, 'visit_' + result.__class__.__name__, None)
+        if method is not None:
+            result = method(result)
+        self.visited[id(node)] = (node, result)
+        return result
+
+    def visit_children(self, node):
+        cls = node.__class__
+        if cls is BinaryOp:
+            left, right = self.visit(node.left), self.visit(node.right)
+            if left is not node.left or right is not node.right:
+                return BinaryOp(left, node.op, right)
+        elif cls is FunctionCall:
+            args = [self.visit(arg) for arg in node.args]
+            if any(new is not old for new, old in zip(args, node.args)):
+                return FunctionCall(node.name, args, node.tail)
+        elif cls is FunctionDef:
+            body = self.visit(node.body)
+            if body is not node.body:
+                return FunctionDef(node.name, node.params, body)
+        elif cls is IfStatement:
+            condition = self.visit(node.condition)
+            then_branch = self.visit(node.then_branch)
+            else_branch = self.visit(node.else_branch)
+            if condition is not node.condition or then_branch is not node.then_branch or else_branch is not node.else_branch:
+                return IfStatement(condition, then_branch, else_branch)
+        return node
+
+class ConstantFolding(ASTPass):
+    def visit_BinaryOp(self, node):
+        if node.left.__class__ is Number and node.right.__class__ is Number:
+            value = fold_binary(node.op, node.left.value, node.right.value)
+            if value is not None:
+                return Number(value)
+        return node
+
+class DeadBranchElimination(ASTPass):
+    def visit_IfStatement(self, node):
+        if node.condition.__class__ is Number:
+            return node.then_branch if node.condition.value != 0.0 else node.else_branch
+        return node
+
+class CommonSubexpressions(ASTPass):
+    # Hash-consing: structurally equal subtrees become one shared node. Children are
+    # consed first, so a node's key only needs the identity of its children.
+    def run(self, tree):
+        self.table = {}
+        return super().run(tree)
+
+    def cons(self, key, node):
+        return self.table.setdefault(key, node)
+
+    def visit_Number(self, node):
+        # -0.0 == 0.0, but the two must stay apart
+        return self.cons((Number, node.value, math.copysign(1.0, node.value)), node)
+
+    def visit_Identifier(self, node):
+        return self.cons((Identifier, node.name), node)
+
+    def visit_BinaryOp(self, node):
+        return self.cons((BinaryOp, id(node.left), node.op, id(node.right)), node)
+
+    def visit_FunctionCall(self, node):
+        return self.cons((FunctionCall, node.name, node.tail) + tuple(map(id, node.args)), node)
+
+    def visit_IfStatement(self, node):
+        return self.cons((IfStatement, id(node.condition), id(node.then_branch), id(node.else_branch)), node)
+
+class TailCallMarking(ASTPass):
+    # Marks the calls a function body returns directly; the marked node is a copy, since
+    # the same call may also be shared by a non-tail position
+    def run(self, tree):
+        if tree.__class__ is not FunctionDef:
+            return tree
+        body = self.mark(tree.body)
+        return tree if body is tree.body else FunctionDef(tree.name, tree.params, body)
+
+    def mark(self, node):
+        cls = node.__class__
+        if cls is FunctionCall and not node.tail:
+            return FunctionCall(node.name, node.args, True)
+        if cls is IfStatement:
+            then_branch = self.mark(node.then_branch)
+            else_branch = self.mark(node.else_branch)
+            if then_branch is not node.then_branch or else_branch is not node.else_branch:
+                return IfStatement(node.condition, then_branch, else_branch)
+        return node
+
+class PassManager:
+    # Runs passes in order over one tree at a time; report holds (pass name, seconds,
+    # nodes removed) for each pass of the last run only, and totals sums them per pass
+    # name, so a long-lived manager keeps a fixed amount of both. Folding runs again after
+    # dead branches are removed, since a removed if can leave constant operands behind.
+    def __init__(self, passes=None):
+        if passes is None:
+            passes = [ConstantFolding(), DeadBranchElimination(), ConstantFolding(),
+                      CommonSubexpressions(), TailCallMarking()]
+        self.passes = passes
+        self.report = []
+        self.totals = {}
+
+    def run(self, tree):
+        self.report = []
+        for optimization in self.passes:
+            before = count_nodes(tree)
+            started = time.perf_counter()
+            tree = optimization.run(tree)
+            elapsed = time.perf_counter() - started
+            name = optimization.__class__.__name__
+            removed = before - count_nodes(tree)
+            self.report.append((name, elapsed, removed))
+            seconds, nodes = self.totals.get(name, (0.0, 0))
+            self.totals[name] = (seconds + elapsed, nodes + removed)
+        return tree
+
+    def summary(self):
+        # Totals per pass over every tree run so far
+        return dict(self.totals)
+
 class Parser:
     def __init__(self, lexer):
         self.lexer = lexer
@@ -168,11 +692,50 @@ class Parser:
         if self.current_token.type == token_type:
             self.current_token = self.lexer.get_next_token()
         else:
-            raise Exception(f'Unexpected token {self.current_token.type}, expected {token_type}')
+            raise ParseError(f'Unexpected token {self.current_token.type}, expected {token_type}', self.current_token)
 
     def parse(self):
         return self.parse_function()
 
+    def parse_program(self):
+        # Yields each top-level def, extern or expression as soon as it is complete, so only
+        # one item's AST is alive at a time. A syntax error is recorded in self.errors and
+        # parsing resumes at the next def or extern.
+        self.errors = []
+        while self.current_token.type != TokenType.EOF:
+            start = self.current_token
+            try:
+                item = self.parse_top_level()
+            except ParseError as error:
+                self.errors.append(error)
+                self.synchronize(start)
+                continue
+            yield item
+
+    def synchronize(self, start):
+        # Skips to the next def/extern, but always past the token the failed item started at
+        if self.current_token is start:
+            self.current_token = self.lexer.get_next_token()
+        while self.current_token.type not in (TokenType.DEF, TokenType.EXTERN, TokenType.EOF):
+            self.current_token = self.lexer.get_next_token()
+
+    def parse_top_level(self):
+        if self.current_token.type == TokenType.DEF:
+            return self.parse_function()
+        elif self.current_token.type == TokenType.EXTERN:
+            return self.parse_extern()
+        else:
+            return self.parse_expression()
+
+    def parse_extern(self):
+        self.eat(TokenType.EXTERN)
+        name = self.current_token.value
+        self.eat(TokenType.IDENTIFIER)
+        self.eat(TokenType.LPAREN)
+        params = self.parse_params()
+        self.eat(TokenType.RPAREN)
+        return Extern(name, params)
+
     def parse_function(self):
         self.eat(TokenType.DEF)
         name = self.current_token.value
@@ -209,19 +772,20 @@ class Parser:
         else_branch = self.parse_expression()
         return IfStatement(condition, then_branch, else_branch)
 
-    def parse_term(self):
+    def parse_term(self, min_precedence=0):
+        # Precedence climbing: operands of tighter operators are parsed by the recursive call
         node = self.parse_factor()
-        while self.current_token.type == TokenType.OPERATOR and self.current_token.value in ('+', '-', '*', '/'):
+        while self.current_token.type == TokenType.OPERATOR and BINARY_PRECEDENCE[self.current_token.value] >= min_precedence:
             op = self.current_token.value
             self.eat(TokenType.OPERATOR)
-            node = BinaryOp(node, op, self.parse_factor())
+            node = BinaryOp(node, op, self.parse_term(BINARY_PRECEDENCE[op] + 1))
         return node
 
     def parse_factor(self):
         token = self.current_token
         if token.type == TokenType.NUMBER:
             self.eat(TokenType.NUMBER)
-            return Number(token.value)
+            return Number(float(token.value))
         elif token.type == TokenType.IDENTIFIER:
             self.eat(TokenType.IDENTIFIER)
             if self.current_token.type == TokenType.LPAREN:
@@ -233,6 +797,10 @@ class Parser:
             node = self.parse_expression()
             self.eat(TokenType.RPAREN)
             return node
+        elif token.type == TokenType.ERROR:
+            raise ParseError(f'Invalid token {token.value!r}', token)
+        else:
+            raise ParseError(f'Unexpected token {token.type} in expression', token)
 
     def parse_function_call(self, name):
         self.eat(TokenType.LPAREN)
@@ -245,8 +813,934 @@ class Parser:
         self.eat(TokenType.RPAREN)
         return FunctionCall(name, args)
 
-# Example usage:
-text = """
+# The Parser grammar in LL(1) form. Upper-case names are non-terminals, TokenType members
+# are terminals and '@' names are TableParser actions that build the AST on a value stack.
+# Terms are a flat Factor (OPERATOR Factor)* list; the actions apply operator precedence.
+LL1_GRAMMAR = {
+    'Function': [(TokenType.DEF, TokenType.IDENTIFIER, TokenType.LPAREN, '@mark', 'Params', TokenType.RPAREN, 'Expr', '@function')],
+    'Params': [(TokenType.IDENTIFIER, 'ParamsTail'), ()],
+    'ParamsTail': [(TokenType.COMMA, TokenType.IDENTIFIER, 'ParamsTail'), ()],
+    'Expr': [(TokenType.IF, 'Expr', TokenType.THEN, 'Expr', TokenType.ELSE, 'Expr', '@if_statement'), ('Term',)],
+    'Term': [('@begin_term', 'Factor', 'TermTail', '@end_term')],
+    'TermTail': [(TokenType.OPERATOR, '@operator', 'Factor', 'TermTail'), ()],
+    'Factor': [(TokenType.NUMBER, '@number'), (TokenType.IDENTIFIER, 'Call'), (TokenType.LPAREN, 'Expr', TokenType.RPAREN)],
+    'Call': [(TokenType.LPAREN, '@mark', 'Args', TokenType.RPAREN, '@call'), ('@identifier',)],
+    'Args': [('Expr', 'ArgsTail'), ()],
+    'ArgsTail': [(TokenType.COMMA, 'Expr', 'ArgsTail'), ()],
+}
+
+def build_ll1_table(grammar, start):
+    # {non-terminal: {token type: production}}; a conflict raises ValueError. Actions are
+    # invisible to FIRST/FOLLOW. The ε-production of a non-terminal, if any, is also stored
+    # under None and used for tokens without an entry, as the recursive Parser stops there too.
+    def symbols_of(production):
+        return [symbol for symbol in production if not (isinstance(symbol, str) and symbol.startswith('@'))]
+
+    nullable = set()
+    first = {non_terminal: set() for non_terminal in grammar}
+    follow = {non_terminal: set() for non_terminal in grammar}
+    follow[start].add(TokenType.EOF)
+
+    def sequence_first(symbols):
+        result = set()
+        for symbol in symbols:
+            if isinstance(symbol, TokenType):
+                result.add(symbol)
+                return result, False
+            result |= first[symbol]
+            if symbol not in nullable:
+                return result, False
+        return result, True
+
+    changed = True
+    while changed:
+        changed = False
+        for non_terminal, productions in grammar.items():
+            for production in productions:
+                symbols = symbols_of(production)
+                result, empty = sequence_first(symbols)
+                if not result <= first[non_terminal] or (empty and non_terminal not in nullable):
+                    first[non_terminal] |= result
+                    if empty:
+                        nullable.add(non_terminal)
+                    changed = True
+                trailer = set(follow[non_terminal])
+                for symbol in reversed(symbols):
+                    if isinstance(symbol, TokenType):
+                        trailer = {symbol}
+                        continue
+                    if not trailer <= follow[symbol]:
+                        follow[symbol] |= trailer
+                        changed = True
+                    trailer = trailer | first[symbol] if symbol in nullable else set(first[symbol])
+
+    table = {}
+    for non_terminal, productions in grammar.items():
+        row = table[non_terminal] = {}
+        for production in productions:
+            result, empty = sequence_first(symbols_of(production))
+            if empty:
+                result |= follow[non_terminal]
+                row[None] = production
+            for token_type in result:
+                if token_type in row and row[token_type] is not production:
+                    raise ValueError(f"LL(1) conflict in {non_terminal} on {token_type}")
+                row[token_type] = production
+    return table
+
+LL1_TABLE = build_ll1_table(LL1_GRAMMAR, 'Function')
+
+class TableParser:
+    # Same interface and AST as Parser, driven by LL1_TABLE with explicit stacks instead of
+    # recursion, so nesting depth is bounded by memory only. Each term keeps its operators
+    # on a shared operator stack above a None marker and reduces them by precedence.
+    VALUE_TOKENS = {TokenType.IDENTIFIER, TokenType.NUMBER, TokenType.OPERATOR}
+
+    def __init__(self, lexer, table=LL1_TABLE):
+        self.lexer = lexer
+        self.current_token = self.lexer.get_next_token()
+        self.marker = object()
+        self.expected = {}
+        # Productions are stored reversed with the actions bound, ready to be pushed. Rows
+        # are filled for every token type, so a step is a single lookup; a missing entry
+        # without an ε-production holds None and raises.
+        self.table = {}
+        for non_terminal, row in table.items():
+            default = self.compile_production(row[None]) if None in row else None
+            self.table[non_terminal] = {token_type: self.compile_production(row[token_type]) if token_type in row else default
+                                        for token_type in TokenType}
+            self.expected[non_terminal] = sorted(token_type.name for token_type in row if token_type is not None)
+
+    def compile_production(self, production):
+        return [getattr(self, symbol[1:]) if isinstance(symbol, str) and symbol.startswith('@') else symbol
+                for symbol in reversed(production)]
+
+    def parse(self, start='Function'):
+        table = self.table
+        value_tokens = self.VALUE_TOKENS
+        next_token = self.lexer.get_next_token
+        token = self.current_token
+        self.values = values = []
+        self.operators = []
+        stack = [start]
+        while stack:
+            symbol = stack.pop()
+            kind = symbol.__class__
+            if kind is TokenType:
+                if token.type != symbol:
+                    raise ParseError(f'Unexpected token {token.type}, expected {symbol}', token)
+                if symbol in value_tokens:
+                    values.append(token.value)
+                token = next_token()
+            elif kind is str:
+                production = table[symbol][token.type]
+                if production is None:
+                    raise ParseError(f'Unexpected token {token.type} in {symbol}, expected one of {self.expected[symbol]}', token)
+                stack.extend(production)
+            else:
+                symbol()
+        self.current_token = token
+        return values.pop()
+
+    def marked(self):
+        # Pops everything above the last mark
+        values = self.values
+        index = len(values) - 1
+        while values[index] is not self.marker:
+            index -= 1
+        items = values[index + 1:]
+        del values[index:]
+        return items
+
+    def function(self):
+        body = self.values.pop()
+        params = self.marked()
+        self.values[-1] = FunctionDef(self.values[-1], params, body)
+
+    def call(self):
+        args = self.marked()
+        self.values[-1] = FunctionCall(self.values[-1], args)
+
+    def identifier(self):
+        self.values[-1] = Identifier(self.values[-1])
+
+    def number(self):
+        self.values[-1] = Number(float(self.values[-1]))
+
+    def mark(self):
+        self.values.append(self.marker)
+
+    def begin_term(self):
+        self.operators.append(None)
+
+    def operator(self):
+        # Operators of at least the new one's precedence are applied before it is pushed
+        values = self.values
+        operators = self.operators
+        op = values.pop()
+        precedence = BINARY_PRECEDENCE[op]
+        while operators[-1] is not None and BINARY_PRECEDENCE[operators[-1]] >= precedence:
+            right = values.pop()
+            values[-1] = BinaryOp(values[-1], operators.pop(), right)
+        operators.append(op)
+
+    def end_term(self):
+        values = self.values
+        operators = self.operators
+        while operators[-1] is not None:
+            right = values.pop()
+            values[-1] = BinaryOp(values[-1], operators.pop(), right)
+        operators.pop()
+
+    def if_statement(self):
+        values = self.values
+        else_branch = values.pop()
+        then_branch = values.pop()
+        values[-1] = IfStatement(values[-1], then_branch, else_branch)
+
+# Python callables known to be free of side effects
+PURE_FUNCTIONS = set()
+
+def pure(function):
+    # Marks a Python function usable from the language as free of side effects
+    PURE_FUNCTIONS.add(function)
+    return function
+
+def _printd(x):
+    print(x)
+    return 0.0
+
+# Functions an 'extern' declaration can bind to
+BUILTINS = {
+    'sin': pure(math.sin),
+    'cos': pure(math.cos),
+    'sqrt': pure(math.sqrt),
+    'exp': pure(math.exp),
+    'log': pure(math.log),
+    'fabs': pure(math.fabs),
+    'printd': _printd,
+}
+
+def evaluate_tree(node, env, functions):
+    # Reference tree walk: env maps parameter names to values, functions maps names to
+    # FunctionDef nodes or Python callables
+    cls = node.__class__
+    if cls is Number:
+        return node.value
+    if cls is Identifier:
+        return env[node.name]
+    if cls is BinaryOp:
+        left = evaluate_tree(node.left, env, functions)
+        right = evaluate_tree(node.right, env, functions)
+        if node.op == '+':
+            return left + right
+        if node.op == '-':
+            return left - right
+        if node.op == '*':
+            return left * right
+        if node.op == '/':
+            return left / right
+        if node.op == '<':
+            return 1.0 if left < right else 0.0
+        return 1.0 if left > right else 0.0
+    if cls is IfStatement:
+        if evaluate_tree(node.condition, env, functions) != 0.0:
+            return evaluate_tree(node.then_branch, env, functions)
+        return evaluate_tree(node.else_branch, env, functions)
+    if cls is FunctionCall:
+        function = functions[node.name]
+        args = [evaluate_tree(arg, env, functions) for arg in node.args]
+        if isinstance(function, FunctionDef):
+            return evaluate_tree(function.body, dict(zip(function.params, args)), functions)
+        return function(*args)
+    raise ValueError(f'Cannot evaluate {node!r}')
+
+class Interpreter:
+    # Each FunctionDef is compiled once into nested closures that take the argument tuple;
+    # calls go through a one-element cell per name, so functions may be defined in any
+    # order and redefined. Functions defined with pure=True are checked to call only pure
+    # functions and are wrapped in an LRU cache of cache_size entries. callers maps a name
+    # to the memoized functions that call it, so redefining it clears their caches.
+    def __init__(self, builtins=None, cache_size=4096):
+        self.builtins = BUILTINS if builtins is None else builtins
+        self.cache_size = cache_size
+        self.cells = {}
+        self.pure_functions = set()
+        self.callees = {}
+        self.callers = {}
+        self.symbols = {}
+
+    def cell(self, name):
+        cell = self.cells.get(name)
+        if cell is None:
+            def undefined(*args):
+                raise NameError(f'Unknown function {name}')
+            cell = self.cells[name] = [undefined]
+        return cell
+
+    def run(self, text, pure=()):
+        # Defines and evaluates every top-level item; returns the values of the expressions
+        parser = Parser(TokenReplay(Lexer(text, self.symbols).stream()))
+        results = []
+        for item in parser.parse_program():
+            if isinstance(item, FunctionDef):
+                self.define(item, item.name in pure)
+            elif isinstance(item, Extern):
+                self.declare(item)
+            else:
+                results.append(self.evaluate(item))
+        if parser.errors:
+            raise parser.errors[0]
+        return results
+
+    def declare(self, extern):
+        function = self.builtins.get(extern.name)
+        if function is None:
+            raise NameError(f'Unknown extern {extern.name}')
+        self.unlink(extern.name)
+        self.cell(extern.name)[0] = function
+        if function in PURE_FUNCTIONS:
+            self.pure_functions.add(extern.name)
+        else:
+            self.pure_functions.discard(extern.name)
+        self.invalidate(extern.name)
+
+    def define(self, function_def, pure=False):
+        name = function_def.name
+        if pure:
+            impure = self.impure_calls(function_def.body, name)
+            if impure:
+                raise ValueError(f'{name} cannot be pure, it calls {", ".join(sorted(impure))}')
+        body = self.compile(function_def.body, {param: i for i, param in enumerate(function_def.params)})
+        arity = len(function_def.params)
+
+        def function(*args):
+            if len(args) != arity:
+                raise TypeError(f'{name} takes {arity} arguments, got {len(args)}')
+            return body(args)
+
+        self.unlink(name)
+        if pure:
+            function = functools.lru_cache(maxsize=self.cache_size)(function)
+            self.pure_functions.add(name)
+            self.callees[name] = self.calls(function_def.body) - {name}
+            for callee in self.callees[name]:
+                self.callers.setdefault(callee, set()).add(name)
+        else:
+            self.pure_functions.discard(name)
+        self.cell(name)[0] = function
+        self.invalidate(name)
+        return function
+
+    def unlink(self, name):
+        # Forgets what the memoized function name called, before name is replaced
+        for callee in self.callees.pop(name, ()):
+            self.callers[callee].discard(name)
+
+    def invalidate(self, name):
+        # name was just redefined: every memoized function that reaches it drops its cached
+        # results, and those that now reach an impure function stop being memoized
+        affected = set()
+        stack = [name]
+        while stack:
+            for caller in self.callers.get(stack.pop(), ()):
+                if caller not in affected:
+                    affected.add(caller)
+                    stack.append(caller)
+        for caller in affected:
+            self.cells[caller][0].cache_clear()
+        impure = set()
+        changed = True
+        while changed:
+            changed = False
+            for caller in affected - impure:
+                if not self.callees[caller] <= self.pure_functions:
+                    impure.add(caller)
+                    self.pure_functions.discard(caller)
+                    changed = True
+        for caller in impure:
+            self.cells[caller][0] = self.cells[caller][0].__wrapped__
+            self.unlink(caller)
+
+    def calls(self, body):
+        names = set()
+        stack = [body]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, FunctionCall):
+                names.add(node.name)
+            stack.extend(ASTArena.children(node))
+        return names
+
+    def impure_calls(self, body, name):
+        impure = set()
+        stack = [body]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, FunctionCall) and node.name != name and node.name not in self.pure_functions:
+                impure.add(node.name)
+            stack.extend(ASTArena.children(node))
+        return impure
+
+    def evaluate(self, node):
+        return self.compile(node, {})(())
+
+    def compile(self, node, params):
+        # Returns a closure env -> value; the tree is walked once here, never at run time
+        cls = node.__class__
+        if cls is Number:
+            value = node.value
+            return lambda env: value
+        if cls is Identifier:
+            if node.name not in params:
+                raise NameError(f'Unknown variable {node.name}')
+            index = params[node.name]
+            return lambda env: env[index]
+        if cls is BinaryOp:
+            left = self.compile(node.left, params)
+            right = self.compile(node.right, params)
+            op = node.op
+            if op == '+':
+                return lambda env: left(env) + right(env)
+            if op == '-':
+                return lambda env: left(env) - right(env)
+            if op == '*':
+                return lambda env: left(env) * right(env)
+            if op == '/':
+                return lambda env: left(env) / right(env)
+            if op == '<':
+                return lambda env: 1.0 if left(env) < right(env) else 0.0
+            if op == '>':
+                return lambda env: 1.0 if left(env) > right(env) else 0.0
+            raise ValueError(f'Unknown operator {op}')
+        if cls is IfStatement:
+            condition = self.compile(node.condition, params)
+            then_branch = self.compile(node.then_branch, params)
+            else_branch = self.compile(node.else_branch, params)
+            return lambda env: then_branch(env) if condition(env) != 0.0 else else_branch(env)
+        if cls is FunctionCall:
+            cell = self.cell(node.name)
+            args = [self.compile(arg, params) for arg in node.args]
+            if len(args) == 1:
+                arg, = args
+                return lambda env: cell[0](arg(env))
+            if len(args) == 2:
+                first, second = args
+                return lambda env: cell[0](first(env), second(env))
+            return lambda env: cell[0](*[arg(env) for arg in args])
+        raise ValueError(f'Cannot compile {node!r}')
+
+class BytecodeVM:
+    # Functions compile to one shared array('i') of variable-length instructions, an opcode
+    # followed by its operands. Values, arguments and temporaries share one preallocated
+    # stack; a call's return address and frame base go into preallocated arrays.
+    #   CONST k                 push constants[k]
+    #   LOAD i                  push argument i of the current frame
+    #   ADD .. GT               pop two values, push the result
+    #   ADD_CONST .. DIV_CONST k   replace the top value v with v op constants[k]
+    #   JUMP t                  continue at t
+    #   JUMP_IF_FALSE t         pop a value, continue at t if it is 0.0
+    #   JUMP_IF_NOT_LT t        pop two values, continue at t unless left < right (GT alike)
+    #   CALL f n                call function slot f with the top n values as arguments
+    #   TAIL_CALL f n           CALL that reuses the current frame for a bytecode function
+    #   RETURN                  pop the result, drop the frame and push the result
+    # LABEL only exists while a function is compiled, as a jump target.
+    (CONST, LOAD, ADD, SUB, MUL, DIV, LT, GT, ADD_CONST, SUB_CONST, MUL_CONST, DIV_CONST,
+     JUMP, JUMP_IF_FALSE, JUMP_IF_NOT_LT, JUMP_IF_NOT_GT, CALL, RETURN, TAIL_CALL, LABEL) = range(20)
+    OPCODE_NAMES = ('CONST', 'LOAD', 'ADD', 'SUB', 'MUL', 'DIV', 'LT', 'GT', 'ADD_CONST',
+                    'SUB_CONST', 'MUL_CONST', 'DIV_CONST', 'JUMP', 'JUMP_IF_FALSE',
+                    'JUMP_IF_NOT_LT', 'JUMP_IF_NOT_GT', 'CALL', 'RETURN', 'TAIL_CALL', 'LABEL')
+    OPERAND_COUNTS = (1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 2, 0, 2, 1)
+    BINARY_OPCODES = {'+': ADD, '-': SUB, '*': MUL, '/': DIV, '<': LT, '>': GT}
+    CONSTANT_OPCODES = {ADD: ADD_CONST, SUB: SUB_CONST, MUL: MUL_CONST, DIV: DIV_CONST}
+    JUMPS = {JUMP, JUMP_IF_FALSE, JUMP_IF_NOT_LT, JUMP_IF_NOT_GT}
+
+    def __init__(self, builtins=None, stack_size=1 << 16, max_depth=1 << 14, optimizer=None):
+        # optimizer, a PassManager, rewrites every tree before it is compiled
+        self.builtins = BUILTINS if builtins is None else builtins
+        self.optimizer = optimizer
+        self.code = array('i')
+        self.constants = []
+        self.constant_ids = {}
+        # Per function slot: entry and end address (-1 when not bytecode), arity, stack
+        # needed beyond the arguments, and the Python callable bound by an extern
+        self.names = []
+        self.slots = {}
+        self.entries = array('i')
+        self.ends = array('i')
+        self.arities = array('i')
+        self.frame_sizes = array('i')
+        self.natives = []
+        self.stack = [0.0] * stack_size
+        self.return_addresses = array('i', bytes(4 * max_depth))
+        self.frame_bases = array('i', bytes(4 * max_depth))
+        self.symbols = {}
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+            self.entries.append(-1)
+            self.ends.append(-1)
+            self.arities.append(0)
+            self.frame_sizes.append(0)
+            self.natives.append(None)
+        return slot
+
+    def constant(self, value):
+        # 0.0 and -0.0 compare equal but must stay separate constants
+        key = (value, math.copysign(1.0, value))
+        index = self.constant_ids.get(key)
+        if index is None:
+            index = self.constant_ids[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def run(self, text):
+        # Defines and evaluates every top-level item; returns the values of the expressions
+        parser = Parser(TokenReplay(Lexer(text, self.symbols).stream()))
+        results = []
+        for item in parser.parse_program():
+            if isinstance(item, FunctionDef):
+                self.define(item)
+            elif isinstance(item, Extern):
+                self.declare(item)
+            else:
+                results.append(self.evaluate(item))
+        if parser.errors:
+            raise parser.errors[0]
+        return results
+
+    def declare(self, extern):
+        function = self.builtins.get(extern.name)
+        if function is None:
+            raise NameError(f'Unknown extern {extern.name}')
+        slot = self.slot(extern.name)
+        self.entries[slot] = -1
+        self.ends[slot] = -1
+        self.natives[slot] = function
+
+    def define(self, function_def):
+        # A redefinition appends new code; calls already compiled go through the slot
+        if self.optimizer is not None:
+            function_def = self.optimizer.run(function_def)
+        entry = self.add_function(function_def.body, function_def.params)
+        slot = self.slot(function_def.name)
+        self.entries[slot] = entry
+        self.ends[slot] = len(self.code)
+        self.arities[slot] = len(function_def.params)
+        self.frame_sizes[slot] = self.stack_needed(function_def.body)
+        self.natives[slot] = None
+        return entry
+
+    def evaluate(self, node):
+        if self.optimizer is not None:
+            node = self.optimizer.run(node)
+        if self.stack_needed(node) > len(self.stack):
+            raise RecursionError('Expression too large for the VM stack')
+        return self.execute(self.add_function(node, []))
+
+    def add_function(self, body, params):
+        instructions = []
+        self.label_count = 0
+        self.compile(body, {param: i for i, param in enumerate(params)}, instructions)
+        instructions.append([self.RETURN])
+        return self.assemble(instructions)
+
+    def stack_needed(self, node):
+        # Most values node pushes at once while it is evaluated
+        cls = node.__class__
+        if cls is BinaryOp:
+            return max(self.stack_needed(node.left), 1 + self.stack_needed(node.right))
+        if cls is IfStatement:
+            return max(self.stack_needed(node.condition), self.stack_needed(node.then_branch), self.stack_needed(node.else_branch))
+        if cls is FunctionCall:
+            return max([i + self.stack_needed(arg) for i, arg in enumerate(node.args)] + [1])
+        return 1
+
+    def compile(self, node, params, instructions):
+        # Emits [opcode, operands...] lists; constant folding and the fusion of comparisons
+        # and constant operands happen here, as each instruction is appended
+        cls = node.__class__
+        if cls is Number:
+            instructions.append([self.CONST, self.constant(node.value)])
+        elif cls is Identifier:
+            if node.name not in params:
+                raise NameError(f'Unknown variable {node.name}')
+            instructions.append([self.LOAD, params[node.name]])
+        elif cls is BinaryOp:
+            if node.op not in self.BINARY_OPCODES:
+                raise ValueError(f'Unknown operator {node.op}')
+            self.compile(node.left, params, instructions)
+            self.compile(node.right, params, instructions)
+            self.emit_binary(self.BINARY_OPCODES[node.op], instructions)
+        elif cls is IfStatement:
+            self.compile(node.condition, params, instructions)
+            last = instructions[-1]
+            if last[0] == self.CONST:
+                # Constant condition: only the branch taken is compiled
+                instructions.pop()
+                branch = node.then_branch if self.constants[last[1]] != 0.0 else node.else_branch
+                self.compile(branch, params, instructions)
+                return
+            else_label = self.new_label()
+            end_label = self.new_label()
+            if last[0] == self.LT:
+                instructions[-1] = [self.JUMP_IF_NOT_LT, else_label]
+            elif last[0] == self.GT:
+                instructions[-1] = [self.JUMP_IF_NOT_GT, else_label]
+            else:
+                instructions.append([self.JUMP_IF_FALSE, else_label])
+            self.compile(node.then_branch, params, instructions)
+            instructions.append([self.JUMP, end_label])
+            instructions.append([self.LABEL, else_label])
+            self.compile(node.else_branch, params, instructions)
+            instructions.append([self.LABEL, end_label])
+        elif cls is FunctionCall:
+            for arg in node.args:
+                self.compile(arg, params, instructions)
+            instructions.append([self.TAIL_CALL if node.tail else self.CALL, self.slot(node.name), len(node.args)])
+        else:
+            raise ValueError(f'Cannot compile {node!r}')
+
+    def new_label(self):
+        self.label_count += 1
+        return self.label_count
+
+    def emit_binary(self, opcode, instructions):
+        right = instructions[-1]
+        left = instructions[-2]
+        if right[0] == self.CONST and left[0] == self.CONST:
+            value = self.fold(opcode, self.constants[left[1]], self.constants[right[1]])
+            if value is not None:
+                del instructions[-1]
+                instructions[-1] = [self.CONST, self.constant(value)]
+                return
+        if right[0] == self.CONST and opcode in self.CONSTANT_OPCODES:
+            instructions[-1] = [self.CONSTANT_OPCODES[opcode], right[1]]
+            return
+        instructions.append([opcode])
+
+    def fold(self, opcode, left, right):
+        # None leaves the operation to run time, where dividing by zero raises
+        if opcode == self.ADD:
+            return left + right
+        if opcode == self.SUB:
+            return left - right
+        if opcode == self.MUL:
+            return left * right
+        if opcode == self.DIV:
+            return left / right if right != 0.0 else None
+        if opcode == self.LT:
+            return 1.0 if left < right else 0.0
+        return 1.0 if left > right else 0.0
+
+    def assemble(self, instructions):
+        # Peephole pass over the finished function, then encoding into self.code:
+        # jumps to jumps are threaded to the final target, a jump to a RETURN becomes a
+        # RETURN, and unreachable code and jumps to the next instruction are dropped
+        LABEL, JUMP, RETURN = self.LABEL, self.JUMP, self.RETURN
+        targets = {}
+        pending = []
+        for i, instruction in enumerate(instructions):
+            if instruction[0] == LABEL:
+                pending.append(instruction[1])
+            else:
+                for label in pending:
+                    targets[label] = i
+                pending = []
+
+        for instruction in instructions:
+            if instruction[0] in self.JUMPS:
+                label = instruction[1]
+                seen = set()
+                while instructions[targets[label]][0] == JUMP and label not in seen:
+                    seen.add(label)
+                    label = instructions[targets[label]][1]
+                instruction[1] = label
+                if instruction[0] == JUMP and instructions[targets[label]][0] == RETURN:
+                    instruction[:] = [RETURN]
+
+        used = {instruction[1] for instruction in instructions if instruction[0] in self.JUMPS}
+        kept = []
+        reachable = True
+        for instruction in instructions:
+            if instruction[0] == LABEL:
+                if instruction[1] in used:
+                    reachable = True
+                    kept.append(instruction)
+            elif reachable:
+                kept.append(instruction)
+                if instruction[0] == JUMP or instruction[0] == RETURN:
+                    reachable = False
+        instructions = [instruction for i, instruction in enumerate(kept)
+                        if not (instruction[0] == JUMP and self.falls_into(kept, i + 1, instruction[1]))]
+
+        address = entry = len(self.code)
+        addresses = {}
+        for instruction in instructions:
+            if instruction[0] == LABEL:
+                addresses[instruction[1]] = address
+            else:
+                address += len(instruction)
+        for instruction in instructions:
+            if instruction[0] == LABEL:
+                continue
+            if instruction[0] in self.JUMPS:
+                instruction = [instruction[0], addresses[instruction[1]]]
+            self.code.extend(instruction)
+        return entry
+
+    def falls_into(self, instructions, i, label):
+        # Whether the labels starting at instructions[i] include label
+        while i < len(instructions) and instructions[i][0] == self.LABEL:
+            if instructions[i][1] == label:
+                return True
+            i += 1
+        return False
+
+    def execute(self, entry):
+        code = self.code
+        constants = self.constants
+        stack = self.stack
+        entries, arities, frame_sizes, natives = self.entries, self.arities, self.frame_sizes, self.natives
+        return_addresses, frame_bases = self.return_addresses, self.frame_bases
+        max_depth = len(return_addresses)
+        stack_size = len(stack)
+        (CONST, LOAD, ADD, SUB, MUL, DIV, LT, GT, ADD_CONST, SUB_CONST, MUL_CONST, DIV_CONST,
+         JUMP, JUMP_IF_FALSE, JUMP_IF_NOT_LT, JUMP_IF_NOT_GT, CALL, RETURN, TAIL_CALL) = range(19)
+        pc = entry
+        sp = 0
+        fp = 0
+        depth = 0
+        # Tests are ordered roughly by how often each opcode runs
+        while True:
+            op = code[pc]
+            if op == LOAD:
+                stack[sp] = stack[fp + code[pc + 1]]
+                sp += 1
+                pc += 2
+            elif op == CALL:
+                slot = code[pc + 1]
+                count = code[pc + 2]
+                pc += 3
+                start = entries[slot]
+                if start >= 0:
+                    if count != arities[slot]:
+                        raise TypeError(f'{self.names[slot]} takes {arities[slot]} arguments, got {count}')
+                    if depth == max_depth or sp + frame_sizes[slot] > stack_size:
+                        raise RecursionError('Maximum VM call depth exceeded')
+                    return_addresses[depth] = pc
+                    frame_bases[depth] = fp
+                    depth += 1
+                    fp = sp - count
+                    pc = start
+                else:
+                    function = natives[slot]
+                    if function is None:
+                        raise NameError(f'Unknown function {self.names[slot]}')
+                    sp -= count
+                    stack[sp] = function(*stack[sp:sp + count])
+                    sp += 1
+            elif op == RETURN:
+                if depth == 0:
+                    return stack[sp - 1]
+                depth -= 1
+                stack[fp] = stack[sp - 1]
+                sp = fp + 1
+                fp = frame_bases[depth]
+                pc = return_addresses[depth]
+            elif op == TAIL_CALL:
+                slot = code[pc + 1]
+                count = code[pc + 2]
+                pc += 3
+                start = entries[slot]
+                if start >= 0:
+                    if count != arities[slot]:
+                        raise TypeError(f'{self.names[slot]} takes {arities[slot]} arguments, got {count}')
+                    if fp + count + frame_sizes[slot] > stack_size:
+                        raise RecursionError('Maximum VM call depth exceeded')
+                    # The arguments replace the caller's; the RETURN after this is skipped
+                    stack[fp:fp + count] = stack[sp - count:sp]
+                    sp = fp + count
+                    pc = start
+                else:
+                    function = natives[slot]
+                    if function is None:
+                        raise NameError(f'Unknown function {self.names[slot]}')
+                    sp -= count
+                    stack[sp] = function(*stack[sp:sp + count])
+                    sp += 1
+            elif op == CONST:
+                stack[sp] = constants[code[pc + 1]]
+                sp += 1
+                pc += 2
+            elif op == JUMP_IF_NOT_LT:
+                sp -= 2
+                pc = pc + 2 if stack[sp] < stack[sp + 1] else code[pc + 1]
+            elif op == SUB_CONST:
+                stack[sp - 1] -= constants[code[pc + 1]]
+                pc += 2
+            elif op == ADD:
+                sp -= 1
+                stack[sp - 1] += stack[sp]
+                pc += 1
+            elif op == ADD_CONST:
+                stack[sp - 1] += constants[code[pc + 1]]
+                pc += 2
+            elif op == SUB:
+                sp -= 1
+                stack[sp - 1] -= stack[sp]
+                pc += 1
+            elif op == MUL:
+                sp -= 1
+                stack[sp - 1] *= stack[sp]
+                pc += 1
+            elif op == MUL_CONST:
+                stack[sp - 1] *= constants[code[pc + 1]]
+                pc += 2
+            elif op == JUMP:
+                pc = code[pc + 1]
+            elif op == JUMP_IF_NOT_GT:
+                sp -= 2
+                pc = pc + 2 if stack[sp] > stack[sp + 1] else code[pc + 1]
+            elif op == JUMP_IF_FALSE:
+                sp -= 1
+                pc = pc + 2 if stack[sp] != 0.0 else code[pc + 1]
+            elif op == DIV:
+                sp -= 1
+                stack[sp - 1] /= stack[sp]
+                pc += 1
+            elif op == DIV_CONST:
+                stack[sp - 1] /= constants[code[pc + 1]]
+                pc += 2
+            elif op == LT:
+                sp -= 1
+                stack[sp - 1] = 1.0 if stack[sp - 1] < stack[sp] else 0.0
+                pc += 1
+            elif op == GT:
+                sp -= 1
+                stack[sp - 1] = 1.0 if stack[sp - 1] > stack[sp] else 0.0
+                pc += 1
+            else:
+                raise ValueError(f'Bad opcode {op} at {pc}')
+
+    def disassemble(self, name):
+        # One line per instruction of a defined function
+        slot = self.slots[name]
+        pc = self.entries[slot]
+        lines = []
+        while pc < self.ends[slot]:
+            op = self.code[pc]
+            operands = list(self.code[pc + 1:pc + 1 + self.OPERAND_COUNTS[op]])
+            text = f'{pc:5} {self.OPCODE_NAMES[op]}'
+            if op == self.CONST or op in self.CONSTANT_OPCODES.values():
+                text += f' {self.constants[operands[0]]}'
+            elif op == self.CALL or op == self.TAIL_CALL:
+                text += f' {self.names[operands[0]]} {operands[1]}'
+            elif operands:
+                text += f' {operands[0]}'
+            lines.append(text)
+            pc += 1 + len(operands)
+        return lines
+
+def benchmark_fib(n=22, repeat=3):
+    # Best-of-repeat seconds for fib(n) with the tree walk, the closures and the VM
+    fib = Parser(Lexer("def fib(x) if x < 3 then 1 else fib(x-1)+fib(x-2)")).parse()
+    call = FunctionCall('fib', [Number(float(n))])
+    interpreter = Interpreter()
+    interpreter.define(fib)
+    vm = BytecodeVM()
+    vm.define(fib)
+    runs = (("tree walk", lambda: evaluate_tree(call, {}, {'fib': fib})),
+            ("closures", lambda: interpreter.evaluate(call)),
+            ("bytecode", lambda: vm.evaluate(call)))
+    results = {}
+    for name, run in runs:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    return results
+
+def generate_source(num_terms, depth=0, seed=0):
+    # A single definition whose body has num_terms factors, wrapped in depth parentheses
+    rng = random.Random(seed)
+    ops = list(BINARY_PRECEDENCE)
+    parts = []
+    for i in range(num_terms):
+        if i:
+            parts.append(rng.choice(ops))
+        kind = rng.random()
+        if kind < 0.4:
+            parts.append(str(rng.randint(0, 99)))
+        elif kind < 0.7:
+            parts.append(rng.choice(['x', 'y']))
+        elif kind < 0.9:
+            parts.append(f"g(x, {rng.randint(0, 9)})")
+        else:
+            parts.append("(if x then y else 1)")
+    return "def f(x, y)\n  " + "(" * depth + " ".join(parts) + ")" * depth + "\n"
+
+def read_tokens(text, symbols=None):
+    lexer = Lexer(text, symbols)
+    tokens = lexer.tokenize_fast()
+    tokens.append(Token(TokenType.EOF, None, lexer.count, lexer.source))
+    return tokens
+
+class TokenReplay:
+    # Feeds a token list or iterator to a parser in place of a Lexer; EOF repeats once it runs out
+    def __init__(self, tokens):
+        self.get_next_token = itertools.chain(tokens, itertools.repeat(Token(TokenType.EOF, None))).__next__
+
+def benchmark_lexer(text, repeat=3):
+    # Best-of-repeat tokens per second for the character loop and the regex scanner
+    results = {}
+    for name, run in (("tokenize", lambda: Lexer(text).tokenize()),
+                      ("tokenize_fast", lambda: Lexer(text).tokenize_fast())):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            count = len(run())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = count / best
+    return results
+
+def benchmark(text, repeat=3):
+    # Best-of-repeat tokens per second for each parser; None when a parser cannot finish
+    tokens = read_tokens(text)
+    results = {}
+    for name, parser_class in (("Parser", Parser), ("TableParser", TableParser)):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                parser_class(TokenReplay(tokens)).parse()
+            except RecursionError:
+                best = None
+                break
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = len(tokens) / best if best else None
+    return results
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as file:
+            source = file.read()
+        for name, rate in benchmark_lexer(source).items():
+            print(f"{name}: {rate:,.0f} tokens/s")
+        for name, rate in benchmark(source).items():
+            print(f"{name}: {rate:,.0f} tokens/s" if rate else f"{name}: recursion limit exceeded")
+        sys.exit()
+
+    # Example usage:
+    text = """
 def fib(x)
   if x < 3 then
     1
@@ -256,19 +1750,54 @@ def fib(x)
 fib(40)
 """
 
-lexer = Lexer(text)
-parser = Parser(lexer)
-
-# Debug: Print tokens
-print("Tokens:")
-while True:
-    token = lexer.get_next_token()
-    if token.type == TokenType.EOF:
-        break
-    print(token)
-
-# Reinitialize lexer for parsing
-lexer = Lexer(text)
-parser = Parser(lexer)
-ast = parser.parse()
-print(ast)
\ No newline at end of file
+    lexer = Lexer(text)
+    parser = Parser(lexer)
+
+    # Debug: Print tokens
+    print("Tokens:")
+    while True:
+        token = lexer.get_next_token()
+        if token.type == TokenType.EOF:
+            break
+        print(f"{token.line}:{token.column}", token)
+
+    # Reinitialize lexer for parsing
+    lexer = Lexer(text)
+    parser = Parser(lexer)
+    ast = parser.parse()
+    print(ast)
+
+    # Same AST from the table-driven parser
+    print(TableParser(Lexer(text)).parse())
+
+    # Every top-level item, including the fib(40) call
+    parser = Parser(Lexer(text))
+    for item in parser.parse_program():
+        print(item)
+    for error in parser.errors:
+        print(f"Error: {error}")
+
+    # Syntax errors point at the offending token
+    parser = Parser(Lexer("def f(x) x +\nf(1..2)\nextern g(1)\n"))
+    for item in parser.parse_program():
+        print(item)
+    for error in parser.errors:
+        print(f"Error: {error}")
+
+    # Run it: fib is compiled to closures once and memoized as a pure function
+    started = time.perf_counter()
+    print("Results:", Interpreter().run(text, pure={'fib'}), f"in {time.perf_counter() - started:.4f}s")
+
+    # fib on the bytecode VM, and against the other evaluators
+    vm = BytecodeVM()
+    vm.define(ast)
+    print("\n".join(vm.disassemble("fib")))
+    print("VM fib(20):", vm.run("fib(20)"))
+    for name, seconds in benchmark_fib().items():
+        print(f"fib(22) {name}: {seconds:.4f}s")
+
+    # Optimizer passes on a function with constant and repeated subexpressions
+    optimizer = PassManager()
+    print(optimizer.run(Parser(Lexer("def f(x) (x*x+1)*(x*x+1) + (if 2 > 1 then 3 * 4 else f(x-1))")).parse()))
+    for name, seconds, removed in optimizer.report:
+        print(f"{name}: {removed} nodes removed in {seconds * 1e6:.0f} us")
@@ -0,0 +1,85 @@
+import hashlib
+import mmap
+import os
+
+
+# Compiled artifacts shared by the labs: Lab_2 automata, Lab_4 regex DFAs and Lab_5 CNF
+# grammars. Each lab adds the repository root to sys.path to import this module.
+class ArtifactCache:
+    # Content-addressed store: an artifact lives in directory/<sha256 of its key>.bin and is
+    # read back through mmap. File modification times order entries for LRU eviction; a
+    # hit touches the file, and store() removes the least recently used files until the
+    # directory fits in max_bytes.
+    def __init__(self, directory, max_bytes=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.bin')
+
+    def load(self, key, decode):
+        # decode() of the mapped entry, or None. An entry decode rejects with ValueError
+        # (truncated or corrupt) is a miss and is removed, so the next store replaces it.
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # missing, evicted meanwhile, or empty
+            self.misses += 1
+            return None
+        try:
+            artifact = decode(data)
+        except ValueError:
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:  # already replaced, or still mapped where that forbids removing it
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:  # evicted since it was mapped; the mapping is still valid
+            pass
+        self.hits += 1
+        return artifact
+
+    def store(self, key, data):
+        # Written under a temporary name first, so readers never see a partial file
+        path = self.path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.bin'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # still mapped on platforms that forbid removing it
+                continue
+            total -= size
+
+
+def grammar_key(grammar, kind):
+    # Canonical text of a grammar: its symbols sorted by name with their terminal flags, the
+    # start symbol and its rules sorted by left-hand and right-hand side names, so the same
+    # grammar hashes alike in whatever order its symbols and productions were written down
+    names = grammar.symbols.names
+    symbols = sorted(zip(names, grammar.symbols.terminal))
+    rules = sorted({(names[lhs], tuple(names[symbol] for symbol in rhs))
+                    for lhs, rhs in zip(grammar.rule_lhs, grammar.rule_rhs) if rhs is not None})
+    return repr((kind, 2, grammar.start, symbols, rules))